@@ -0,0 +1,277 @@
+'''Headless JSON query API over the trial datasets, without Streamlit.
+
+Usage:
+    python api.py                              # serve the GCS datasets on 127.0.0.1:8080
+    python api.py --storage ./bucket --port 8081
+
+Endpoints (GET), with dataset = medication | device:
+    /health
+    /metrics                                   # Prometheus text of the stage timings
+    /v1/{dataset}/search                       # paginated rows matching the search
+    /v1/{dataset}/top?column=Sponsor&n=10      # top n entities among the rows matching the search
+    /v1/{dataset}/trials/{id}                  # rows with this trial ID
+    /v1/{dataset}/suggest?column=Sponsor&q=ㅅㅈ  # typeahead, as on the search forms
+
+The search parameters are the inputs of the search forms: sponsor, site and title (medication),
+manufacturer, device_id and title (device), date_from and date_to. /search also takes page,
+page_size, sort (comma separated columns), descending and columns (comma separated).
+
+The datasets are loaded once at startup, with every index, and checked for a new GCS version every
+API_REFRESH_SECONDS in the background. Searches share the query cache with every request.
+'''
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import ceil
+from urllib.parse import parse_qs, unquote, urlparse
+
+import pandas as pd
+
+from module.constants import *
+from module.storage import open_storage
+from module.datasets import TrialDataset, get_result_page_row_ids, load_device_dataset, load_medication_dataset
+from module.search import parse_date_range
+from module.query_cache import search_cached
+from module.autocomplete import suggest
+from module.metrics import record, to_prometheus
+
+API_DATASETS = {
+    'medication': {
+        'load': load_medication_dataset,
+        'query_params': {'sponsor': 'Sponsor', 'site': 'Site', 'title': 'Protocol Title'},
+        'id_columns': ['Clinical Trial ID'],
+    },
+    'device': {
+        'load': load_device_dataset,
+        'query_params': {'manufacturer': 'Manufacturer', 'device_id': 'Device ID', 'title': 'Protocol Title'},
+        'id_columns': MEDICAL_DEVICE_STUDY_KEY_COLUMN_NAME,
+    },
+}
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+def build_id_index(dataset: TrialDataset, id_columns: list) -> dict:
+    '''Map every trial ID in the ID columns to its row ids.'''
+
+    id_index = {}
+    for column in id_columns:
+        if column in dataset.dataframe:
+            for trial_id, row_ids in dataset.dataframe.groupby(column, observed=True, sort=False).indices.items():
+                id_index.setdefault(str(trial_id), []).extend(row_ids.tolist())
+    return id_index
+
+class QueryService:
+    '''The datasets the API serves, kept loaded in memory along with their ID indexes.
+
+    refresh() reloads a dataset only when its stored version changed and swaps it in whole, so a
+    request always sees one consistent version. A failed refresh keeps the last loaded one.'''
+
+    def __init__(self, conn, refresh_seconds: float = API_REFRESH_SECONDS) -> None:
+        self.conn = conn
+        self.refresh_seconds = refresh_seconds
+        # name: (dataset, id_index)
+        self.datasets = {}
+
+    def refresh(self) -> None:
+        for name, spec in API_DATASETS.items():
+            dataset = spec['load'](self.conn)
+            loaded = self.datasets.get(name)
+            if loaded is None or loaded[0] is not dataset:
+                self.datasets[name] = (dataset, build_id_index(dataset, spec['id_columns']))
+
+    def refresh_forever(self) -> None:
+        while True:
+            time.sleep(self.refresh_seconds)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f'Refresh failed, still serving the loaded versions: {e!r}', file=sys.stderr)
+
+    def start(self) -> 'QueryService':
+        '''Load every dataset, then keep checking for new versions in the background.'''
+
+        self.refresh()
+        threading.Thread(target=self.refresh_forever, daemon=True).start()
+        return self
+
+    def get(self, name: str) -> tuple[TrialDataset, dict]:
+        if name not in self.datasets:
+            raise ApiError(404, f'Unknown dataset {name!r}, expected one of {list(API_DATASETS)}.')
+        return self.datasets[name]
+
+def get_int(params: dict, name: str, default: int, minimum: int = 1, maximum: int = None) -> int:
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise ApiError(400, f'{name} must be an integer.')
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ApiError(400, f'{name} must be between {minimum} and {maximum}.' if maximum is not None else f'{name} must be at least {minimum}.')
+    return value
+
+def get_columns(params: dict, name: str, dataset: TrialDataset, default: list) -> list:
+    if not params.get(name):
+        return default
+    columns = [column.strip() for column in params[name].split(',') if column.strip()]
+    unknown_columns = [column for column in columns if column not in dataset.dataframe]
+    if unknown_columns:
+        raise ApiError(400, f'Unknown columns {unknown_columns}.')
+    return columns
+
+def get_search(name: str, params: dict) -> tuple[dict, tuple[int, int]]:
+    '''Return the search_cached queries and date range of the request.'''
+
+    queries = {column: params.get(param, '') for param, column in API_DATASETS[name]['query_params'].items()}
+    try:
+        date_range = parse_date_range(params.get('date_from', ''), params.get('date_to', ''))
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    return queries, date_range
+
+def to_records(dataframe: pd.DataFrame) -> list:
+    '''Rows as JSON-ready dicts, missing values as null.'''
+
+    # pandas' JSON writer is several times faster than converting the cells to Python objects
+    return json.loads(dataframe.to_json(orient='records', force_ascii=False))
+
+def search(service: QueryService, name: str, params: dict) -> dict:
+    dataset, _ = service.get(name)
+    queries, date_range = get_search(name, params)
+    page = get_int(params, 'page', 1)
+    page_size = get_int(params, 'page_size', API_DEFAULT_PAGE_SIZE, maximum=API_MAX_PAGE_SIZE)
+    columns = get_columns(params, 'columns', dataset, list(dataset.dataframe.columns))
+    sort_columns = get_columns(params, 'sort', dataset, [])
+    descending = params.get('descending', '').lower() in ('1', 'true')
+
+    result = search_cached(dataset, queries, date_range=date_range)
+    # The matches are sorted once per result and sort order, each request only serializes its page
+    row_ids = get_result_page_row_ids(dataset, result, sort_columns, descending, page, page_size)
+    return {
+        'dataset': name,
+        'version': dataset.version,
+        'total': int(result.row_ids.shape[0]),
+        'page': page,
+        'page_size': page_size,
+        'num_of_pages': max(ceil(result.row_ids.shape[0] / page_size), 1),
+        'rows': to_records(dataset.dataframe.iloc[row_ids][columns]),
+    }
+
+def top(service: QueryService, name: str, params: dict) -> dict:
+    dataset, _ = service.get(name)
+    column = params.get('column', '')
+    if column not in dataset.entity_index:
+        raise ApiError(400, f'column must be one of {list(dataset.entity_index)}.')
+    n = get_int(params, 'n', 10, maximum=API_MAX_TOP_N)
+    queries, date_range = get_search(name, params)
+
+    result = search_cached(dataset, queries, date_range=date_range, n=n)
+    # Most trials first, top_entities counts in ascending order
+    entities = result.top_entities[column].iloc[::-1]
+    return {
+        'dataset': name,
+        'version': dataset.version,
+        'total': int(result.row_ids.shape[0]),
+        'column': column,
+        'entities': [{'name': str(entity), 'count': int(count)} for entity, count in entities.itertuples(index=False)],
+    }
+
+def trial(service: QueryService, name: str, trial_id: str) -> dict:
+    dataset, id_index = service.get(name)
+    row_ids = id_index.get(trial_id)
+    if not row_ids:
+        raise ApiError(404, f'No {name} trial with ID {trial_id!r}.')
+    return {'dataset': name, 'version': dataset.version, 'rows': to_records(dataset.dataframe.iloc[row_ids])}
+
+def suggestions(service: QueryService, name: str, params: dict) -> dict:
+    dataset, _ = service.get(name)
+    column = params.get('column', '')
+    if column not in dataset.suggestion_index:
+        raise ApiError(400, f'column must be one of {list(dataset.suggestion_index)}.')
+    limit = get_int(params, 'limit', SUGGESTION_LIMIT, maximum=API_MAX_TOP_N)
+    return {
+        'dataset': name,
+        'column': column,
+        'suggestions': [{'name': entity, 'count': count} for entity, count in suggest(dataset.suggestion_index[column], params.get('q', ''), limit)],
+    }
+
+def route(service: QueryService, path: str, params: dict) -> tuple[str, dict]:
+    '''Return the endpoint name and the JSON body of a request path.'''
+
+    parts = [unquote(part) for part in path.strip('/').split('/')]
+    if parts == ['health']:
+        return 'health', {'status': 'ok', 'versions': {name: dataset.version for name, (dataset, _) in service.datasets.items()}}
+    if len(parts) == 3 and parts[0] == 'v1' and parts[2] == 'search':
+        return 'search', search(service, parts[1], params)
+    if len(parts) == 3 and parts[0] == 'v1' and parts[2] == 'top':
+        return 'top', top(service, parts[1], params)
+    if len(parts) == 3 and parts[0] == 'v1' and parts[2] == 'suggest':
+        return 'suggest', suggestions(service, parts[1], params)
+    if len(parts) == 4 and parts[0] == 'v1' and parts[2] == 'trials':
+        return 'trials', trial(service, parts[1], parts[3])
+    raise ApiError(404, f'Unknown path {path!r}.')
+
+def make_server(service: QueryService, host: str = API_HOST, port: int = API_PORT) -> ThreadingHTTPServer:
+    '''HTTP server answering from the service, one thread per connection (kept alive between requests).'''
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are separate writes, Nagle would hold the body for the client's delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def send_body(self, status: int, body: bytes, content_type: str) -> None:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            parsed_url = urlparse(self.path)
+            if parsed_url.path == '/metrics':
+                self.send_body(200, to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+                return None
+
+            params = {key: values[0] for key, values in parse_qs(parsed_url.query).items()}
+            start_time = time.perf_counter()
+            status, endpoint = 200, 'error'
+            try:
+                endpoint, body = route(service, parsed_url.path, params)
+            except ApiError as e:
+                status, body = e.status, {'error': str(e)}
+            except Exception as e:
+                status, body = 500, {'error': repr(e)}
+            # One histogram per endpoint, failed requests under api.error
+            record(f'api.{endpoint}', time.perf_counter() - start_time)
+            self.send_body(status, json.dumps(body, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--storage', default='gcs', help="'gcs' or a local directory standing in for the bucket.")
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--refresh-seconds', type=float, default=API_REFRESH_SECONDS, help='How often to check for a new dataset version.')
+    args = parser.parse_args()
+
+    service = QueryService(open_storage(args.storage), refresh_seconds=args.refresh_seconds).start()
+    server = make_server(service, args.host, args.port)
+    print(f'Serving {list(service.datasets)} on http://{args.host}:{server.server_port}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+'''Measure the p50/p99 latency of api.py at a given request rate.
+
+Run from the repository root:
+    python -m benchmarks.bench_api --rows 100000 --requests 5000 --concurrency 16 --rate 500
+api.py is started in its own process over a temporary bucket holding synthetic catalogs, then
+a mix of searches, top-n counts, ID lookups and suggestions is sent from `concurrency` connections.
+With --rate the requests are sent on a fixed schedule and every latency is counted from the
+request's scheduled time, so a server falling behind shows up in the percentiles; without it every
+connection sends its next request as soon as the last one returns.
+'''
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlencode
+
+import numpy as np
+
+from module.constants import *
+from module.storage import get_dataset_path, open_storage, update_data
+from benchmarks.synthetic import DEVICE_MANUFACTURERS, DISEASES, REGIONS, SPONSOR_PREFIXES, make_device_dataframe, make_medication_dataframe
+
+def reserve_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def make_requests(medication_ids: list, device_ids: list, num_of_requests: int, seed: int) -> list:
+    '''Return (endpoint, path) pairs: 60% searches, 15% top-n, 15% ID lookups and 10% suggestions.'''
+
+    random_generator = random.Random(seed)
+    requests = []
+    for _ in range(num_of_requests):
+        draw = random_generator.random()
+        if draw < 0.6:
+            if random_generator.random() < 0.8:
+                params = {
+                    'sponsor': random_generator.choice(SPONSOR_PREFIXES) if random_generator.random() < 0.6 else '',
+                    'site': random_generator.choice(REGIONS) if random_generator.random() < 0.4 else '',
+                    'title': random_generator.choice(DISEASES) if random_generator.random() < 0.5 else '',
+                    'date_from': str(random_generator.randint(2012, 2025)) if random_generator.random() < 0.3 else '',
+                    'page': random_generator.randint(1, 3),
+                    'sort': 'IND Approval Date' if random_generator.random() < 0.3 else '',
+                }
+                requests.append(('search', f'/v1/medication/search?{urlencode(params)}'))
+            else:
+                params = {'manufacturer': random_generator.choice(DEVICE_MANUFACTURERS), 'page': 1}
+                requests.append(('search', f'/v1/device/search?{urlencode(params)}'))
+        elif draw < 0.75:
+            params = {
+                'column': random_generator.choice(['Sponsor', 'Site']),
+                'title': random_generator.choice(DISEASES) if random_generator.random() < 0.5 else '',
+            }
+            requests.append(('top', f'/v1/medication/top?{urlencode(params)}'))
+        elif draw < 0.9:
+            if random_generator.random() < 0.8:
+                requests.append(('trials', f'/v1/medication/trials/{quote(random_generator.choice(medication_ids))}'))
+            else:
+                requests.append(('trials', f'/v1/device/trials/{quote(random_generator.choice(device_ids))}'))
+        else:
+            prefix = random_generator.choice(SPONSOR_PREFIXES)[:random_generator.randint(1, 2)]
+            requests.append(('suggest', f'/v1/medication/suggest?{urlencode({"column": "Sponsor", "q": prefix})}'))
+    return requests
+
+def summarize(samples: list) -> dict:
+    seconds = np.array(samples)
+    return {
+        'count': int(seconds.shape[0]),
+        'p50_ms': round(float(np.percentile(seconds, 50)) * 1000, 3),
+        'p90_ms': round(float(np.percentile(seconds, 90)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(seconds, 99)) * 1000, 3),
+        'max_ms': round(float(seconds.max()) * 1000, 3),
+    }
+
+def run_load(port: int, requests: list, concurrency: int, rate: float = None) -> dict:
+    '''Send the requests from `concurrency` kept-alive connections and return the latencies per endpoint.'''
+
+    latencies = {}
+    num_of_errors = 0
+    next_index = 0
+    lock = threading.Lock()
+    start_time = time.perf_counter()
+
+    def worker() -> None:
+        nonlocal next_index, num_of_errors
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        while True:
+            with lock:
+                index = next_index
+                next_index += 1
+            if index >= len(requests):
+                break
+            endpoint, path = requests[index]
+            scheduled_time = start_time + index / rate if rate else time.perf_counter()
+            time.sleep(max(scheduled_time - time.perf_counter(), 0))
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            seconds = time.perf_counter() - scheduled_time
+            with lock:
+                latencies.setdefault(endpoint, []).append(seconds)
+                # A lookup of an ID the catalog does not have is a valid 404
+                num_of_errors += response.status >= 500 or (response.status >= 400 and endpoint != 'trials')
+        connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        'requests': len(requests),
+        'concurrency': concurrency,
+        'target_rate': rate,
+        'throughput': round(len(requests) / elapsed, 1),
+        'errors': num_of_errors,
+        'overall': summarize([seconds for samples in latencies.values() for seconds in samples]),
+        'endpoints': {endpoint: summarize(samples) for endpoint, samples in sorted(latencies.items())},
+    }
+
+def wait_until_ready(port: int, process: subprocess.Popen, timeout_seconds: float = 600) -> None:
+    deadline = time.time() + timeout_seconds
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'api.py exited with code {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                return None
+        except OSError:
+            time.sleep(0.5)
+    raise TimeoutError('api.py did not start in time')
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='Trials per synthetic catalog.')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rate', type=float, help='Requests per second to send on a fixed schedule.')
+    parser.add_argument('--warm-up', type=int, default=500, help='Requests sent (and not measured) before the run.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Also write the result as JSON here.')
+    args = parser.parse_args()
+
+    storage_dir = tempfile.mkdtemp(prefix='bench-api-')
+    conn = open_storage(storage_dir)
+    medication_dataframe = make_medication_dataframe(args.rows, seed=args.seed, realistic=True)
+    device_dataframe = make_device_dataframe(args.rows, seed=args.seed)
+    update_data(medication_dataframe, conn, get_dataset_path(MEDICATION_TRIAL_FILE_NAME))
+    update_data(device_dataframe, conn, get_dataset_path(DEVICE_TRIAL_FILE_NAME))
+
+    port = reserve_port()
+    process = subprocess.Popen(
+        [sys.executable, 'api.py', '--storage', storage_dir, '--port', str(port)],
+        # Snapshots of a throwaway bucket are not worth keeping
+        env={**os.environ, 'SNAPSHOT_DIR': ''},
+        )
+    try:
+        load_start = time.perf_counter()
+        wait_until_ready(port, process)
+        load_seconds = time.perf_counter() - load_start
+
+        medication_ids = medication_dataframe['Clinical Trial ID'].astype(str).tolist()
+        device_ids = device_dataframe['Clinical Trial Approval No'].astype(str).tolist()
+        run_load(port, make_requests(medication_ids, device_ids, args.warm_up, args.seed + 1), args.concurrency)
+        result = {
+            'rows': args.rows,
+            'startup_seconds': round(load_seconds, 3),
+            **run_load(port, make_requests(medication_ids, device_ids, args.requests, args.seed), args.concurrency, args.rate),
+        }
+    finally:
+        process.terminate()
+        process.wait()
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0 if result['errors'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+'''Compare peak RSS and wall time of the streaming JSONL decoder against the previous decoder.
+
+Run from the repository root:
+    python -m benchmarks.bench_decode --rows 50000
+Each decoder runs in its own process, so peak RSS is not shared between them.
+'''
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from module.constants import *
+from module.storage import decode_jsonl
+from benchmarks.synthetic import make_medication_dataframe
+
+def legacy_decoding_json_bytes(json_file) -> list:
+    '''The previous decoder: read everything, rewrite it into one JSON array and parse it at once.'''
+
+    json_bytes = '[' + json_file.read().decode('utf-8').replace('}\n{', '},{') + ']'
+
+    return json.loads(json_bytes)
+
+def legacy_decode(json_file) -> pd.DataFrame:
+    return pd.DataFrame(legacy_decoding_json_bytes(json_file))
+
+DECODERS = {
+    'legacy': legacy_decode,
+    'streaming': decode_jsonl,
+}
+
+def write_sample_jsonl(file_path: str, num_of_rows: int) -> None:
+    '''Write synthetic medication rows as line-delimited JSON.'''
+
+    with open(file_path, 'wb') as f:
+        make_medication_dataframe(num_of_rows).to_json(f, orient='records', lines=True, force_ascii=False)
+
+def get_peak_rss_kib() -> int:
+    '''Peak RSS of this process in KiB.
+    VmHWM is reset on exec, unlike ru_maxrss which keeps the parent's peak from fork time.'''
+
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_worker(decoder: str, file_path: str) -> None:
+    '''Decode the file once and print wall time and peak RSS growth as JSON.'''
+
+    baseline_rss = get_peak_rss_kib()
+    start_time = time.perf_counter()
+    with open(file_path, 'rb') as f:
+        dataframe = DECODERS[decoder](f)
+    elapsed = time.perf_counter() - start_time
+    peak_rss = get_peak_rss_kib()
+    print(json.dumps({
+        'decoder': decoder,
+        'rows': dataframe.shape[0],
+        'seconds': round(elapsed, 4),
+        'peak_rss_mib': round((peak_rss - baseline_rss) / 1024, 1),
+        'frame_mib': round(dataframe.memory_usage(deep=True).sum() / 1024 ** 2, 1),
+    }))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--worker', choices=list(DECODERS), help=argparse.SUPPRESS)
+    parser.add_argument('--file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.file)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix='.json') as sample_file:
+        write_sample_jsonl(sample_file.name, args.rows)
+        for decoder in DECODERS:
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_decode', '--worker', decoder, '--file', sample_file.name],
+                check=True, capture_output=True, text=True
+                ).stdout
+            print(output.strip())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+'''Print per-column memory of a trial frame before and after compact_dataframe.
+
+Run from the repository root:
+    python -m benchmarks.bench_memory --rows 50000
+'''
+import argparse
+
+import pandas as pd
+
+from module.datasets import compact_dataframe, memory_report
+from benchmarks.synthetic import make_medication_dataframe
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    args = parser.parse_args()
+
+    dataframe = make_medication_dataframe(args.rows)
+    with pd.option_context('display.width', 120):
+        print(memory_report(dataframe, compact_dataframe(dataframe)))
+
+if __name__ == '__main__':
+    main()
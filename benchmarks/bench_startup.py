@@ -0,0 +1,73 @@
+'''Check the cold-start import time of the app against its budget.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup --runs 5
+Every run imports what main.py imports in a fresh process. The check fails (exit code 1) if the
+median import time is over STARTUP_IMPORT_BUDGET_SECONDS or any of LAZY_MODULES was imported.
+tests/test_startup.py runs the same check under pytest.
+'''
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from module.constants import *
+
+def run_worker() -> None:
+    '''Import the app's modules once and print the wall time and the lazy modules loaded as JSON.'''
+
+    import streamlit.logger
+    streamlit.logger.set_log_level('error')
+
+    start_time = time.perf_counter()
+    import pytz
+    import pandas
+    import streamlit
+    import module.fragments
+    import module.utils
+    elapsed = time.perf_counter() - start_time
+    print(json.dumps({
+        'seconds': round(elapsed, 4),
+        'lazy_modules_loaded': [name for name in LAZY_MODULES if name in sys.modules],
+    }))
+
+def measure_startup(runs: int, budget: float = STARTUP_IMPORT_BUDGET_SECONDS) -> dict:
+    '''Import the app in `runs` fresh processes and return the timings, the lazy modules loaded and whether it passed.'''
+
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_startup', '--worker'],
+            check=True, capture_output=True, text=True
+            ).stdout
+        results.append(json.loads(output))
+
+    median_seconds = statistics.median(result['seconds'] for result in results)
+    lazy_modules_loaded = sorted({name for result in results for name in result['lazy_modules_loaded']})
+    return {
+        'runs': [result['seconds'] for result in results],
+        'median_seconds': median_seconds,
+        'budget_seconds': budget,
+        'lazy_modules_loaded': lazy_modules_loaded,
+        'passed': median_seconds <= budget and not lazy_modules_loaded,
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=STARTUP_IMPORT_BUDGET_SECONDS, help='Seconds allowed for the median run.')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker()
+        return 0
+
+    result = measure_startup(args.runs, args.budget)
+    print(json.dumps(result, indent=2))
+    return 0 if result['passed'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
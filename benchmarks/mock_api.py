@@ -0,0 +1,152 @@
+'''Local stand-in for the paginated apis.data.go.kr endpoints the app calls.
+
+Serves the medication and device trial lists (newest approval first, like the real API) and the
+medication details endpoint, with configurable latency and failure rate. Run it standalone and
+point the app or ingest.py at it:
+    python -m benchmarks.mock_api --rows 10000 --port 8765
+    MFDS_BASE_URL=http://127.0.0.1:8765/1471000 DECODED_API_KEY=benchmark python ingest.py --storage ./bucket
+'''
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from module.constants import *
+from benchmarks.synthetic import make_details_item, make_device_dataframe, make_medication_dataframe
+
+def get_endpoint_path(url: str) -> str:
+    '''Service and operation of an API URL, e.g. MdcinClincTestInfoService02/getMdcinClincTestInfoList02.'''
+
+    return '/'.join(urlparse(url).path.split('/')[-2:])
+
+class MockMFDSServer:
+    '''In-process HTTP server answering like the MFDS APIs, from DataFrames.
+
+    latency_seconds is added to every response, failure_rate is the share of requests answered
+    with HTTP 500. Trial lists are sorted newest approval first; prepend rows to add new trials.'''
+
+    def __init__(self, medication_dataframe: pd.DataFrame, device_dataframe: pd.DataFrame, latency_seconds: float = 0.0, failure_rate: float = 0.0, seed: int = 0, port: int = 0) -> None:
+        self.datasets = {}
+        self.sponsors = {}
+        self.set_dataset(MEDICATION_TRIAL_URL, medication_dataframe)
+        self.set_dataset(DEVICE_TRIAL_URL, device_dataframe)
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.random_generator = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.num_of_requests = 0
+        self.num_of_failures = 0
+
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                server.handle(self)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        '''Value for MFDS_BASE_URL.'''
+
+        return f'http://127.0.0.1:{self.httpd.server_port}{urlparse(BASE_URL).path}'
+
+    def set_dataset(self, url: str, dataframe: pd.DataFrame) -> None:
+        '''Replace the rows served for a trial list URL, sorted newest approval first.'''
+
+        dataframe = dataframe.sort_values('IND Approval Date', ascending=False, kind='stable')
+        self.datasets[get_endpoint_path(url)] = dataframe.to_dict(orient='records')
+        if url == MEDICATION_TRIAL_URL:
+            # The details endpoint answers for the medication trials being served
+            self.sponsors = dict(zip(dataframe['Clinical Trial ID'], dataframe['Sponsor']))
+
+    def handle(self, request: BaseHTTPRequestHandler) -> None:
+        with self.random_lock:
+            self.num_of_requests += 1
+            fail = self.random_generator.random() < self.failure_rate
+            self.num_of_failures += fail
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        if fail:
+            request.send_response(500)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return None
+
+        parsed_url = urlparse(request.path)
+        path = get_endpoint_path(request.path)
+        query = {key: values[0] for key, values in parse_qs(parsed_url.query).items()}
+        page_no = int(query.get('pageNo', 1))
+        num_of_rows = int(query.get('numOfRows', 10))
+
+        if path == get_endpoint_path(MEDICATION_DETAILS_URL):
+            trial_id = query.get('CLNC_TEST_SN', '')
+            items = [make_details_item(trial_id, self.sponsors[trial_id])] if trial_id in self.sponsors else []
+            total_count = len(items)
+        elif path in self.datasets:
+            rows = self.datasets[path]
+            items = rows[(page_no - 1) * num_of_rows:page_no * num_of_rows]
+            total_count = len(rows)
+        else:
+            request.send_response(404)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return None
+
+        body = json.dumps({
+            'header': {'resultCode': '00', 'resultMsg': 'NORMAL SERVICE.'},
+            'body': {'pageNo': page_no, 'totalCount': total_count, 'numOfRows': num_of_rows, 'items': items},
+        }, ensure_ascii=False).encode('utf-8')
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json;charset=UTF-8')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def start(self) -> 'MockMFDSServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> 'MockMFDSServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every response.')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of requests answered with HTTP 500.')
+    args = parser.parse_args()
+
+    server = MockMFDSServer(
+        make_medication_dataframe(args.rows, realistic=True),
+        make_device_dataframe(args.rows),
+        latency_seconds=args.latency,
+        failure_rate=args.failure_rate,
+        port=args.port,
+        )
+    print(f'Serving {args.rows} trials per dataset. Set MFDS_BASE_URL={server.base_url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
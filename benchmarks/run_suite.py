@@ -0,0 +1,300 @@
+'''Benchmark ingest, decode, search, aggregation and detail lookups as the catalogs grow.
+
+Run from the repository root:
+    python -m benchmarks.run_suite --scales 1 10 100 --base-rows 1000
+    python -m benchmarks.run_suite --benchmarks search aggregation --scales 1 10
+    python -m benchmarks.run_suite --compare benchmarks/results/A.json benchmarks/results/B.json
+
+The MFDS API is served by benchmarks.mock_api and the bucket is a temporary local directory,
+so nothing leaves the machine. Ingest goes through the real rate limiter, expect about
+base_rows * scale / 1000 seconds per dataset. Every run is saved under --output with a timestamp.
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+def reserve_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# module.constants reads MFDS_BASE_URL on import, so point it at the stand-in first
+MOCK_API_PORT = int(os.environ.get('MOCK_API_PORT') or reserve_port())
+os.environ['MFDS_BASE_URL'] = f'http://127.0.0.1:{MOCK_API_PORT}/1471000'
+os.environ.setdefault('DECODED_API_KEY', 'benchmark')
+
+import numpy as np
+import pandas as pd
+import streamlit.logger
+
+streamlit.logger.set_log_level('error')
+
+from module.utils import *
+from module.datasets import load_dataset
+from module.search import parse_date_range, search_dataframe
+from module.aggregates import top_entities
+from module.metrics import reset, snapshot
+from ingest import ConsoleStatus
+from benchmarks.mock_api import MockMFDSServer
+from benchmarks.synthetic import DISEASES, REGIONS, make_details_item, make_device_dataframe, make_medication_dataframe
+
+BENCHMARKS = ['ingest', 'decode', 'search', 'aggregation', 'details']
+
+class QuietStatus(ConsoleStatus):
+    '''ConsoleStatus that only keeps the messages.'''
+
+    def write(self, level: str, message: str) -> None:
+        self.messages.append(f'{level}: {message}')
+
+    def progress(self, value: float = 0, text: str = '') -> 'QuietStatus':
+        return self
+
+def time_call(function, *args, **kwargs) -> tuple:
+    '''Return the function's result and its wall time in seconds.'''
+
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+def summarize_seconds(samples: list) -> dict:
+    samples = np.asarray(samples)
+    return {
+        'count': int(samples.shape[0]),
+        'mean_seconds': float(samples.mean()),
+        'p50_seconds': float(np.percentile(samples, 50)),
+        'p95_seconds': float(np.percentile(samples, 95)),
+        'max_seconds': float(samples.max()),
+    }
+
+def make_catalogs(num_of_rows: int, num_of_new_rows: int, seed: int) -> tuple:
+    '''Return the medication and device catalogs, each with num_of_new_rows extra trials
+    approved after all the others, which the incremental ingest picks up.'''
+
+    catalogs = []
+    for dataframe in [make_medication_dataframe(num_of_rows + num_of_new_rows, seed=seed, realistic=True), make_device_dataframe(num_of_rows + num_of_new_rows, seed=seed)]:
+        dataframe.loc[dataframe.index[-num_of_new_rows:], 'IND Approval Date'] = '20260101'
+        catalogs.append(dataframe)
+    return tuple(catalogs)
+
+def benchmark_ingest(server: MockMFDSServer, fs, catalogs: tuple, num_of_new_rows: int) -> dict:
+    '''Full sync of both catalogs into an empty bucket, then an incremental sync after new trials were approved.'''
+
+    datasets = [
+        ('medication', MEDICATION_TRIAL_URL, MEDICATION_TRIAL_FILE_NAME, fetch_medication_trial_data),
+        ('device', DEVICE_TRIAL_URL, DEVICE_TRIAL_FILE_NAME, fetch_device_trial_data),
+    ]
+    output = {}
+    for (name, url, file_name, fetch_function), dataframe in zip(datasets, catalogs):
+        server.set_dataset(url, dataframe.iloc[:-num_of_new_rows])
+        num_of_requests = server.num_of_requests
+        (result, e), full_seconds = time_call(sync_data, fs, file_name, fetch_function, QuietStatus(name), full_refresh=True)
+        full_requests = server.num_of_requests - num_of_requests
+
+        server.set_dataset(url, dataframe)
+        num_of_requests = server.num_of_requests
+        (result, e), incremental_seconds = time_call(sync_data, fs, file_name, fetch_function, QuietStatus(name))
+        output[name] = {
+            'status': result.value,
+            'full_seconds': full_seconds,
+            'full_requests': full_requests,
+            'incremental_seconds': incremental_seconds,
+            'incremental_requests': server.num_of_requests - num_of_requests,
+            'stored_bytes': fs.size(get_dataset_path(file_name)),
+        }
+    return output
+
+def benchmark_decode(fs, dataframe: pd.DataFrame, repeat: int = 3) -> dict:
+    '''Write the catalog in every storage format and time reading it back.'''
+
+    output = {}
+    for file_format in FILE_EXTENSIONS:
+        file_path = get_dataset_path('benchmark_decode', file_format)
+        update_data(dataframe, fs, file_path, skip_unchanged=False)
+        samples = []
+        for _ in range(repeat):
+            with fs.open(file_path, 'rb') as f:
+                _, seconds = time_call(read_dataframe, f, file_format)
+            samples.append(seconds)
+        output[file_format] = {'bytes': fs.size(file_path), 'seconds': min(samples)}
+    return output
+
+def make_queries(dataframe: pd.DataFrame, num_of_queries: int, seed: int) -> list:
+    '''Random search inputs like users type them: short name fragments, regions, diseases and years.'''
+
+    random_generator = random.Random(seed)
+    sponsors = dataframe['Sponsor'].drop_duplicates().tolist()
+    queries = []
+    for _ in range(num_of_queries):
+        sponsor = random_generator.choice(sponsors)
+        queries.append(({
+            'Sponsor': sponsor[:random_generator.randint(1, 3)] if random_generator.random() < 0.6 else '',
+            'Site': random_generator.choice(REGIONS) if random_generator.random() < 0.4 else '',
+            'Protocol Title': random_generator.choice(DISEASES) if random_generator.random() < 0.5 else '',
+        }, parse_date_range(str(random_generator.randint(2012, 2025)), '') if random_generator.random() < 0.3 else None))
+    return queries
+
+def benchmark_search(fs, dataframe: pd.DataFrame, num_of_queries: int, seed: int) -> dict:
+    '''Time the cold dataset load (download and index build) and random searches over it.'''
+
+    update_data(dataframe, fs, get_dataset_path(MEDICATION_TRIAL_FILE_NAME))
+    dataset, load_seconds = time_call(
+        load_dataset, fs, MEDICATION_TRIAL_FILE_NAME,
+        search_columns=MEDICATION_STUDY_SEARCH_COLUMN_NAME, entity_columns=MEDICATION_STUDY_ENTITY_COLUMN_NAME,
+        )
+    samples, num_of_matches = [], []
+    for queries, date_range in make_queries(dataframe, num_of_queries, seed):
+        mask, seconds = time_call(search_dataframe, dataset, queries, date_range=date_range)
+        samples.append(seconds)
+        num_of_matches.append(int(mask.sum()))
+    return {'load_seconds': load_seconds, 'mean_matches': float(np.mean(num_of_matches)), **summarize_seconds(samples)}
+
+def benchmark_aggregation(fs, dataframe: pd.DataFrame, num_of_queries: int, seed: int) -> dict:
+    '''Time the Top 10 counts of every entity column over the whole catalog and over search results.'''
+
+    update_data(dataframe, fs, get_dataset_path(MEDICATION_TRIAL_FILE_NAME))
+    dataset = load_dataset(
+        fs, MEDICATION_TRIAL_FILE_NAME,
+        search_columns=MEDICATION_STUDY_SEARCH_COLUMN_NAME, entity_columns=MEDICATION_STUDY_ENTITY_COLUMN_NAME,
+        )
+    masks = [None] + [search_dataframe(dataset, queries, date_range=date_range) for queries, date_range in make_queries(dataframe, num_of_queries, seed)]
+    output = {}
+    for column, index in dataset.entity_index.items():
+        samples = [time_call(top_entities, index, mask, 10, column)[1] for mask in masks]
+        output[column] = {'entities': int(index.names.shape[0]), **summarize_seconds(samples)}
+    return output
+
+def benchmark_details(fs, dataframe: pd.DataFrame, num_of_lookups: int, seed: int) -> dict:
+    '''Look up details of random trials with half of them already in the detail store,
+    then look them up again once all of them are stored.'''
+
+    sample = dataframe.sample(n=min(num_of_lookups, dataframe.shape[0]), random_state=seed)[['Clinical Trial ID', 'Sponsor']]
+    stored = sample.iloc[:sample.shape[0] // 2]
+    update_detail_store(fs, make_details_dataframe([make_details_item(trial_id, sponsor) for trial_id, sponsor in stored.itertuples(index=False)]))
+
+    status = QuietStatus('details')
+    details, cold_seconds = time_call(fetch_medication_details_data, sample, fs, notify=status.toast)
+    _, warm_seconds = time_call(fetch_medication_details_data, sample, fs, notify=status.toast)
+    return {
+        'lookups': sample.shape[0],
+        'found': details.shape[0],
+        'cold_seconds': cold_seconds,
+        'warm_seconds': warm_seconds,
+        'store_bytes': fs.size(get_dataset_path(MEDICATION_DETAILS_FILE_NAME)),
+    }
+
+def run_scale(server: MockMFDSServer, scale: int, args) -> dict:
+    '''Run the selected benchmarks on a catalog of base_rows * scale trials in a fresh bucket.'''
+
+    num_of_rows = args.base_rows * scale
+    num_of_new_rows = max(num_of_rows // 100, 1)
+    catalogs = make_catalogs(num_of_rows, num_of_new_rows, args.seed)
+    medication_dataframe = catalogs[0].iloc[:-num_of_new_rows]
+    server.set_dataset(MEDICATION_TRIAL_URL, medication_dataframe)
+
+    output = {'rows': num_of_rows}
+    with tempfile.TemporaryDirectory() as bucket_dir:
+        fs = open_storage(bucket_dir)
+        for name in args.benchmarks:
+            reset()
+            print(f'[{scale}x] {name}...', file=sys.stderr)
+            if name == 'ingest':
+                output[name] = benchmark_ingest(server, fs, catalogs, num_of_new_rows)
+                server.set_dataset(MEDICATION_TRIAL_URL, medication_dataframe)
+            elif name == 'decode':
+                output[name] = benchmark_decode(fs, medication_dataframe)
+            elif name == 'search':
+                output[name] = benchmark_search(fs, medication_dataframe, args.queries, args.seed)
+            elif name == 'aggregation':
+                output[name] = benchmark_aggregation(fs, medication_dataframe, args.queries, args.seed)
+            elif name == 'details':
+                output[name] = benchmark_details(fs, medication_dataframe, args.detail_lookups, args.seed)
+            # Stage timings of the app's own spans during this benchmark
+            output[name]['stages'] = {stage: {key: summary[key] for key in ['count', 'total_seconds', 'p95_seconds', 'total_bytes']} for stage, summary in snapshot().items()}
+    return output
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def flatten(results: dict, prefix: str = '') -> dict:
+    '''Flatten nested results into {'10x.search.p95_seconds': value} for the numeric leaves.'''
+
+    output = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            output.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            output[f'{prefix}{key}'] = value
+    return output
+
+def compare(baseline_path: str, candidate_path: str) -> None:
+    '''Print the timings and sizes of two saved runs side by side.'''
+
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = flatten(json.load(f)['scales'])
+    with open(candidate_path, encoding='utf-8') as f:
+        candidate = flatten(json.load(f)['scales'])
+
+    rows = []
+    for key in baseline.keys() & candidate.keys():
+        if '.stages.' in key or not key.endswith(('seconds', 'bytes', 'requests')):
+            continue
+        change = (candidate[key] - baseline[key]) / baseline[key] * 100 if baseline[key] else float('nan')
+        rows.append([key, baseline[key], candidate[key], change])
+    comparison = pd.DataFrame(rows, columns=['metric', 'baseline', 'candidate', 'change %']).sort_values('metric')
+    with pd.option_context('display.width', 160, 'display.max_rows', None, 'display.float_format', '{:.4f}'.format):
+        print(comparison.to_string(index=False))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--base-rows', type=int, default=1000, help='Trials per catalog at 1x.')
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds the stand-in API adds to every response.')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of API requests answered with HTTP 500.')
+    parser.add_argument('--queries', type=int, default=200, help='Random searches per scale.')
+    parser.add_argument('--detail-lookups', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=os.path.join('benchmarks', 'results'))
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'), help='Compare two saved runs instead of running.')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    started_at = datetime.now()
+    results = {
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'git_commit': get_git_commit(),
+        'python': platform.python_version(),
+        'args': {key: value for key, value in vars(args).items() if key not in ['output', 'compare']},
+        'scales': {},
+    }
+    server = MockMFDSServer(pd.DataFrame(columns=MEDICATION_STUDY_COLUMN_NAME), pd.DataFrame(columns=MEDICAL_DEVICE_STUDY_COLUMN_NAME), args.latency, args.failure_rate, args.seed, MOCK_API_PORT)
+    with server:
+        for scale in args.scales:
+            results['scales'][f'{scale}x'] = run_scale(server, scale, args)
+    results['api_requests'] = server.num_of_requests
+    results['api_failures'] = server.num_of_failures
+
+    os.makedirs(args.output, exist_ok=True)
+    output_path = os.path.join(args.output, f'{started_at:%Y%m%d_%H%M%S}.json')
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    summary = {key: value for key, value in flatten(results['scales']).items() if '.stages.' not in key}
+    print(json.dumps(summary, indent=2))
+    print(f'Saved to {output_path}', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
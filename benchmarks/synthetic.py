@@ -0,0 +1,101 @@
+'''Synthetic trial rows following the MFDS API schemas, for benchmarks.'''
+import random
+
+import pandas as pd
+
+from module.constants import *
+
+SPONSORS = [f'{name}제약' for name in ['삼진', '한미', '종근당', '유한', '대웅', '녹십자']]
+SITES = [f'{name}병원' for name in ['서울대학교', '세브란스', '삼성서울', '서울아산', '고려대학교안암', '분당서울대학교']]
+PHASES = ['1상', '2상', '3상', '연구자임상']
+
+# Building blocks for larger, more varied catalogs
+SPONSOR_PREFIXES = ['삼진', '한미', '종근당', '유한', '대웅', '녹십자', '보령', '동아', '일동', '셀트리온', '광동', '제일', '부광', '휴온스', '한독', '에이치케이이노엔', '대원', '동국']
+SPONSOR_SUFFIXES = ['제약', '약품', '바이오', '헬스케어', '바이오로직스', '(주)', '한국지사', '코리아']
+REGIONS = ['서울', '부산', '대구', '인천', '광주', '대전', '울산', '경기', '강원', '충북', '충남', '전북', '전남', '경북', '경남', '제주']
+SITE_NAMES = ['대학교병원', '성모병원', '의료원', '기독병원', '아산병원', '삼성병원', '백병원', '중앙병원', '한양대학교병원', '경희대학교병원']
+DISEASES = ['급성 골수성 백혈병', '제2형 당뇨병', '고혈압', '비소세포폐암', '류마티스 관절염', '알츠하이머병', '파킨슨병', '아토피 피부염', '위암', '만성 신장병', '건선', '천식', '유방암', '간세포암', '골다공증']
+DESIGNS = ['무작위배정', '이중눈가림', '위약대조', '다기관', '공개', '평행설계', '교차설계', '단일군']
+PURPOSES = ['유효성 및 안전성을 평가하기 위한', '약동학적 특성을 평가하기 위한', '용량을 탐색하기 위한', '장기 안전성을 확인하기 위한']
+DEVICE_MANUFACTURERS = ['뷰노', '루닛', '메디톡스', '오스템임플란트', '인바디', '바텍', '레이', '딥노이드', '제이엘케이', '휴비츠', '셀바스헬스케어', '메디아나']
+DEVICE_PRODUCTS = ['영상분석 소프트웨어', '인공지능 진단보조 소프트웨어', '치과용 임플란트', '체성분 분석기', '디지털 엑스선 촬영장치', '환자감시장치', '초음파 영상진단장치', '혈당측정기']
+
+def make_sponsor_names(num_of_sponsors: int, random_generator: random.Random) -> list:
+    names = sorted({f'{prefix}{suffix}' for prefix in SPONSOR_PREFIXES for suffix in SPONSOR_SUFFIXES})
+    return random_generator.sample(names, min(num_of_sponsors, len(names)))
+
+def make_site_names() -> list:
+    return [f'{region}{name}' for region in REGIONS for name in SITE_NAMES]
+
+def make_protocol_title(random_generator: random.Random) -> str:
+    disease = random_generator.choice(DISEASES)
+    design = ' '.join(random_generator.sample(DESIGNS, 2))
+    return f'{disease} 환자를 대상으로 {random_generator.choice(PURPOSES)} {design}, 제{random_generator.choice(PHASES)} 임상시험'
+
+def make_approval_date(random_generator: random.Random, first_year: int) -> str:
+    return f'{random_generator.randint(first_year, 2025)}{random_generator.randint(1, 12):02d}{random_generator.randint(1, 28):02d}'
+
+def make_medication_dataframe(num_of_rows: int, seed: int = 0, realistic: bool = False) -> pd.DataFrame:
+    '''Medication rows with Korean text and multi-site ' :' strings.
+    realistic draws from hundreds of sponsors and sites and varied protocol titles instead of a handful.'''
+
+    random_generator = random.Random(seed)
+    sponsors = make_sponsor_names(120, random_generator) if realistic else SPONSORS
+    sites = make_site_names() if realistic else SITES
+    rows = []
+    for i in range(num_of_rows):
+        rows.append([
+            random_generator.choice(sponsors),
+            make_approval_date(random_generator, 2012) if realistic else f'{random_generator.randint(2012, 2024)}{random_generator.randint(1, 12):02d}{random_generator.randint(1, 28):02d}',
+            ' :'.join(random_generator.sample(sites, random_generator.randint(1, 6 if realistic else 4))),
+            f'IP-{i}',
+            make_protocol_title(random_generator) if realistic else f'급성 환자를 대상으로 한 임상시험 {i} ' * 3,
+            random_generator.choice(PHASES),
+            str(100000 + i),
+        ])
+    return pd.DataFrame(rows, columns=MEDICATION_STUDY_COLUMN_NAME)
+
+def make_device_dataframe(num_of_rows: int, seed: int = 0) -> pd.DataFrame:
+    '''Device rows in the MEDICAL_DEVICE_STUDY_COLUMN_NAME order.'''
+
+    random_generator = random.Random(seed)
+    sponsors = make_sponsor_names(60, random_generator)
+    rows = []
+    for i in range(num_of_rows):
+        manufacturer = random_generator.choice(DEVICE_MANUFACTURERS)
+        row = {
+            'Plan Approval No': f'{random_generator.randint(2003, 2025)}-{i:06d}',
+            'Clinical Trial Approval No': f'제{i:06d}호',
+            'IND Approval Date': make_approval_date(random_generator, 2003),
+            'Manufacturer': manufacturer,
+            'Manufacturer Zipcode': f'{random_generator.randint(1000, 63999):05d}',
+            'Sponsor': random_generator.choice([manufacturer, random_generator.choice(sponsors)]),
+            'Product Name': f'{manufacturer} {random_generator.choice(DEVICE_PRODUCTS)}',
+            'Protocol Title': make_protocol_title(random_generator).replace('임상시험', '의료기기 임상시험'),
+            'Category ID': f'A{random_generator.randint(10000, 99999)}',
+            'Clinical Trial ID Code': str(random_generator.randint(1, 5)),
+            'Clinical Trial ID Name': random_generator.choice(['탐색', '확증', '연구자']),
+            'Clinical Trial Detail Code': str(random_generator.randint(1, 9)),
+            'Clinical Trial Detail Name': random_generator.choice(['허가용', '연구용']),
+            'Forein Approval': random_generator.choice(['Y', 'N']),
+            'Device ID': f'{random_generator.choice("ABCDE")}{random_generator.randint(10000, 99999)}.{random_generator.randint(1, 99):02d}',
+            'Information Release': random_generator.choice(['Y', 'N']),
+            'Deleted': 'N',
+            'Unknown': '',
+        }
+        rows.append([row[column] for column in MEDICAL_DEVICE_STUDY_COLUMN_NAME])
+    return pd.DataFrame(rows, columns=MEDICAL_DEVICE_STUDY_COLUMN_NAME)
+
+def make_details_item(trial_id: str, sponsor: str = '') -> dict:
+    '''One details API item for a trial, the same for the same trial ID.'''
+
+    random_generator = random.Random(trial_id)
+    item = {column: f'{column} {random_generator.choice(DISEASES)}' for column in MEDICATION_STUDY_DETAILS_COLUMN_NAME}
+    item.update({
+        'Sponsor': sponsor or random_generator.choice(SPONSOR_PREFIXES) + '제약',
+        'Protocol Title (Korean)': make_protocol_title(random_generator),
+        'Phase': random_generator.choice(PHASES),
+        'Study Status': random_generator.choice(['모집중', '모집완료', '종료']),
+        'Clinical Trial ID': trial_id,
+    })
+    return item
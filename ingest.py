@@ -0,0 +1,222 @@
+'''Headless ingestion of the MFDS trial datasets, without Streamlit.
+
+Usage:
+    python ingest.py                        # incremental sync of medication and device trials
+    python ingest.py --full --details       # full rebuild, then fetch missing medication details
+    python ingest.py --dry-run              # only report what would be fetched
+    python ingest.py --resume               # reuse the pages an interrupted run saved
+    python ingest.py --storage ./bucket     # use a local directory instead of GCS
+    python ingest.py --metrics-file m.prom  # also write per-stage timings
+
+The API key is read from the DECODED_API_KEY environment variable (or .streamlit/secrets.toml).
+A JSON summary is printed to stdout, progress goes to stderr. The exit code is 1 if anything failed.
+'''
+import argparse
+import json
+import os
+import re
+import sys
+from datetime import datetime
+from math import ceil
+
+import pytz
+import streamlit.logger
+
+# Streamlit is only used for its cache decorators here, silence its "No runtime found" warnings
+streamlit.logger.set_log_level('error')
+
+from module.utils import *
+from module.refresh_lock import open_refresh_lock
+from module.metrics import dump_metrics
+
+class ConsoleStatus:
+    '''Stand-in for a Streamlit status container that writes to stderr.'''
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.messages = []
+        self.num_of_errors = 0
+        self.last_percent = -1
+
+    def write(self, level: str, message: str) -> None:
+        # Drop Streamlit color markup such as :red[...]
+        message = re.sub(r':\w+\[(.*?)\]', r'\1', str(message))
+        self.messages.append(f'{level}: {message}')
+        print(f'[{self.name}] {level}: {message}', file=sys.stderr)
+
+    def info(self, message, **kwargs) -> None:
+        self.write('INFO', message)
+
+    def success(self, message, **kwargs) -> None:
+        self.write('SUCCESS', message)
+
+    def warning(self, message, **kwargs) -> None:
+        self.write('WARNING', message)
+
+    def error(self, message, **kwargs) -> None:
+        self.num_of_errors += 1
+        self.write('ERROR', message)
+
+    def toast(self, message, **kwargs) -> None:
+        self.write('WARNING', message)
+
+    def progress(self, value: float = 0, text: str = '') -> 'ConsoleStatus':
+        # Only report every 10%
+        percent = int(value * 10) * 10
+        if percent != self.last_percent:
+            self.last_percent = percent
+            print(f'[{self.name}] {percent}% {text}', file=sys.stderr)
+        return self
+
+DATASETS = {
+    'medication': {
+        'file_name': MEDICATION_TRIAL_FILE_NAME,
+        'fetch_function': fetch_medication_trial_data,
+        'url': MEDICATION_TRIAL_URL,
+        'key_columns': MEDICATION_STUDY_KEY_COLUMN_NAME,
+    },
+    'device': {
+        'file_name': DEVICE_TRIAL_FILE_NAME,
+        'fetch_function': fetch_device_trial_data,
+        'url': DEVICE_TRIAL_URL,
+        'key_columns': MEDICAL_DEVICE_STUDY_KEY_COLUMN_NAME,
+    },
+}
+
+def read_stored_count(conn, file_name: str, key_columns: list) -> int:
+    try:
+        return read_data(conn, file_name, columns=key_columns).shape[0]
+    except FileNotFoundError:
+        return 0
+
+def plan_dataset(conn, dataset: dict, args) -> dict:
+    '''Report what a sync would fetch, using a single API request.'''
+
+    response_body_dict = get_page(dataset['url'], {'serviceKey': get_api_key(), 'type': 'json', 'pageNo': 1, 'numOfRows': 1})
+    total_count = response_body_dict.get('totalCount', 0)
+    stored_count = read_stored_count(conn, dataset['file_name'], dataset['key_columns'])
+    checkpoint_dir = os.path.join(args.checkpoint_dir, dataset['file_name'])
+    checkpoint_pages = len([name for name in os.listdir(checkpoint_dir) if name.startswith('page_')]) if os.path.isdir(checkpoint_dir) else 0
+
+    last_full_refresh = read_last_full_refresh(conn, dataset['file_name'])
+
+    return {
+        'status': Function_Status.SUCCESS.value,
+        # The same choice sync_dataframe makes, a delta that turns out too large still falls back to a full fetch
+        'mode': 'full' if args.full or stored_count == 0 or is_full_refresh_due(conn, dataset['file_name']) else 'incremental',
+        'last_full_refresh': last_full_refresh.isoformat() if last_full_refresh is not None else None,
+        'total_count': total_count,
+        'stored_count': stored_count,
+        'new_rows': max(total_count - stored_count, 0),
+        'full_fetch_pages': ceil(total_count / NUM_OF_ROWS),
+        'checkpoint_pages': checkpoint_pages,
+    }
+
+def ingest_dataset(conn, name: str, dataset: dict, args) -> dict:
+    '''Sync one dataset into its snapshot and summarize the outcome.'''
+
+    status = ConsoleStatus(name)
+    summary = {'file_path': get_dataset_path(dataset['file_name'])}
+    try:
+        if args.dry_run:
+            return {**summary, **plan_dataset(conn, dataset, args)}
+
+        checkpoint_dir = os.path.join(args.checkpoint_dir, dataset['file_name'])
+        if not args.resume:
+            clear_checkpoint(checkpoint_dir)
+
+        dataframe, stored_dataframe, full_fetch = sync_dataframe(conn, dataset['file_name'], dataset['fetch_function'], status, args.full, checkpoint_dir)
+        if dataframe is None:
+            summary.update(status=Function_Status.SUCCESS.value, mode='unchanged', rows=read_stored_count(conn, dataset['file_name'], dataset['key_columns']))
+        elif dataframe.empty:
+            summary.update(status=Function_Status.FAIL.value, error='No data was fetched from the API.')
+        elif status.num_of_errors:
+            # Keep the stored snapshot and the checkpoint, --resume only refetches the failed pages
+            summary.update(status=Function_Status.FAIL.value, error=f'{status.num_of_errors} pages failed, run again with --resume.')
+        else:
+            result, e = save_trial_data(conn, dataset['file_name'], dataframe, stored_dataframe, full_fetch)
+            summary.update(status=result.value, mode='full' if full_fetch else 'incremental', rows=dataframe.shape[0])
+            if result == Function_Status.FAIL:
+                summary['error'] = str(e)
+            else:
+                clear_checkpoint(checkpoint_dir)
+    except IncompleteFetchError as e:
+        # Keep the stored snapshot and the checkpoint, --resume only refetches the failed pages
+        summary.update(status=Function_Status.FAIL.value, error=f'{e} Run again with --resume.')
+    except Exception as e:
+        summary.update(status=Function_Status.FAIL.value, error=str(e))
+
+    summary['messages'] = status.messages
+    return summary
+
+def ingest_details(conn, args) -> dict:
+    '''Fetch the medication details missing from the detail store, one batch at a time.
+    Each batch is saved as it completes, so an interrupted run resumes where it stopped.'''
+
+    status = ConsoleStatus('details')
+    summary = {'file_path': get_dataset_path(MEDICATION_DETAILS_FILE_NAME)}
+    try:
+        trial_ids = read_data(conn, MEDICATION_TRIAL_FILE_NAME, columns=['Clinical Trial ID'])['Clinical Trial ID'].astype(str)
+        stored_ids = set(read_detail_store(conn)['Clinical Trial ID'])
+        missing_ids = trial_ids[~trial_ids.isin(stored_ids)].drop_duplicates()
+        summary.update(total_count=trial_ids.shape[0], stored_count=len(stored_ids), missing_count=missing_ids.shape[0])
+
+        if not args.dry_run:
+            for start in range(0, missing_ids.shape[0], DETAILS_BATCH_SIZE):
+                batch = missing_ids.iloc[start:start + DETAILS_BATCH_SIZE].to_frame()
+                status.info(f'Fetching details {start + 1}~{start + batch.shape[0]} of {missing_ids.shape[0]}...')
+                fetch_medication_details_data(batch, conn, notify=status.toast, bypass_cache=args.full)
+        summary['status'] = Function_Status.SUCCESS.value
+    except Exception as e:
+        summary.update(status=Function_Status.FAIL.value, error=str(e))
+
+    summary['messages'] = status.messages
+    return summary
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--full', action='store_true', help='Download every page instead of only new or changed ones.')
+    parser.add_argument('--details', action='store_true', help='Also fetch medication details missing from the detail store.')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be fetched without fetching or writing.')
+    parser.add_argument('--resume', action='store_true', help='Reuse pages saved by an interrupted full fetch.')
+    parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR, help='Where fetched pages are saved while a run is in progress.')
+    parser.add_argument('--storage', default='gcs', help="'gcs' or a local directory standing in for the bucket.")
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS), default=list(DATASETS))
+    parser.add_argument('--metrics-file', help='Write stage timings here at the end (JSON for .json, Prometheus text otherwise).')
+    args = parser.parse_args()
+
+    conn = open_storage(args.storage)
+    started_at = datetime.now(tz=pytz.timezone('Asia/Seoul')).isoformat()
+    summary = {'started_at': started_at, 'dry_run': args.dry_run, 'full': args.full, 'datasets': {}}
+
+    # Never crawl alongside the app or another ingest run
+    refresh_lock = open_refresh_lock(conn)
+    if not args.dry_run and not refresh_lock.acquire():
+        summary.update(status=Function_Status.FAIL.value, error='Another refresh is already running.', holder=refresh_lock.holder())
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return 1
+
+    try:
+        for name in args.datasets:
+            summary['datasets'][name] = ingest_dataset(conn, name, DATASETS[name], args)
+        if args.details:
+            summary['details'] = ingest_details(conn, args)
+
+        results = [result['status'] for result in summary['datasets'].values()]
+        results += [summary['details']['status']] if args.details else []
+        if not args.dry_run and Function_Status.FAIL.value not in results:
+            # Let the Home page know today's update is done
+            append_api_call_log(conn, read_api_call_logs(conn), started_at)
+    finally:
+        refresh_lock.release()
+
+    summary['finished_at'] = datetime.now(tz=pytz.timezone('Asia/Seoul')).isoformat()
+    summary['status'] = Function_Status.FAIL.value if Function_Status.FAIL.value in results else Function_Status.SUCCESS.value
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if args.metrics_file:
+        dump_metrics(args.metrics_file)
+
+    return 0 if summary['status'] == Function_Status.SUCCESS.value else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
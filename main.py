@@ -3,9 +3,9 @@ import pytz
 
 import pandas as pd
 import streamlit as st
-from st_files_connection import FilesConnection
 
-from module.fragments import home, medication_tirals_page, device_tirals_page
+from module.fragments import home, medication_tirals_page, device_tirals_page, trends_page, company_page, metrics_page, is_warm_up_enabled, start_warm_up
+from module.utils import get_files_connection
 
 timezone = pytz.timezone('Asia/Seoul')
 today = datetime.now(tz=timezone).isoformat()
@@ -18,8 +18,6 @@ st.set_page_config(
 # Session State Initialization
 if 'today' not in st.session_state:
     st.session_state['today'] = today
-if 'files_connection' not in st.session_state:
-    st.session_state['files_connection'] = st.connection('gcs', type=FilesConnection)
 if 'fetch_data_result_dict' not in st.session_state:
     st.session_state['fetch_data_result_dict'] = dict
 if 'medication_retrieve' not in st.session_state:
@@ -30,8 +28,12 @@ if 'medication_details_retrieve' not in st.session_state:
     st.session_state['medication_details_retrieve'] = 'INITIAL'
 if 'medication_df' not in st.session_state:
     st.session_state['medication_df'] = pd.DataFrame
-if 'medication_filtered_df' not in st.session_state:
-    st.session_state['medication_filtered_df'] = pd.DataFrame
+if 'medication_filtered_mask' not in st.session_state:
+    st.session_state['medication_filtered_mask'] = None
+if 'medication_filtered_version' not in st.session_state:
+    st.session_state['medication_filtered_version'] = None
+if 'medication_query_result' not in st.session_state:
+    st.session_state['medication_query_result'] = None
 if 'medication_details_df' not in st.session_state:
     st.session_state['medication_details_df'] = pd.DataFrame
 if 'device_df' not in st.session_state:
@@ -42,12 +44,25 @@ if 'device_retrieve' not in st.session_state:
     st.session_state['device_retrieve'] = 'INITIAL'
 if 'device_filter' not in st.session_state:
     st.session_state['device_filter'] = 'INITIAL'
+if 'device_filtered_mask' not in st.session_state:
+    st.session_state['device_filtered_mask'] = None
+if 'device_filtered_version' not in st.session_state:
+    st.session_state['device_filtered_version'] = None
+if 'device_query_result' not in st.session_state:
+    st.session_state['device_query_result'] = None
+
+# The GCS connection is opened by the first page that reads from it, unless datasets are warmed up
+if is_warm_up_enabled():
+    start_warm_up(get_files_connection())
 
 # Sidebar
 pages = { 
     'Home': home,
     'Medication Trials': medication_tirals_page, 
     'Device Trials': device_tirals_page,
+    'Trends': trends_page,
+    'Companies': company_page,
+    'Metrics': metrics_page,
     }
 
 with st.sidebar.title('Navigation') as sidebar:
@@ -0,0 +1,71 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from module.constants import *
+from module.metrics import timed
+
+@dataclass(frozen=True)
+class EntityIndex:
+    '''Trial-to-entity mapping of one column in CSR form, with integer entity ids.
+
+    The entities of row i are entity_ids[row_ptr[i]:row_ptr[i + 1]], so a multi-valued
+    column like Site maps one trial to several sites. counts holds the catalog-wide trial
+    count of every entity.'''
+
+    names: np.ndarray
+    row_ptr: np.ndarray
+    entity_ids: np.ndarray
+    counts: np.ndarray
+
+def build_entity_index(series: pd.Series, separator: str = None) -> EntityIndex:
+    '''Map every row to the entities in its value, split on separator if given.
+    Only the distinct values are split, rows reuse their value's entity ids.'''
+
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    parts = [str(value).split(separator) if separator is not None else [str(value)] for value in uniques]
+
+    # Entity ids of every distinct value, back to back
+    value_lengths = np.array([len(value_parts) for value_parts in parts] + [0], dtype=np.int64)
+    value_ptr = np.concatenate([[0], np.cumsum(value_lengths)])
+    flat_parts = [part for value_parts in parts for part in value_parts]
+    value_entity_ids, names = pd.factorize(pd.Series(flat_parts, dtype=object))
+
+    # Missing values (code -1) hit the extra empty slot at the end
+    row_lengths = value_lengths[codes]
+    row_ptr = np.concatenate([[0], np.cumsum(row_lengths)])
+    offsets = np.repeat(value_ptr[codes] - row_ptr[:-1], row_lengths) + np.arange(row_ptr[-1])
+    entity_ids = value_entity_ids[offsets].astype(np.int32)
+
+    return EntityIndex(
+        names=np.asarray(names, dtype=object),
+        row_ptr=row_ptr,
+        entity_ids=entity_ids,
+        counts=np.bincount(entity_ids, minlength=len(names)),
+        )
+
+def build_entity_indexes(dataframe: pd.DataFrame, entity_columns: dict) -> dict:
+    '''Build an entity index for each {column: separator}.'''
+
+    return {column: build_entity_index(dataframe[column], separator) for column, separator in entity_columns.items()}
+
+def count_entities(index: EntityIndex, mask: np.ndarray = None) -> np.ndarray:
+    '''Return the trial count of every entity over the rows in the mask (every row if None).'''
+
+    if mask is None or mask.all():
+        return index.counts
+    entity_mask = np.repeat(mask, np.diff(index.row_ptr))
+    return np.bincount(index.entity_ids[entity_mask], minlength=index.names.shape[0])
+
+@timed('aggregates.top_entities')
+def top_entities(index: EntityIndex, mask: np.ndarray = None, n: int = 10, column: str = 'Entity') -> pd.DataFrame:
+    '''Return the n entities with the most trials among the masked rows, in ascending count order.'''
+
+    counts = count_entities(index, mask)
+    n = min(n, int(np.count_nonzero(counts)))
+    if n == 0:
+        return pd.DataFrame({column: pd.Series(dtype=object), 'Count': pd.Series(dtype=np.int64)})
+    top_ids = np.argpartition(counts, -n)[-n:]
+    top_ids = top_ids[np.argsort(counts[top_ids], kind='stable')]
+    return pd.DataFrame({column: index.names[top_ids], 'Count': counts[top_ids]})
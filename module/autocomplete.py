@@ -0,0 +1,131 @@
+import bisect
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+from module.constants import *
+from module.aggregates import EntityIndex
+from module.metrics import timed
+
+HANGUL_FIRST, HANGUL_LAST = 0xAC00, 0xD7A3
+NUM_OF_JUNGSEONG, NUM_OF_JONGSEONG = 21, 28
+# Compatibility jamo as typed on a keyboard, in choseong order
+CHOSEONG = 'ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ'
+# Revised Romanization, without the sound change rules between syllables
+CHOSEONG_ROMAN = ['g', 'kk', 'n', 'd', 'tt', 'r', 'm', 'b', 'pp', 's', 'ss', '', 'j', 'jj', 'ch', 'k', 't', 'p', 'h']
+JUNGSEONG_ROMAN = ['a', 'ae', 'ya', 'yae', 'eo', 'e', 'yeo', 'ye', 'o', 'wa', 'wae', 'oe', 'yo', 'u', 'wo', 'we', 'wi', 'yu', 'eu', 'ui', 'i']
+JONGSEONG_ROMAN = ['', 'k', 'k', 'k', 'n', 'n', 'n', 't', 'l', 'k', 'm', 'l', 'l', 'l', 'p', 'l', 'm', 'p', 'p', 't', 't', 'ng', 't', 't', 'k', 't', 'p', 't']
+# Keys also start after these, so '(주)한미약품' is found by '한미'
+WORD_BOUNDARY = re.compile(r'[\s()\[\]/,.·&-]+')
+
+def is_hangul_syllable(character: str) -> bool:
+    return HANGUL_FIRST <= ord(character) <= HANGUL_LAST
+
+def to_choseong(text: str) -> str:
+    '''Replace every Hangul syllable by its initial consonant, e.g. '삼진제약' -> 'ㅅㅈㅈㅇ'.'''
+
+    return ''.join(
+        CHOSEONG[(ord(character) - HANGUL_FIRST) // (NUM_OF_JUNGSEONG * NUM_OF_JONGSEONG)] if is_hangul_syllable(character) else character
+        for character in text
+    )
+
+def romanize(text: str) -> str:
+    '''Romanize Hangul syllable by syllable, e.g. '서울대학교병원' -> 'seouldaehakgyobyeongwon'.'''
+
+    output = []
+    for character in text:
+        if is_hangul_syllable(character):
+            offset = ord(character) - HANGUL_FIRST
+            output.append(
+                CHOSEONG_ROMAN[offset // (NUM_OF_JUNGSEONG * NUM_OF_JONGSEONG)]
+                + JUNGSEONG_ROMAN[offset // NUM_OF_JONGSEONG % NUM_OF_JUNGSEONG]
+                + JONGSEONG_ROMAN[offset % NUM_OF_JONGSEONG]
+            )
+        else:
+            output.append(character)
+    return ''.join(output)
+
+def make_keys(name: str) -> set:
+    '''Lowercased, choseong and romanized forms of the name and of every word in it.'''
+
+    name = name.lower()
+    starts = [0] + [match.end() for match in WORD_BOUNDARY.finditer(name)]
+    suffixes = {name[start:] for start in starts if start < len(name)}
+    compact_suffixes = {WORD_BOUNDARY.sub('', suffix) for suffix in suffixes}
+    return {key for suffix in suffixes | compact_suffixes for key in [suffix, to_choseong(suffix), romanize(suffix)] if key}
+
+def get_prefix_range(query: str) -> tuple[str, str]:
+    '''Return the [low, high) key range of the keys starting with the query.
+
+    The last character may still be in the middle of being typed: a syllable without a final
+    consonant ('삼지') also matches the syllables that add one ('삼진'), and a lone initial
+    consonant ('삼ㅈ') matches every syllable starting with it.'''
+
+    head, last = query[:-1], query[-1]
+    if is_hangul_syllable(last) and (ord(last) - HANGUL_FIRST) % NUM_OF_JONGSEONG == 0:
+        return query, head + chr(ord(last) + NUM_OF_JONGSEONG)
+    if last in CHOSEONG and head and is_hangul_syllable(head[-1]):
+        first = HANGUL_FIRST + CHOSEONG.index(last) * NUM_OF_JUNGSEONG * NUM_OF_JONGSEONG
+        return head + chr(first), head + chr(first + NUM_OF_JUNGSEONG * NUM_OF_JONGSEONG)
+    # Every key starting with the query sorts before query + the highest code point
+    return query, query + chr(0x10FFFF)
+
+@dataclass(frozen=True)
+class SuggestionIndex:
+    '''Sorted prefix keys of the distinct values of one entity column.
+
+    Each value is reachable through its lowercased, choseong and romanized forms, from its start
+    or from any word in it. key_entity_ids[i] is the entity of keys[i], counts its trial count.'''
+
+    names: np.ndarray
+    counts: np.ndarray
+    keys: list
+    key_entity_ids: np.ndarray
+
+def build_suggestion_index(entity_index: EntityIndex) -> SuggestionIndex:
+    '''Build the prefix keys of every entity with at least one trial.'''
+
+    pairs = sorted(
+        (key, entity_id)
+        for entity_id, name in enumerate(entity_index.names)
+        if entity_index.counts[entity_id] > 0
+        for key in make_keys(str(name).strip())
+    )
+    return SuggestionIndex(
+        names=entity_index.names,
+        counts=entity_index.counts,
+        keys=[key for key, _ in pairs],
+        key_entity_ids=np.array([entity_id for _, entity_id in pairs], dtype=np.int32),
+        )
+
+def build_suggestion_indexes(entity_indexes: dict, columns: list = SUGGESTION_COLUMN_NAME) -> dict:
+    '''Build a suggestion index for each entity column that has one among the columns.'''
+
+    return {column: build_suggestion_index(entity_indexes[column]) for column in columns if column in entity_indexes}
+
+@timed('autocomplete.suggest')
+def suggest(index: SuggestionIndex, query: str, limit: int = SUGGESTION_LIMIT) -> list[tuple[str, int]]:
+    '''Return up to `limit` (value, trial count) pairs whose keys start with the query, most trials first.'''
+
+    query = WORD_BOUNDARY.sub(' ', query.strip().lower())
+    if not query:
+        return []
+
+    entity_ids = []
+    # 'seoul daehak' is typed with spaces, the compact keys have none
+    for candidate in {query, query.replace(' ', '')}:
+        low, high = get_prefix_range(candidate)
+        start, end = bisect.bisect_left(index.keys, low), bisect.bisect_left(index.keys, high)
+        entity_ids.append(index.key_entity_ids[start:end])
+    entity_ids = np.unique(np.concatenate(entity_ids))
+    if entity_ids.size == 0:
+        return []
+
+    counts = index.counts[entity_ids]
+    if entity_ids.size > limit:
+        top = np.argpartition(counts, -limit)[-limit:]
+        entity_ids, counts = entity_ids[top], counts[top]
+    # Most trials first, then by name
+    order = sorted(range(entity_ids.size), key=lambda i: (-counts[i], str(index.names[entity_ids[i]])))
+    return [(str(index.names[entity_ids[i]]), int(counts[i])) for i in order]
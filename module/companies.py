@@ -0,0 +1,190 @@
+import hashlib
+import json
+import re
+import sys
+import threading
+import unicodedata
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from module.constants import *
+from module.storage import *
+from module.datasets import TrialDataset, load_device_dataset, load_medication_dataset
+from module.autocomplete import CHOSEONG_ROMAN, HANGUL_FIRST, HANGUL_LAST, JUNGSEONG_ROMAN, NUM_OF_JONGSEONG, NUM_OF_JUNGSEONG
+from module.metrics import record, span, timed
+
+# Company columns of each trial dataset
+COMPANY_DATASETS = {
+    MEDICATION_TRIAL_FILE_NAME: MEDICATION_STUDY_COMPANY_COLUMN_NAME,
+    DEVICE_TRIAL_FILE_NAME: MEDICAL_DEVICE_STUDY_COMPANY_COLUMN_NAME,
+}
+# Changed whenever normalize_company_name changes, so maps built with the old keys are rebuilt
+COMPANY_KEY_SCHEME = 'transliterated-v1'
+# Legal forms and branch markers dropped from Korean names, '㈜' is '(주)' once NFKC normalized
+KOREAN_LEGAL_FORMS = re.compile(r'\(\s*(주|유|재|사|합)\s*\)|주식회사|유한책임회사|유한회사|재단법인|사단법인|한국지사')
+LATIN_LEGAL_FORMS = {'co', 'ltd', 'inc', 'corp', 'corporation', 'company', 'limited', 'llc', 'gmbh', 'ag', 'sa', 'plc', 'bv', 'kk', 'branch', 'office'}
+# Revised Romanization transliteration of the final consonants, one spelling each (unlike the
+# pronunciation used for typeahead), so no two syllables are romanized alike
+JONGSEONG_TRANSLITERATION = ['', 'g', 'kk', 'gs', 'n', 'nj', 'nh', 'd', 'l', 'lg', 'lm', 'lb', 'ls', 'lt', 'lp', 'lh', 'm', 'b', 'bs', 's', 'ss', 'ng', 'j', 'ch', 'k', 't', 'p', 'h']
+HANGUL_SYLLABLES = re.compile(f'[{chr(HANGUL_FIRST)}-{chr(HANGUL_LAST)}]+')
+
+def transliterate_hangul(text: str) -> str:
+    '''Romanize every Hangul syllable of lower case text in upper case, syllables separated by '-', e.g. 'lg화학' -> 'lgHWA-HAG'.
+
+    Nothing is folded, so two different names never share a romanization: the rest of the key is
+    lower case, and the separators keep '화' (HWA) apart from 'ㅎ' followed by '와' (H-WA).'''
+
+    def transliterate_run(match: re.Match) -> str:
+        syllables = []
+        for character in match.group():
+            offset = ord(character) - HANGUL_FIRST
+            syllables.append(
+                CHOSEONG_ROMAN[offset // (NUM_OF_JUNGSEONG * NUM_OF_JONGSEONG)]
+                + JUNGSEONG_ROMAN[offset // NUM_OF_JONGSEONG % NUM_OF_JUNGSEONG]
+                + JONGSEONG_TRANSLITERATION[offset % NUM_OF_JONGSEONG]
+            )
+        return '-'.join(syllables).upper()
+
+    return HANGUL_SYLLABLES.sub(transliterate_run, text)
+
+def normalize_company_name(name: str) -> str:
+    '''Return the key of a company name, shared by the spellings that differ only in legal form,
+    spacing, punctuation or case.
+
+    '한미약품(주)' and '㈜ 한미약품' share 'HAN-MI-YAG-PUM', 'Hanmi Pharm. Co., Ltd.' and 'HANMI PHARM'
+    share 'hanmipharm'. Names are never matched by sound, so English and Korean spellings of a
+    company are only joined through COMPANY_KEY_ALIASES.'''
+
+    text = KOREAN_LEGAL_FORMS.sub(' ', unicodedata.normalize('NFKC', name).lower())
+    words = [word for word in re.split(r'[\W_]+', text) if word]
+    # A name made of legal forms only keeps them
+    words = [word for word in words if word not in LATIN_LEGAL_FORMS] or words
+    key = transliterate_hangul(''.join(words))
+    return COMPANY_KEY_ALIASES.get(key, key)
+
+def get_company_id(key: str) -> str:
+    '''Canonical company ID of a normalized name, the same in every dataset and every run.'''
+
+    return f'C{hashlib.sha1(key.encode("utf-8")).hexdigest()[:10].upper()}'
+
+def get_company_map_path(file_name: str) -> str:
+    return get_dataset_path(f'{file_name}{COMPANY_MAP_FILE_SUFFIX}', 'parquet')
+
+def get_company_map_version(version: str) -> str:
+    '''Source version a company map is tagged with: the dataset version and the key rules it was
+    built with, so editing COMPANY_KEY_ALIASES (or the key scheme) rebuilds the stored maps.'''
+
+    key_rules = json.dumps([COMPANY_KEY_SCHEME, COMPANY_KEY_ALIASES], sort_keys=True, ensure_ascii=False)
+    return f'{version}:{hashlib.sha1(key_rules.encode("utf-8")).hexdigest()[:10]}'
+
+def get_company_names(dataframe: pd.DataFrame, column: str) -> pd.Series:
+    return dataframe[column].astype('string').str.strip()
+
+@timed('companies.build_map')
+def build_company_map(dataframe: pd.DataFrame, company_columns: list) -> pd.DataFrame:
+    '''Resolve every distinct name of the company columns to its company ID, with its trial count.'''
+
+    parts = []
+    for column in company_columns:
+        counts = get_company_names(dataframe, column).replace('', pd.NA).value_counts()
+        parts.append(pd.DataFrame({'Column': column, 'Name': counts.index.astype(str), 'Trials': counts.to_numpy()}))
+    company_map = pd.concat(parts, ignore_index=True)
+    # Each distinct name is normalized once, whichever columns it appears in
+    company_ids = {name: get_company_id(normalize_company_name(name)) for name in company_map['Name'].unique()}
+    company_map['Company ID'] = company_map['Name'].map(company_ids)
+    return company_map
+
+def update_company_map(conn, file_name: str, dataframe: pd.DataFrame, version: str) -> None:
+    '''Resolve the companies of a newly saved dataset version and store its company map.'''
+
+    company_map = build_company_map(dataframe, COMPANY_DATASETS[file_name])
+    write_derived_table(conn, get_company_map_path(file_name), company_map, get_company_map_version(version))
+
+def build_company_trials(dataframe: pd.DataFrame, company_columns: list, company_map: pd.DataFrame) -> dict:
+    '''Map every company ID to the sorted row ids of its trials, a trial counting once even when
+    it names the company in several columns.'''
+
+    row_ids, company_ids = [], []
+    for column in company_columns:
+        column_map = company_map[company_map['Column'] == column]
+        column_ids = dict(zip(column_map['Name'], column_map['Company ID']))
+        # Only the distinct names are looked up, rows reuse their name's company ID
+        codes, names = pd.factorize(get_company_names(dataframe, column))
+        name_ids = np.array([column_ids.get(name) for name in names] + [None], dtype=object)
+        row_company_ids = name_ids[codes]
+        has_company = pd.notna(row_company_ids)
+        row_ids.append(np.flatnonzero(has_company))
+        company_ids.append(row_company_ids[has_company])
+
+    pairs = pd.DataFrame({'Row': np.concatenate(row_ids), 'Company ID': np.concatenate(company_ids)}).drop_duplicates()
+    rows = pairs['Row'].to_numpy()
+    return {company_id: np.sort(rows[positions]) for company_id, positions in pairs.groupby('Company ID').indices.items()}
+
+@dataclass(frozen=True)
+class CompanyIndex:
+    '''Companies of the medication and device trials, for one version of each dataset.
+
+    companies has one row per company ID (most trials first) with its most used name and every
+    name it is listed under. trials[file_name][company_id] holds the row ids of its trials in
+    datasets[file_name].'''
+
+    versions: tuple
+    datasets: dict
+    companies: pd.DataFrame
+    trials: dict
+
+_company_index = None
+_company_index_lock = threading.Lock()
+
+def load_company_map(conn, file_name: str, dataset: TrialDataset) -> pd.DataFrame:
+    '''Return the stored company map of the dataset version, rebuilt if it describes another one
+    or was built with other key rules.'''
+
+    company_map, source_version = read_derived_table(conn, get_company_map_path(file_name))
+    if company_map is None or source_version != get_company_map_version(dataset.version):
+        company_map = build_company_map(dataset.dataframe, COMPANY_DATASETS[file_name])
+        try:
+            write_derived_table(conn, get_company_map_path(file_name), company_map, get_company_map_version(dataset.version))
+        except Exception as e:
+            # Kept in memory, the next process tries again
+            record('companies.write_failed', 0)
+            print(f'Failed to store the rebuilt company map of {file_name}: {e!r}', file=sys.stderr)
+    return company_map
+
+def load_company_index(conn) -> CompanyIndex:
+    '''Return the company index of the current dataset versions, shared by every session of this process.'''
+
+    global _company_index
+    datasets = {MEDICATION_TRIAL_FILE_NAME: load_medication_dataset(conn), DEVICE_TRIAL_FILE_NAME: load_device_dataset(conn)}
+    versions = tuple(dataset.version for dataset in datasets.values())
+    if _company_index is not None and _company_index.versions == versions:
+        return _company_index
+
+    with _company_index_lock:
+        if _company_index is not None and _company_index.versions == versions:
+            return _company_index
+
+        with span('companies.build_index'):
+            company_maps = {file_name: load_company_map(conn, file_name, dataset) for file_name, dataset in datasets.items()}
+            trials = {
+                file_name: build_company_trials(dataset.dataframe, COMPANY_DATASETS[file_name], company_maps[file_name])
+                for file_name, dataset in datasets.items()
+            }
+
+            names = pd.concat(company_maps.values()).groupby(['Company ID', 'Name'], as_index=False)['Trials'].sum()
+            names = names.sort_values(['Trials', 'Name'], ascending=[False, True], kind='stable')
+            companies = names.groupby('Company ID', sort=False).agg(Company=('Name', 'first'), Names=('Name', list))
+            companies['Medication Trials'] = [len(trials[MEDICATION_TRIAL_FILE_NAME].get(company_id, ())) for company_id in companies.index]
+            companies['Device Trials'] = [len(trials[DEVICE_TRIAL_FILE_NAME].get(company_id, ())) for company_id in companies.index]
+            total_trials = companies['Medication Trials'] + companies['Device Trials']
+            companies = companies.iloc[np.argsort(-total_trials.to_numpy(), kind='stable')]
+
+        _company_index = CompanyIndex(versions=versions, datasets=datasets, companies=companies, trials=trials)
+    return _company_index
+
+def get_company_trials(company_index: CompanyIndex, file_name: str, company_id: str) -> np.ndarray:
+    '''Row ids of one company's trials in a dataset, a hash lookup instead of a scan.'''
+
+    return company_index.trials[file_name].get(company_id, np.empty(0, dtype=np.int64))
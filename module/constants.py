@@ -1,9 +1,17 @@
+import os
+import tempfile
 from enum import Enum
 
 MEDICATION_STUDY_COLUMN_NAME = [
     'Sponsor', 'IND Approval Date', 'Site', 'IP Name', 
     'Protocol Title', 'Phase', 'Clinical Trial ID'
 ]
+MEDICATION_STUDY_KEY_COLUMN_NAME = ['Clinical Trial ID']
+MEDICATION_STUDY_SEARCH_COLUMN_NAME = ['Sponsor', 'Site', 'Protocol Title']
+# {column: separator} counted per entity for the Top 10 charts, a trial lists its sites separated by ' :'
+MEDICATION_STUDY_ENTITY_COLUMN_NAME = {'Sponsor': None, 'Site': ' :'}
+# Columns naming a company, resolved to a canonical company ID shared with the device trials
+MEDICATION_STUDY_COMPANY_COLUMN_NAME = ['Sponsor']
 MEDICATION_STUDY_DETAILS_COLUMN_NAME = [
     'Sponsor', 'President of the Sponsor', 'Address of the Sponsor', 
     'Original Developer of the IP', 'Nationality of the Original Developer', 
@@ -21,10 +29,62 @@ MEDICATION_STUDY_DETAILS_COLUMN_NAME = [
     'Method of the IP Administration', 'Study Status', 'Clinical Trial ID'
 ]
 
-BASE_URL = 'http://apis.data.go.kr/1471000'
+# MFDS_BASE_URL points the app at a stand-in API (see benchmarks/mock_api.py)
+BASE_URL = os.environ.get('MFDS_BASE_URL', 'http://apis.data.go.kr/1471000')
+MEDICATION_TRIAL_URL = f'{BASE_URL}/MdcinClincTestInfoService02/getMdcinClincTestInfoList02'
+DEVICE_TRIAL_URL = f'{BASE_URL}/MdeqClncTestPlanAprvAplyDtlService01/getMdeqClncTestPlanAprvAplyDtlInq01'
+MEDICATION_DETAILS_URL = f'{BASE_URL}/ClncExamPlanDtlService2/getClncExamPlanDtlInq2'
 
 NUM_OF_ROWS = 100
 
+# Concurrent page fetching
+MAX_CONCURRENT_REQUESTS = 8
+MAX_REQUESTS_PER_SECOND = 10
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5
+REQUEST_TIMEOUT_SECONDS = 30
+
+# API response cache (module/response_cache.py), used for per-trial detail requests: IDs without
+# details never reach the detail store, so every search asks for them again. Trial list pages are
+# requested once per sync and never cached, a refresh always sees the API's current state
+RESPONSE_CACHE_TTL_SECONDS = 3600
+RESPONSE_CACHE_MAX_ENTRIES = 5000
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# A directory for the on-disk tier (or the RESPONSE_CACHE_DIR environment variable), None or '' for memory only
+RESPONSE_CACHE_DIR = None
+# Params left out of cache keys and cache files
+RESPONSE_CACHE_SECRET_PARAMS = ['serviceKey']
+
+# Headless ingestion (ingest.py)
+# Set AUTO_REFRESH_ON_HOME to False once ingest.py runs on a schedule, so Home never starts a crawl
+AUTO_REFRESH_ON_HOME = True
+CHECKPOINT_DIR = '.ingest_checkpoint'
+DETAILS_BATCH_SIZE = 500
+
+# Headless query API (api.py)
+API_HOST = '127.0.0.1'
+API_PORT = 8080
+# How often the API checks GCS for a new dataset version, the loaded one keeps serving meanwhile
+API_REFRESH_SECONDS = 300
+API_DEFAULT_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+API_MAX_TOP_N = 100
+
+# Updates only fetch the newest pages, so an edit to an older trial is only picked up by a full
+# fetch. One is made whenever the last one is older than FULL_REFRESH_MAX_AGE_DAYS, its time kept
+# in a small object next to each dataset, e.g. medication_trial_info_full_refresh.json
+FULL_REFRESH_MAX_AGE_DAYS = 7
+FULL_REFRESH_FILE_SUFFIX = '_full_refresh'
+
+# Single-flight refresh lock, shared by every session, worker and ingest run
+REFRESH_LOCK_FILE_NAME = 'refresh.lock'
+# A crashed refresh blocks others for at most one lease
+REFRESH_LOCK_LEASE_SECONDS = 300
+REFRESH_LOCK_HEARTBEAT_SECONDS = 30
+# How long Home waits for another session's refresh before showing the last snapshot
+REFRESH_WAIT_SECONDS = 120
+REFRESH_POLL_SECONDS = 2
+
 MEDICAL_DEVICE_STUDY_COLUMN_NAME = [
     'Plan Approval No', 'Clinical Trial Approval No', 'IND Approval Date', 'Manufacturer',
     'Manufacturer Zipcode', 'Sponsor', 'Product Name', 'Protocol Title', 'Category ID', 
@@ -32,9 +92,109 @@ MEDICAL_DEVICE_STUDY_COLUMN_NAME = [
     'Clinical Trial Detail Name', 'Forein Approval', 'Device ID', 
     'Information Release', 'Deleted', 'Unknown'
 ]
+MEDICAL_DEVICE_STUDY_KEY_COLUMN_NAME = ['Plan Approval No', 'Clinical Trial Approval No']
+MEDICAL_DEVICE_STUDY_SEARCH_COLUMN_NAME = ['Manufacturer', 'Device ID', 'Protocol Title']
+MEDICAL_DEVICE_STUDY_ENTITY_COLUMN_NAME = {'Manufacturer': None}
+MEDICAL_DEVICE_STUDY_COMPANY_COLUMN_NAME = ['Manufacturer', 'Sponsor']
+MEDICAL_DEVICE_STUDY_DISPLAY_COLUMN_NAME = [
+    'Plan Approval No', 'Clinical Trial Approval No', 'IND Approval Date', 'Manufacturer',
+    'Manufacturer Zipcode', 'Sponsor', 'Product Name', 'Protocol Title', 'Forein Approval',
+    'Device ID', 'Information Release', 'Deleted'
+]
+
+# Searches kept by the cross-session query cache (module/query_cache.py)
+QUERY_CACHE_MAX_ENTRIES = 256
+# Typeahead (module/autocomplete.py), built at load time for these entity columns
+SUGGESTION_COLUMN_NAME = ['Sponsor', 'Site', 'Manufacturer']
+SUGGESTION_LIMIT = 8
+# Result viewer, only one page of results is sent to the browser
+RESULT_PAGE_SIZES = [25, 50, 100, 250]
+# While details are fetched, the table shown so far is redrawn after this many responses or seconds,
+# whichever comes first, instead of after every response
+DETAILS_UPDATE_EVERY = 50
+DETAILS_UPDATE_SECONDS = 1.0
+# Exports of results and details (module/exports.py), written EXPORT_CHUNK_ROWS rows at a time.
+# Files over EXPORT_DOWNLOAD_MAX_BYTES are uploaded under EXPORT_DIR in the bucket and served through
+# a signed link valid for EXPORT_LINK_SECONDS, instead of going through the Streamlit websocket
+EXPORT_CHUNK_ROWS = 10000
+EXPORT_DOWNLOAD_MAX_BYTES = 16 * 1024 * 1024
+EXPORT_DIR = 'exports'
+EXPORT_LINK_SECONDS = 24 * 3600
 
 GCS_BUCKET_NAME = 'streamlit-mfds-clinical-trials'
 
+# Local snapshot tier (module/snapshot.py): every process on the host maps the same Arrow file
+# of a stored object version instead of downloading it. The SNAPSHOT_DIR environment variable
+# overrides it, None or an empty value turns it off
+SNAPSHOT_DIR = os.path.join(tempfile.gettempdir(), 'clinical_trials_snapshots')
+
+# Substring search index
+MAX_GRAM_SIZE = 3
+
+# Columns with at most this share of distinct values are stored as categoricals in memory
+CATEGORICAL_MAX_UNIQUE_RATIO = 0.5
+
+# Trial dataset storage ('parquet' or 'jsonl')
+STORAGE_FORMAT = 'parquet'
+PARQUET_COMPRESSION = 'zstd'
+JSONL_CHUNK_SIZE = 1024 * 1024
+# JSONL objects are written compressed ('gzip', 'zstd' or None), readers detect it from the magic bytes
+JSONL_COMPRESSION = 'gzip'
+FILE_EXTENSIONS = {'parquet': 'parquet', 'jsonl': 'json'}
+# Rows serialized at a time, so a write never holds a second copy of the whole frame
+WRITE_CHUNK_ROWS = 20000
+# Uploads go to GCS in blocks of this size (a multiple of 256 KiB)
+UPLOAD_BLOCK_SIZE = 8 * 1024 * 1024
+# One object per update under this prefix, so appending never rewrites the log
+API_CALL_LOG_DIR = 'api_call_logs'
+MEDICATION_TRIAL_FILE_NAME = 'medication_trial_info'
+DEVICE_TRIAL_FILE_NAME = 'device_trial_info'
+MEDICATION_DETAILS_FILE_NAME = 'medication_trial_details'
+# Trend cube stored next to each trial dataset (module/trends.py), e.g. medication_trial_info_trend_cube.parquet
+TREND_CUBE_FILE_SUFFIX = '_trend_cube'
+# Company map stored next to each trial dataset (module/companies.py), e.g. device_trial_info_companies.parquet
+COMPANY_MAP_FILE_SUFFIX = '_companies'
+# Company name keys (normalize_company_name) mapped to the key of the same company's Korean name.
+# Keys are never matched by sound, so every English spelling to join is listed here
+COMPANY_KEY_ALIASES = {
+    'celltrion': 'SEL-TEU-RI-ON',
+    'celltrionhealthcare': 'SEL-TEU-RI-ON-HEL-SEU-KE-EO',
+    'hanmipharm': 'HAN-MI-YAG-PUM',
+    'hanmipharmaceutical': 'HAN-MI-YAG-PUM',
+    'chongkundang': 'JONG-GEUN-DANG',
+    'chongkundangpharm': 'JONG-GEUN-DANG',
+    'chongkundangpharmaceutical': 'JONG-GEUN-DANG',
+    'daewoongpharm': 'DAE-UNG-JE-YAG',
+    'daewoongpharmaceutical': 'DAE-UNG-JE-YAG',
+    'yuhan': 'YU-HAN-YANG-HAENG',
+    'boryung': 'BO-RYEONG',
+    'boryungpharm': 'BO-RYEONG-JE-YAG',
+    'boryungpharmaceutical': 'BO-RYEONG-JE-YAG',
+    'dongast': 'DONG-A-E-SEU-TI',
+    'ildongpharm': 'IL-DONG-JE-YAG',
+    'ildongpharmaceutical': 'IL-DONG-JE-YAG',
+    'jwpharmaceutical': 'jwJUNG-OE-JE-YAG',
+    'samsungbioepis': 'SAM-SEONG-BA-I-O-E-PI-SEU',
+    'vuno': 'BYU-NO',
+    'lunit': 'RU-NIS',
+}
+
+# Hot-path timing (module/metrics.py), the METRICS_ENABLED environment variable overrides it
+METRICS_ENABLED = True
+METRICS_PREFIX = 'trial_finder'
+METRICS_BUCKETS_SECONDS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+# Prometheus text, or JSON if the path ends with .json
+METRICS_DUMP_PATH = 'metrics.prom'
+
+# Startup. With WARM_UP_DATASETS (or the environment variable of the same name), the first script
+# run of a server process starts loading the trial datasets in the background, so the first visit
+# to a trial page does not pay for the download and index build
+WARM_UP_DATASETS = False
+# Budget of benchmarks/bench_startup.py for importing what main.py imports
+STARTUP_IMPORT_BUDGET_SECONDS = 1.5
+# Modules only loaded by the pages drawing charts, reading GCS or calling the API (Streamlit itself loads plotly)
+LAZY_MODULES = ['plotly.express', 'gcsfs', 'requests']
+
 class Function_Status(Enum):
     SUCCESS = 'SUCCESS'
     FAIL = 'FAIL'
\ No newline at end of file
@@ -0,0 +1,220 @@
+import threading
+from dataclasses import dataclass, field
+
+import fsspec
+import numpy as np
+import pandas as pd
+
+from module.constants import *
+from module.storage import *
+from module.search import DateIndex, build_date_index, build_search_index
+from module.aggregates import build_entity_indexes
+from module.autocomplete import build_suggestion_indexes
+from module.query_cache import get_query_cache
+from module.snapshot import load_snapshot
+from module.metrics import span, timed
+
+# Sort rank of missing values, above any value's rank so they come last in both directions
+MISSING_SORT_RANK = np.iinfo(np.int32).max
+
+@dataclass(frozen=True)
+class TrialDataset:
+    '''A trial dataset loaded once per process for one stored object version.'''
+
+    file_name: str
+    version: str
+    dataframe: pd.DataFrame
+    search_index: dict
+    date_index: DateIndex
+    entity_index: dict
+    # Typeahead over the distinct values of the entity columns
+    suggestion_index: dict = field(default_factory=dict)
+    # Filled lazily by get_sort_rank, one array per sorted column
+    sort_ranks: dict = field(default_factory=dict)
+
+    def view(self) -> pd.DataFrame:
+        '''Return a view for a session. It shares the data of every other session's view, so it is
+        only read (selections like .loc[mask] are copies); take a .copy() of it to change anything.'''
+
+        return self.dataframe.copy(deep=False)
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+_loading_locks = {}
+
+@timed('dataset.version_check')
+def get_object_version(conn, file_path: str) -> str:
+    '''Return the version of a stored object with a single metadata call.
+    GCS objects are identified by their generation, other filesystems fall back to etag or mtime.'''
+
+    fs = get_filesystem(conn)
+    # Skip the listing cache, it would hide a newer generation
+    fs.invalidate_cache(file_path)
+    info = fs.info(file_path)
+    for key in ['generation', 'etag', 'md5Hash', 'mtime']:
+        if info.get(key):
+            return str(info[key])
+    return f'{info.get("size")}'
+
+def load_dataset(conn, file_name: str, columns: list = None, search_columns: list = None, entity_columns: dict = None) -> TrialDataset:
+    '''Return the trial dataset shared by every session of this process.
+
+    The stored object is only downloaded again when its version changed. Along with the compacted
+    frame, the search index over `search_columns`, the entity indexes of `entity_columns`
+    ({column: separator}) with their typeahead keys and the IND Approval Date index are built once.'''
+
+    file_path = get_dataset_path(file_name)
+    try:
+        version = get_object_version(conn, file_path)
+    except FileNotFoundError:
+        # Migrate a legacy dataset before its first use
+        read_data(conn, file_name, columns=[])
+        version = get_object_version(conn, file_path)
+
+    key = (
+        file_name, 
+        tuple(columns) if columns is not None else None, 
+        tuple(search_columns) if search_columns is not None else None,
+        tuple(entity_columns.items()) if entity_columns is not None else None,
+        )
+    dataset = _datasets.get(key)
+    if dataset is not None and dataset.version == version:
+        return dataset
+
+    with _datasets_lock:
+        loading_lock = _loading_locks.setdefault(key, threading.Lock())
+
+    # Only one session downloads a new version, the others wait for it
+    with loading_lock:
+        dataset = _datasets.get(key)
+        if dataset is not None and dataset.version == version:
+            return dataset
+
+        # Downloaded by the first process on the host, mapped by the others
+        dataframe = load_snapshot(
+            file_name, get_object_url(conn, file_path), version, columns, 
+            lambda: read_compacted_data(conn, file_name, columns)
+            )
+        with span('dataset.build_indexes'):
+            entity_index = build_entity_indexes(dataframe, entity_columns or {})
+            dataset = TrialDataset(
+                file_name=file_name, 
+                version=version, 
+                dataframe=dataframe, 
+                search_index=build_search_index(dataframe, search_columns or []),
+                date_index=build_date_index(dataframe['IND Approval Date']) if 'IND Approval Date' in dataframe else None,
+                entity_index=entity_index,
+                suggestion_index=build_suggestion_indexes(entity_index),
+                )
+        _datasets[key] = dataset
+        # Cached searches of the previous snapshot can never hit again
+        get_query_cache().invalidate(file_name, version)
+
+    return dataset
+
+def load_medication_dataset(conn) -> TrialDataset:
+    '''Load the medication dataset with the indexes the Medication Trials page and api.py use.'''
+
+    return load_dataset(
+        conn, 
+        MEDICATION_TRIAL_FILE_NAME, 
+        search_columns=MEDICATION_STUDY_SEARCH_COLUMN_NAME, 
+        entity_columns=MEDICATION_STUDY_ENTITY_COLUMN_NAME
+        )
+
+def load_device_dataset(conn) -> TrialDataset:
+    '''Load the device dataset with the indexes the Device Trials page and api.py use (unused code columns are never read).'''
+
+    return load_dataset(
+        conn, 
+        DEVICE_TRIAL_FILE_NAME, 
+        columns=MEDICAL_DEVICE_STUDY_DISPLAY_COLUMN_NAME, 
+        search_columns=MEDICAL_DEVICE_STUDY_SEARCH_COLUMN_NAME,
+        entity_columns=MEDICAL_DEVICE_STUDY_ENTITY_COLUMN_NAME
+        )
+
+def read_compacted_data(conn, file_name: str, columns: list = None) -> pd.DataFrame:
+    dataframe = read_data(conn, file_name, columns=columns)
+    with span('dataset.compact'):
+        return compact_dataframe(dataframe)
+
+def compact_dataframe(dataframe: pd.DataFrame) -> pd.DataFrame:
+    '''Dictionary-encode low-cardinality string columns and keep the rest as Arrow-backed strings.'''
+
+    compacted_columns = {}
+    for column in dataframe.columns:
+        series = dataframe[column]
+        if series.dtype != object:
+            compacted_columns[column] = series
+        elif series.nunique(dropna=True) <= CATEGORICAL_MAX_UNIQUE_RATIO * series.shape[0]:
+            compacted_columns[column] = series.astype('category')
+        else:
+            compacted_columns[column] = series.astype('string[pyarrow]')
+    # The columns are new or belong to the frame being replaced, so they need no copy
+    return pd.DataFrame(compacted_columns, copy=False)
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    '''Per-column memory usage of a frame before and after compact_dataframe.'''
+
+    report = pd.DataFrame({
+        'dtype': after.dtypes.astype(str),
+        'before_bytes': before.memory_usage(index=False, deep=True),
+        'after_bytes': after.memory_usage(index=False, deep=True),
+    })
+    report.loc['Total'] = ['', report['before_bytes'].sum(), report['after_bytes'].sum()]
+    report['ratio'] = (report['after_bytes'] / report['before_bytes']).round(3)
+    return report
+
+def get_sort_rank(dataset: TrialDataset, column: str) -> np.ndarray:
+    '''Return the rank of every row in the column's sort order, computed once per dataset.
+    Equal values share a rank and missing values rank last.'''
+
+    rank = dataset.sort_ranks.get(column)
+    if rank is None:
+        series = dataset.dataframe[column]
+        codes, uniques = pd.factorize(series.astype(str).where(series.notna()), sort=True)
+        rank = np.where(codes == -1, MISSING_SORT_RANK, codes).astype(np.int32)
+        dataset.sort_ranks[column] = rank
+    return rank
+
+def get_sorted_row_ids(dataset: TrialDataset, mask: np.ndarray, sort_columns: list, descending: bool) -> np.ndarray:
+    '''Return the row ids of the masked rows, sorted by sort_columns, missing values last either way.
+    Only the matching rows' ranks are sorted, the rows themselves are never materialized.'''
+
+    row_ids = np.flatnonzero(mask)
+    if sort_columns:
+        # lexsort sorts by its last key first
+        ranks = [get_sort_rank(dataset, column)[row_ids] for column in reversed(sort_columns)]
+        if descending:
+            # Values are reversed, missing ones stay last
+            ranks = [np.where(rank == MISSING_SORT_RANK, MISSING_SORT_RANK, -rank) for rank in ranks]
+        order = np.lexsort(ranks)
+        row_ids = row_ids[order]
+    return row_ids
+
+def get_page_row_ids(dataset: TrialDataset, mask: np.ndarray, sort_columns: list, descending: bool, page: int, page_size: int) -> np.ndarray:
+    '''Return the row ids of one page of the masked rows, sorted by sort_columns.'''
+
+    start = (page - 1) * page_size
+    return get_sorted_row_ids(dataset, mask, sort_columns, descending)[start:start + page_size]
+
+def get_result_sorted_row_ids(dataset: TrialDataset, result, sort_columns: list, descending: bool) -> np.ndarray:
+    '''Return every row id of a search_cached result, sorted by sort_columns.
+    The sorted order is kept with the cached result, so the matches are sorted once per order.'''
+
+    if not sort_columns:
+        return result.row_ids
+    key = (tuple(sort_columns), descending)
+    sorted_row_ids = result.sorted_row_ids.get(key)
+    if sorted_row_ids is None:
+        sorted_row_ids = get_sorted_row_ids(dataset, result.mask(), sort_columns, descending)
+        # Shared between sessions, like the result
+        sorted_row_ids.flags.writeable = False
+        result.sorted_row_ids[key] = sorted_row_ids
+    return sorted_row_ids
+
+def get_result_page_row_ids(dataset: TrialDataset, result, sort_columns: list, descending: bool, page: int, page_size: int) -> np.ndarray:
+    '''Return the row ids of one page of a search_cached result, sorted by sort_columns.'''
+
+    start = (page - 1) * page_size
+    return get_result_sorted_row_ids(dataset, result, sort_columns, descending)[start:start + page_size]
@@ -0,0 +1,134 @@
+import io
+import shutil
+import tempfile
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from module.constants import *
+from module.storage import get_filesystem
+from module.metrics import record, span, timed
+
+# {format: (file extension, MIME type)}
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'Excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+# Rows an Excel sheet holds below its header
+EXCEL_MAX_ROWS = 1048575
+
+def iter_chunks(dataframe: pd.DataFrame, row_ids: np.ndarray, columns: list, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    '''Yield the rows in row_ids, in that order, chunk_rows at a time (at least one, maybe empty, chunk).
+    Only the current chunk is ever copied out of the frame.'''
+
+    for start in range(0, max(row_ids.shape[0], 1), chunk_rows):
+        yield dataframe.iloc[row_ids[start:start + chunk_rows]][columns]
+
+def write_csv(chunks, f) -> None:
+    # UTF-8 with a BOM, so Excel opens the Korean text as such
+    text = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+    for i, chunk in enumerate(chunks):
+        chunk.to_csv(text, header=i == 0, index=False)
+    text.flush()
+    # Leave f open for the caller
+    text.detach()
+
+def write_xlsx(chunks, f, num_of_rows: int) -> None:
+    '''Write the chunks to a single sheet with a write-only workbook, which streams its rows to
+    disk instead of keeping a cell object per value.'''
+
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    if num_of_rows > EXCEL_MAX_ROWS:
+        raise ValueError(f'Excel sheets hold at most {EXCEL_MAX_ROWS:,} rows, export {num_of_rows:,} rows as CSV or Parquet instead.')
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Trials')
+    for i, chunk in enumerate(chunks):
+        if i == 0:
+            sheet.append(list(chunk.columns))
+        # Control characters the API leaves in some texts are not allowed in XML
+        cells = chunk.astype('string').replace(ILLEGAL_CHARACTERS_RE, '', regex=True).astype(object)
+        for row in cells.where(cells.notna(), None).itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(f)
+
+def write_parquet(chunks, f) -> None:
+    '''Write every chunk as its own row group.'''
+
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                # A column without any value in the first chunk would be typed null
+                schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema], metadata=table.schema.metadata)
+                writer = pq.ParquetWriter(f, schema, compression=PARQUET_COMPRESSION)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
+
+@timed('export.write')
+def write_export(dataframe: pd.DataFrame, row_ids: np.ndarray, columns: list, f, file_format: str, chunk_rows: int = EXPORT_CHUNK_ROWS) -> None:
+    '''Write the rows in row_ids with the given columns to an open binary file, chunk by chunk.'''
+
+    chunks = iter_chunks(dataframe, row_ids, columns, chunk_rows)
+    if file_format == 'CSV':
+        write_csv(chunks, f)
+    elif file_format == 'Excel':
+        write_xlsx(chunks, f, row_ids.shape[0])
+    elif file_format == 'Parquet':
+        write_parquet(chunks, f)
+    else:
+        raise ValueError(f'Unknown export format {file_format!r}, expected one of {list(EXPORT_FORMATS)}.')
+
+def get_export_link(conn, file_path: str) -> str:
+    '''Return a signed link to an export at file_path, or None where the filesystem cannot sign one
+    (a local stand-in bucket, or GCS credentials without a private key). Signing does not need
+    the object, so the link is made before uploading.'''
+
+    try:
+        return get_filesystem(conn).sign(file_path, expiration=EXPORT_LINK_SECONDS)
+    except Exception:
+        record('export.sign_failed', 0)
+        return None
+
+def prepare_export(conn, dataframe: pd.DataFrame, row_ids: np.ndarray, columns: list, file_format: str, name: str) -> dict:
+    '''Export the rows in row_ids and return how to get the file.
+
+    The file is written to a local temporary file, one chunk at a time. Up to EXPORT_DOWNLOAD_MAX_BYTES
+    it is returned as data for a download button, a larger one is uploaded to the bucket and
+    returned as a signed link (data is None then). If no link can be signed, the larger file is
+    returned as data too, rather than uploaded behind a link nobody can open.'''
+
+    extension, mime = EXPORT_FORMATS[file_format]
+    file_name = f'{name}_{datetime.now():%Y%m%d_%H%M%S}.{extension}'
+    export = {'file_name': file_name, 'mime': mime, 'rows': int(row_ids.shape[0]), 'data': None, 'url': None}
+
+    with tempfile.TemporaryFile() as f:
+        write_export(dataframe, row_ids, columns, f, file_format)
+        export['bytes'] = f.tell()
+        f.seek(0)
+        if export['bytes'] <= EXPORT_DOWNLOAD_MAX_BYTES:
+            export['data'] = f.read()
+            return export
+
+        # A directory of its own, so two exports of the same second never collide
+        file_path = f'{GCS_BUCKET_NAME}/{EXPORT_DIR}/{uuid.uuid4().hex}/{file_name}'
+        export['url'] = get_export_link(conn, file_path)
+        if export['url'] is None:
+            export['data'] = f.read()
+            return export
+
+        with span('export.upload', export['bytes']):
+            with conn.open(file_path, mode='wb', block_size=UPLOAD_BLOCK_SIZE) as out:
+                shutil.copyfileobj(f, out, UPLOAD_BLOCK_SIZE)
+
+    return export
@@ -0,0 +1,160 @@
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+
+from module.constants import *
+from module.metrics import span
+from module.response_cache import ResponseCache
+
+_session = None
+_session_lock = threading.Lock()
+
+class IncompleteFetchError(Exception):
+    '''Some pages of a trial list could not be fetched. The rows that were fetched must not
+    replace the stored snapshot, they would drop every trial of the missing pages.'''
+
+class RateLimiter:
+    '''Spread request start times so that at most `rate` requests start per second.'''
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            start_time = max(self.next_time, now)
+            self.next_time = start_time + self.interval
+        if start_time > now:
+            time.sleep(start_time - now)
+
+def get_session() -> 'requests.Session':
+    '''Return the process-wide session with a keep-alive connection pool.'''
+
+    # Imported on the first request, pages that only read snapshots never need it
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_REQUESTS)
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+def get_page(url: str, params: dict, limiter: RateLimiter = None, cache: ResponseCache = None, bypass_cache: bool = False) -> dict:
+    '''Make a GET request and return the response body, retrying with exponential backoff.
+    Raise the last error if every attempt failed.
+
+    With a cache, a fresh cached body is returned without a request (or a rate limiter slot).
+    bypass_cache always makes the request, and the new body replaces the cached one.'''
+
+    import requests
+
+    if cache is not None and not bypass_cache:
+        body = cache.get(url, params)
+        if body is not None:
+            return body
+
+    session = get_session()
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter is not None:
+            limiter.wait()
+        try:
+            with span('api.page') as page_span:
+                response = session.get(url, params=params, timeout=REQUEST_TIMEOUT_SECONDS)
+                page_span.add_bytes(len(response.content))
+                response.raise_for_status()
+                # The API answers some errors with a 200 XML body, which fails here as well
+                body = response.json().get('body', {})
+            if cache is not None:
+                cache.put(url, params, body, len(response.content))
+            return body
+        except (requests.exceptions.RequestException, ValueError):
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+def fetch_all(url: str, params_list: list[dict], on_result: Callable = None, cache: ResponseCache = None, bypass_cache: bool = False) -> list:
+    '''Make every request concurrently and return the response bodies (or the raised Exception)
+    in the order of params_list. cache and bypass_cache are passed on to get_page.
+
+    `on_result(index, body, num_of_done, num_of_requests)` is called from the calling thread
+    every time a request finishes, so it can safely drive Streamlit elements.'''
+
+    limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
+    results = [None] * len(params_list)
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        futures = {
+            executor.submit(get_page, url, params, limiter, cache, bypass_cache): index
+            for index, params in enumerate(params_list)
+        }
+        for num_of_done, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                results[index] = e
+            if on_result is not None:
+                on_result(index, results[index], num_of_done, len(params_list))
+
+    return results
+
+def fetch_pages(url: str, params: dict, page_numbers: list[int], on_page: Callable = None) -> dict:
+    '''Fetch the given pages concurrently and return {page_no: items or the raised Exception} in page order.
+    `on_page(page_no, items, num_of_done, num_of_pages)` is called from the calling thread as pages finish.'''
+
+    def on_result(index, body, num_of_done, num_of_pages):
+        if on_page is not None:
+            on_page(page_numbers[index], body if isinstance(body, Exception) else body.get('items', []), num_of_done, num_of_pages)
+
+    bodies = fetch_all(
+        url, 
+        [{**params, 'pageNo': page_no, 'numOfRows': NUM_OF_ROWS} for page_no in page_numbers], 
+        on_result=on_result
+        )
+    return {
+        page_no: body if isinstance(body, Exception) else body.get('items', [])
+        for page_no, body in zip(page_numbers, bodies)
+    }
+
+def load_checkpoint(checkpoint_dir: str, total_count: int) -> dict:
+    '''Return the pages saved by an interrupted fetch as {page_no: items}.
+    A checkpoint taken for a different totalCount is discarded, its pages no longer line up.'''
+
+    try:
+        with open(os.path.join(checkpoint_dir, 'meta.json')) as f:
+            if json.load(f).get('totalCount') != total_count:
+                raise ValueError
+    except (FileNotFoundError, ValueError):
+        clear_checkpoint(checkpoint_dir)
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        with open(os.path.join(checkpoint_dir, 'meta.json'), 'w') as f:
+            json.dump({'totalCount': total_count}, f)
+        return {}
+
+    pages = {}
+    for file_name in os.listdir(checkpoint_dir):
+        if file_name.startswith('page_'):
+            with open(os.path.join(checkpoint_dir, file_name), encoding='utf-8') as f:
+                pages[int(file_name[5:-5])] = json.load(f)
+    return pages
+
+def save_checkpoint_page(checkpoint_dir: str, page_no: int, items: list) -> None:
+    '''Save one fetched page, written to a temporary file first so a crash never leaves half a page.'''
+
+    file_path = os.path.join(checkpoint_dir, f'page_{page_no:05d}.json')
+    with open(f'{file_path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(items, f, ensure_ascii=False)
+    os.replace(f'{file_path}.tmp', file_path)
+
+def clear_checkpoint(checkpoint_dir: str) -> None:
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
@@ -1,12 +1,26 @@
+import os
+import threading
+from math import ceil
+
+import numpy as np
+import pytz
 import streamlit as st
 # from langchain_google_vertexai import ChatVertexAI
 # from google.oauth2 import service_account
 
 from module.utils import *
 from module.constants import *
+from module.datasets import *
+from module.search import parse_date_range
+from module.refresh_lock import open_refresh_lock
+from module.query_cache import QueryResult, get_query_cache, search_cached
+from module.autocomplete import suggest
+from module.trends import get_top_trend_entities, get_trend, get_trend_options, load_trend_cube
+from module.companies import get_company_trials, load_company_index
+from module.exports import EXPORT_FORMATS, prepare_export
+from module.metrics import dump_metrics, is_enabled, reset, snapshot, span, to_prometheus
 
-gcs_info = st.secrets.connections.gcs
-
+# gcs_info = st.secrets.connections.gcs
 # llm = ChatVertexAI(
 #     project=gcs_info['project_id'],
 #     model='gemini-1.5-flash-001',
@@ -18,6 +32,27 @@ gcs_info = st.secrets.connections.gcs
 #     # other params...
 # )
 
+def is_warm_up_enabled() -> bool:
+    return os.environ.get('WARM_UP_DATASETS', str(WARM_UP_DATASETS)).lower() in ('1', 'true')
+
+@st.cache_resource(show_spinner=False)
+def start_warm_up(_conn) -> threading.Thread:
+    '''Load both trial datasets in a background thread, once per server process.
+    A trial page opened meanwhile waits for the same load instead of starting another one.'''
+
+    def warm_up() -> None:
+        for load in [load_medication_dataset, load_device_dataset]:
+            try:
+                with span('startup.warm_up'):
+                    load(_conn)
+            except Exception:
+                # The page loads it again on its first visit and shows the error there
+                pass
+
+    thread = threading.Thread(target=warm_up, name='warm_up_datasets', daemon=True)
+    thread.start()
+    return thread
+
 @st.fragment
 def home() -> None:
     # Set Layout
@@ -31,48 +66,216 @@ def home() -> None:
         status.success(f'API Call Log Check Success!')
 
         # Check if today's date is missing from the DataFrame
-        if st.session_state['today'].split('T')[0] not in st.session_state['api_call_logs_df'].loc[:, 'date'].values:
-            # Fetching Data for update
-            fetch_data(st.session_state['files_connection'], st.session_state['api_call_logs_df'], st.session_state['today'], status)
-            if st.session_state['fetch_data_result_dict']['total_result'] == Function_Status.FAIL:
-                del st.session_state['fetch_data_result_dict']['total_result']
-                for result in st.session_state['fetch_data_result_dict'].keys():
-                    if st.session_state['fetch_data_result_dict'][result]['status'] == Function_Status.SUCCESS:
-                        status.success(st.session_state['fetch_data_result_dict'][result]['message'])
-                    elif st.session_state['fetch_data_result_dict'][result]['status'] == Function_Status.FAIL:
-                        status.error(st.session_state['fetch_data_result_dict'][result]['message'], icon='🚨')
-            else:
-                status.update(label='Update Success. Every data is up to date!', expanded=False, state='complete')
-            
+        if not AUTO_REFRESH_ON_HOME:
+            # Snapshots are refreshed by ingest.py, Home only reports them
+            api_call_logs_df = st.session_state['api_call_logs_df']
+            last_update = f"{api_call_logs_df['date'].iloc[-1]} {api_call_logs_df['time'].iloc[-1]}" if not api_call_logs_df.empty else 'never'
+            status.update(label=f'Last update: {last_update}', expanded=False, state='complete')
+        elif st.session_state['today'].split('T')[0] not in st.session_state['api_call_logs_df'].loc[:, 'date'].values:
+            # Fetching Data for update, unless another session already is
+            refresh_data(status, skip_if_updated_today=True)
         else:
             status.update(label=f'Already updated today. Every data is up to date!', expanded=False, state='complete')
 
+    full_refresh = columns[1].checkbox(
+        'Full rebuild',
+        help=f'''Download every page again instead of only new or changed ones. Updates only read the newest pages, so changes
+        to older trials show up with the next full rebuild, made automatically every {FULL_REFRESH_MAX_AGE_DAYS} days.'''
+        )
     if columns[1].button('Update Now'):
         status.update(label='Update Now...', expanded=True)
         # Fetching Data for update
-        fetch_data(st.session_state['files_connection'], st.session_state['api_call_logs_df'], st.session_state['today'], status)
-        if st.session_state['fetch_data_result_dict']['total_result'] == Function_Status.FAIL:
-            del st.session_state['fetch_data_result_dict']['total_result']
-            for result in st.session_state['fetch_data_result_dict'].keys():
-                if st.session_state['fetch_data_result_dict'][result]['status'] == Function_Status.SUCCESS:
-                    status.success(st.session_state['fetch_data_result_dict'][result]['message'])
-                elif st.session_state['fetch_data_result_dict'][result]['status'] == Function_Status.FAIL:
-                    status.error(st.session_state['fetch_data_result_dict'][result]['message'], icon='🚨')
+        refresh_data(status, full_refresh=full_refresh)
+
+def refresh_data(status, full_refresh: bool = False, skip_if_updated_today: bool = False) -> None:
+    '''Run fetch_data under the refresh lock, so only one session crawls the API at a time.
+    A session that finds a refresh running waits for it, then falls back to the last snapshot.'''
+
+    conn = get_files_connection()
+    refresh_lock = open_refresh_lock(conn)
+    if not refresh_lock.acquire():
+        holder = refresh_lock.holder()
+        if holder is not None:
+            started_at = datetime.fromtimestamp(holder['acquired_at'], tz=pytz.timezone('Asia/Seoul')).strftime('%H:%M:%S')
+            status.info(f'Another session started an update at {started_at}. Waiting for it to finish...')
+        if refresh_lock.wait():
+            st.session_state['api_call_logs_df'] = read_api_call_logs(conn)
+            status.update(label='Updated by another session. Every data is up to date!', expanded=False, state='complete')
         else:
-            status.update(label='Update Success. Every data is up to date!', expanded=False, state='complete')
+            status.update(label='An update is still running in another session. Showing the last snapshot.', expanded=False, state='complete')
+        return None
+
+    try:
+        # Another session may have finished an update between the log check and taking the lock
+        st.session_state['api_call_logs_df'] = read_api_call_logs(conn)
+        if skip_if_updated_today and st.session_state['today'].split('T')[0] in st.session_state['api_call_logs_df']['date'].values:
+            status.update(label='Updated by another session. Every data is up to date!', expanded=False, state='complete')
+            return None
+        fetch_data(conn, st.session_state['api_call_logs_df'], st.session_state['today'], status, full_refresh=full_refresh)
+    finally:
+        refresh_lock.release()
+
+    if refresh_lock.lost:
+        status.warning(':orange[The update took longer than its lease and another session took over.]', icon='⚠️')
+    if st.session_state['fetch_data_result_dict']['total_result'] == Function_Status.FAIL:
+        del st.session_state['fetch_data_result_dict']['total_result']
+        for result in st.session_state['fetch_data_result_dict'].keys():
+            if st.session_state['fetch_data_result_dict'][result]['status'] == Function_Status.SUCCESS:
+                status.success(st.session_state['fetch_data_result_dict'][result]['message'])
+            elif st.session_state['fetch_data_result_dict'][result]['status'] == Function_Status.FAIL:
+                status.error(st.session_state['fetch_data_result_dict'][result]['message'], icon='🚨')
+    else:
+        status.update(label='Update Success. Every data is up to date!', expanded=False, state='complete')
+
+def date_input(key: str) -> None:
+    '''IND Approval Date range inputs. From alone covers the whole period it names.'''
+
+    date_help = '''Available Input: YYYY | YYYYMM | YYYYMMDD | YYYYQ1~4. 
+    From alone matches that whole period, To alone matches everything up to the end of it.'''
+    # Stacked, the inputs already sit in the form's columns inside the page's columns
+    st.text_input(
+        '''IND Approval Date :blue[From]''', 
+        key=f'{key}_date_from', 
+        max_chars=8, 
+        placeholder='YYYYMMDD',
+        help=date_help
+        )
+    st.text_input(
+        '''IND Approval Date :blue[To]''', 
+        key=f'{key}_date_to', 
+        max_chars=8, 
+        placeholder='YYYYMMDD',
+        help=date_help
+        )
+
+def pick_suggestion(key: str, input_key: str) -> None:
+    pills_key = f'{key}_suggest_{input_key}'
+    st.session_state[input_key] = st.session_state[pills_key]
+    st.session_state[pills_key] = None
+    st.session_state[f'{key}_suggestion_picked'] = True
+
+@st.fragment
+def suggestion_box(key: str, dataset: TrialDataset, input_keys: dict) -> None:
+    '''Typeahead for the entity inputs of a search form ({column: input key}), with trial counts.
+    Picking a suggestion fills the form input with it.'''
+
+    if st.session_state.pop(f'{key}_suggestion_picked', False):
+        # The form is outside this fragment
+        st.rerun()
+
+    query = st.text_input(
+        'Quick find', 
+        key=f'{key}_suggest_query', 
+        placeholder='ㅅㅈㅈㅇ | samjin | 서울대',
+        help='Start of a name or of any word in it, its initial consonants (초성) or its romanization.'
+        )
+    if not query:
+        return None
+
+    num_of_suggestions = 0
+    for column, input_key in input_keys.items():
+        # Answered from the prefix keys built with the dataset, not by scanning it
+        suggestions = dict(suggest(dataset.suggestion_index[column], query))
+        if suggestions:
+            num_of_suggestions += len(suggestions)
+            st.pills(
+                column, 
+                options=list(suggestions), 
+                format_func=lambda name, suggestions=suggestions: f'{name} ({suggestions[name]:,})', 
+                key=f'{key}_suggest_{input_key}', 
+                on_change=pick_suggestion, 
+                args=(key, input_key)
+                )
+    if num_of_suggestions == 0:
+        st.caption(f'No {" or ".join(input_keys)} starts with "{query}"')
+
+@st.fragment
+def result_viewer(key: str, dataset: TrialDataset, result) -> None:
+    '''Show one page of the rows of a search_cached result. Only that page, with the chosen columns, is sent to the browser.'''
+
+    num_of_matches = result.row_ids.shape[0]
+    columns = list(dataset.dataframe.columns)
+
+    control_columns = st.columns([3, 2, 1, 1], vertical_alignment='bottom')
+    visible_columns = control_columns[0].multiselect('Columns', options=columns, default=columns, key=f'{key}_columns')
+    sort_columns = control_columns[1].multiselect('Sort by', options=columns, key=f'{key}_sort')
+    descending = control_columns[2].toggle('Descending', key=f'{key}_descending')
+    page_size = control_columns[3].selectbox('Rows', options=RESULT_PAGE_SIZES, key=f'{key}_page_size')
+
+    num_of_pages = max(ceil(num_of_matches / page_size), 1)
+    if st.session_state.get(f'{key}_page', 1) > num_of_pages:
+        # A larger page size left fewer pages
+        st.session_state[f'{key}_page'] = num_of_pages
+    page = st.number_input(f'Page (of {num_of_pages:,})', min_value=1, max_value=num_of_pages, key=f'{key}_page')
+
+    with span('viewer.page'):
+        # Sorted once per order and kept with the cached result, so reruns only slice it
+        row_ids = get_result_page_row_ids(dataset, result, sort_columns, descending, page, page_size)
+        st.caption(f'{num_of_matches:,} matches, showing {(page - 1) * page_size + 1:,}~{(page - 1) * page_size + row_ids.shape[0]:,}')
+        st.dataframe(dataset.dataframe.iloc[row_ids][visible_columns or columns], hide_index=True)
+
+    export_box(key, dataset.dataframe, get_result_sorted_row_ids(dataset, result, sort_columns, descending), visible_columns or columns)
+
+def export_box(key: str, dataframe: pd.DataFrame, row_ids: np.ndarray, columns: list) -> None:
+    '''Export the rows in row_ids, in that order, as CSV, Excel or Parquet.
+    Small files are offered as a download, larger ones are uploaded to the bucket and linked.'''
+
+    control_columns = st.columns([1, 1, 2], vertical_alignment='bottom')
+    file_format = control_columns[0].selectbox('Export as', options=list(EXPORT_FORMATS), key=f'{key}_export_format')
+    # A prepared export is only offered for the rows, columns and format it was made of.
+    # It holds on to its dataframe and row ids, so comparing them by identity is enough for the
+    # sorted row ids cached with a search result, other row ids are compared by value.
+    signature = (tuple(columns), file_format)
+    export = st.session_state.get(f'{key}_export')
+    if export is not None and (
+        export['signature'] != signature
+        or export['dataframe'] is not dataframe
+        or not (export['row_ids'] is row_ids or np.array_equal(export['row_ids'], row_ids))
+    ):
+        export = st.session_state[f'{key}_export'] = None
+
+    if control_columns[1].button(f'Export {row_ids.shape[0]:,} rows', key=f'{key}_export_button', use_container_width=True):
+        try:
+            with st.spinner('Writing the export...'):
+                export = {**prepare_export(get_files_connection(), dataframe, row_ids, columns, file_format, key), 'signature': signature, 'dataframe': dataframe, 'row_ids': row_ids}
+        except ValueError as e:
+            control_columns[2].error(str(e), icon='🚨')
+            return None
+        st.session_state[f'{key}_export'] = export
+
+    if export is None:
+        return None
+    if export['data'] is not None:
+        control_columns[2].download_button(
+            f'Download {export["file_name"]}', 
+            data=export['data'], 
+            file_name=export['file_name'], 
+            mime=export['mime'], 
+            key=f'{key}_download', 
+            use_container_width=True
+            )
+        if export['bytes'] > EXPORT_DOWNLOAD_MAX_BYTES:
+            st.warning(f':orange[{export["bytes"]:,} bytes. No download link could be signed for the bucket, so the file is sent through the app and may take a while.]', icon='⚠️')
+    else:
+        control_columns[2].link_button(f'Open {export["file_name"]}', export['url'], use_container_width=True)
+        st.caption(f'{export["bytes"]:,} bytes, too large to send through the app. The link is valid for {EXPORT_LINK_SECONDS // 3600} hours.')
 
 @st.fragment
 def medication_tirals_page() -> None:
-    conn = st.session_state['files_connection']
-    medication_trial_json_bytes = conn.open(f'{GCS_BUCKET_NAME}/medication_trial_info.json', mode='rb')
+    conn = get_files_connection()
     
     columns = st.columns([2,1], border=True)
     tabs = columns[1].tabs(['Top 10 Sponsors', 'Top 10 Sites'])
 
     with columns[0]:
         st.title(':blue[Medication] Clinical Trial Information :blue[Finder] (2012~)')
-        medication_trial_list = decoding_json_bytes(medication_trial_json_bytes)
-        st.session_state['medication_df'] = pd.DataFrame(medication_trial_list)
+        # Shared by every session until the stored object changes
+        medication_dataset = load_medication_dataset(conn)
+        st.session_state['medication_dataset'] = medication_dataset
+        st.session_state['medication_df'] = medication_dataset.view()
+        if st.session_state['medication_filter'] == 'DONE' and st.session_state['medication_filtered_version'] != medication_dataset.version:
+            # A newer snapshot was loaded since the last search, its row mask no longer lines up
+            search_medication_trials()
     
         # Calling API done
         st.session_state['medication_retrieve'] = 'DONE'
@@ -81,17 +284,19 @@ def medication_tirals_page() -> None:
             medication_trials()
 
         if st.session_state['medication_filter'] == 'DONE':
-            if st.session_state['medication_filtered_df'].empty:
+            if st.session_state['medication_query_result'].row_ids.shape[0] == 0:
                 st.error('Study Not Found')
             else: 
-                st.dataframe(st.session_state['medication_filtered_df'])
+                result_viewer('medication_result', medication_dataset, st.session_state['medication_query_result'])
 
                 medication_details()
 
-                with tabs[0]:
-                    st.plotly_chart(top10_sponsors_plot(st.session_state['medication_filtered_df']))
-                with tabs[1]:
-                    st.plotly_chart(top10_sites_plot(st.session_state['medication_filtered_df']))
+                # Counted once per search, along with the matching rows
+                top_entities = st.session_state['medication_query_result'].top_entities
+                with tabs[0], span('plot.build'):
+                    st.plotly_chart(top10_sponsors_plot(top_entities['Sponsor']))
+                with tabs[1], span('plot.build'):
+                    st.plotly_chart(top10_sites_plot(top_entities['Site']))
 
 @st.fragment
 def medication_trials() -> None:
@@ -99,72 +304,97 @@ def medication_trials() -> None:
         st.empty()
 
     else:
+        suggestion_box('medication', st.session_state['medication_dataset'], {'Sponsor': 'sponsor', 'Site': 'site'})
         form = st.form(key='medication_trials_filter', enter_to_submit=True)
         form_columns = form.columns(2)
         with form_columns[0]:
             st.text_input('Sponsor', key='sponsor', placeholder='삼진제약')
-            st.text_input(
-                '''IND Approval Date (Available Input: :blue[YYYY] | 
-                :blue[YYYY]:orange[MM] | :blue[YYYY]:orange[MM]:green[DD])''', 
-                key='date', 
-                max_chars=8, 
-                placeholder='YYYYMMDD'
-                )
+            date_input(key='medication')
         with form_columns[1]:
             st.text_input('Site', key='site', placeholder='서울대학교병원')
             st.text_input('Protocol Title', key='title', placeholder='급성')
         
         # Filtering Dataframe
         if form.form_submit_button('Search', use_container_width=True):
-            medication_filtered_df = st.session_state['medication_df'].copy()
-            medication_filtered_df = medication_filtered_df[
-                medication_filtered_df['Sponsor'].str.contains(st.session_state['sponsor'], case=False)
-                &medication_filtered_df['IND Approval Date'].str.contains(st.session_state['date'], case=False)
-                &medication_filtered_df['Site'].str.contains(st.session_state['site'], case=False)
-                &medication_filtered_df['Protocol Title'].str.contains(st.session_state['title'], case=False)
-                ]
-            st.session_state['medication_filtered_df'] = medication_filtered_df
-            st.session_state['medication_filter'] = 'DONE'
+            try:
+                search_medication_trials()
+            except ValueError as e:
+                form.error(str(e), icon='🚨')
+                return None
 
             # rerun superier fragment
             st.rerun()
 
     return None
 
+def search_medication_trials() -> None:
+    '''Filter the medication dataset with the search inputs in session_state.
+    Raise ValueError for an invalid date input.'''
+
+    medication_dataset = st.session_state['medication_dataset']
+    date_range = parse_date_range(st.session_state['medication_date_from'], st.session_state['medication_date_to'])
+    # Shared by every session that runs the same search on this snapshot
+    medication_query_result = search_cached(medication_dataset, {
+        'Sponsor': st.session_state['sponsor'],
+        'Site': st.session_state['site'],
+        'Protocol Title': st.session_state['title'],
+        }, date_range=date_range)
+
+    st.session_state['medication_query_result'] = medication_query_result
+    st.session_state['medication_filtered_mask'] = medication_query_result.mask()
+    st.session_state['medication_filtered_version'] = medication_dataset.version
+    st.session_state['medication_filter'] = 'DONE'
+    # A new result starts on its first page
+    st.session_state.pop('medication_result_page', None)
+    # Details of the previous result are fetched again on request
+    st.session_state['medication_details_df'] = pd.DataFrame
+
 @st.fragment
 def medication_details() -> None:
     # Displaying the details button
     if st.button('Search Details', use_container_width=True):
-        medication_details_df = fetch_medication_details_data(dataframe=st.session_state['medication_filtered_df'])
-        st.dataframe(medication_details_df)
+        progress_bar = st.progress(value=0, text='Loading stored details...')
+        details_table = st.empty()
 
-        return None
+        # Show the rows collected so far every few responses instead of waiting for every request
+        def on_chunk(details_df, num_of_done, num_of_ids):
+            details_table.dataframe(details_df)
+            if num_of_ids:
+                progress_bar.progress(num_of_done / num_of_ids, text=f'Fetched {num_of_done}/{num_of_ids} new details...')
+
+        medication_details_df = fetch_medication_details_data(
+            dataframe=st.session_state['medication_df'].loc[st.session_state['medication_filtered_mask'], ['Clinical Trial ID']], 
+            conn=get_files_connection(), 
+            on_chunk=on_chunk
+            )
+        progress_bar.empty()
+        details_table.dataframe(medication_details_df)
+        st.session_state['medication_details_df'] = medication_details_df
+    elif isinstance(st.session_state['medication_details_df'], pd.DataFrame):
+        # Still shown when the export below reruns the fragment
+        st.dataframe(st.session_state['medication_details_df'])
+
+    medication_details_df = st.session_state['medication_details_df']
+    if isinstance(medication_details_df, pd.DataFrame) and not medication_details_df.empty:
+        export_box('medication_details', medication_details_df, np.arange(medication_details_df.shape[0]), list(medication_details_df.columns))
+
+    return None
 
 def device_tirals_page() -> None:
-    conn = st.session_state['files_connection']
-    device_trial_json_bytes = conn.open(f'{GCS_BUCKET_NAME}/device_trial_info.json', mode='rb')
+    conn = get_files_connection()
     
     columns = st.columns([2,1], border=True)
     tabs = columns[1].tabs(['Top 10 Manufacturer'])
     
     with columns[0]:
         st.title(':green[Device] Clinical Trial Information :green[Finder] (2003~)')
-        # device_trial_df = conn.read(f'{GCS_BUCKET_NAME}/device_trial_info.json', input_format='jsonl', encoding='utf-8', dtype=str)
-        device_trial_list = decoding_json_bytes(device_trial_json_bytes)
-        device_df = pd.DataFrame(device_trial_list)
-
-        # Cleaning device trail dataframe
-        device_df.drop(columns=[
-            'Unknown', 
-            'Category ID', 
-            'Clinical Trial ID Code', 
-            'Clinical Trial ID Name', 
-            'Clinical Trial Detail Code', 
-            'Clinical Trial Detail Name'
-            ], inplace=True)
-        device_df['IND Approval Date'] = device_df['IND Approval Date'].str.replace('-', '')
-
-        st.session_state['device_df'] = device_df
+        # Shared by every session until the stored object changes (unused code columns are never read)
+        device_dataset = load_device_dataset(conn)
+        st.session_state['device_dataset'] = device_dataset
+        st.session_state['device_df'] = device_dataset.view()
+        if st.session_state['device_filter'] == 'DONE' and st.session_state['device_filtered_version'] != device_dataset.version:
+            # A newer snapshot was loaded since the last search, its row mask no longer lines up
+            search_device_trials()
 
         # Calling API done
         st.session_state['device_retrieve'] = 'DONE'
@@ -173,44 +403,195 @@ def device_tirals_page() -> None:
             device_trials()
 
         if st.session_state['device_filter'] == 'DONE':
-            if st.session_state['device_filtered_df'].empty:
+            if st.session_state['device_query_result'].row_ids.shape[0] == 0:
                 st.error('Study Not Found')
             else:
-                st.dataframe(st.session_state['device_filtered_df'])
+                result_viewer('device_result', device_dataset, st.session_state['device_query_result'])
 
-                with tabs[0]:
-                    st.plotly_chart(top10_Manufacturer_plot(st.session_state['device_filtered_df']))
+                with tabs[0], span('plot.build'):
+                    st.plotly_chart(top10_Manufacturer_plot(st.session_state['device_query_result'].top_entities['Manufacturer']))
 
 def device_trials() -> None:
+    suggestion_box('device', st.session_state['device_dataset'], {'Manufacturer': 'manufacturer'})
     form = st.form(key='search_device_trial')
     form_columns = form.columns(2)
     with form_columns[0]:
         st.text_input('Manufacturer', key='manufacturer', placeholder='뷰노')
-        st.text_input(
-            '''IND Approval Date (Available Input: :blue[YYYY] | 
-            :blue[YYYY]:orange[MM] | :blue[YYYY]:orange[MM]:green[DD])''', 
-            key='date', 
-            max_chars=8, 
-            placeholder='YYYYMMDD'
-            )
+        date_input(key='device')
     with form_columns[1]:
         st.text_input('Device ID', key='device_id', placeholder='D06080.01')
         st.text_input('Protocol Title', key='title', placeholder='파킨슨')
     
     if form.form_submit_button('Search', use_container_width=True):
-        device_filtered_df = st.session_state['device_df'].copy()
-        device_filtered_df = device_filtered_df[
-            device_filtered_df['Manufacturer'].str.contains(st.session_state['manufacturer'], case=False)
-            &device_filtered_df['IND Approval Date'].str.contains(st.session_state['date'], case=False)
-            &device_filtered_df['Device ID'].str.contains(st.session_state['device_id'], case=False)
-            &device_filtered_df['Protocol Title'].str.contains(st.session_state['title'], case=False)
-            ]
-        st.session_state['device_filtered_df'] = device_filtered_df
-        st.session_state['device_filter'] = 'DONE'
+        try:
+            search_device_trials()
+        except ValueError as e:
+            form.error(str(e), icon='🚨')
+            return None
 
         # rerun superier fragment
         st.rerun()
 
+def search_device_trials() -> None:
+    '''Filter the device dataset with the search inputs in session_state.
+    Raise ValueError for an invalid date input.'''
+
+    device_dataset = st.session_state['device_dataset']
+    date_range = parse_date_range(st.session_state['device_date_from'], st.session_state['device_date_to'])
+    # Shared by every session that runs the same search on this snapshot
+    device_query_result = search_cached(device_dataset, {
+        'Manufacturer': st.session_state['manufacturer'],
+        'Device ID': st.session_state['device_id'],
+        'Protocol Title': st.session_state['title'],
+        }, date_range=date_range)
+
+    st.session_state['device_query_result'] = device_query_result
+    st.session_state['device_filtered_mask'] = device_query_result.mask()
+    st.session_state['device_filtered_version'] = device_dataset.version
+    st.session_state['device_filter'] = 'DONE'
+    # A new result starts on its first page
+    st.session_state.pop('device_result_page', None)
+
+def trends_page() -> None:
+    '''Trial counts over time, answered from the trend cubes instead of the trial datasets.'''
+
+    conn = get_files_connection()
+    st.title('Clinical Trial :blue[Trends]')
+    control_columns = st.columns(2)
+    dataset_name = control_columns[0].radio('Dataset', ['Medication', 'Device'], horizontal=True, key='trends_dataset')
+    granularity = control_columns[1].radio('Period', ['Year', 'Month'], horizontal=True, key='trends_granularity')
+
+    try:
+        with span('trends.load_cube'):
+            trend_cube = load_trend_cube(conn, MEDICATION_TRIAL_FILE_NAME if dataset_name == 'Medication' else DEVICE_TRIAL_FILE_NAME)
+    except FileNotFoundError:
+        st.info('No trials stored yet. Update the data from Home first.')
+        return None
+
+    if dataset_name == 'Medication':
+        tabs = st.tabs(['Trials by Phase', 'Sponsors over Time', 'Sites over Time'])
+        with tabs[0]:
+            st.bar_chart(get_trend(trend_cube, 'Phase', 'Phase', granularity))
+        with tabs[1]:
+            entity_trend(trend_cube, 'Sponsor', granularity)
+        with tabs[2]:
+            entity_trend(trend_cube, 'Site', granularity)
+    else:
+        tabs = st.tabs(['Approvals by Manufacturer'])
+        with tabs[0]:
+            entity_trend(trend_cube, 'Manufacturer', granularity)
+
+def entity_trend(trend_cube, column: str, granularity: str) -> None:
+    '''Line chart of the chosen entities of one cuboid, the top 5 by default.'''
+
+    phase_options = get_trend_options(trend_cube, 'Phase', 'Phase')
+    phases = st.multiselect('Phase', options=phase_options, key=f'trends_{column}_phases') if phase_options else []
+    entities = st.multiselect(
+        column, 
+        options=get_trend_options(trend_cube, column, 'Entity'), 
+        default=get_top_trend_entities(trend_cube, column, n=5), 
+        key=f'trends_{column}_entities'
+        )
+    if not entities:
+        st.caption(f'Choose at least one {column}.')
+        return None
+    st.line_chart(get_trend(trend_cube, column, 'Entity', granularity, phases=phases, entities=entities))
+
+def reset_company_pages() -> None:
+    # Another company's trials start on their first page
+    for key in ['company_medication_page', 'company_device_page']:
+        st.session_state.pop(key, None)
+
+def company_page() -> None:
+    '''Medication and device trials of one company, however each dataset spells its name.'''
+
+    conn = get_files_connection()
+    st.title('Company :blue[Trials]')
+    try:
+        with span('companies.load_index'):
+            company_index = load_company_index(conn)
+    except FileNotFoundError:
+        st.info('No trials stored yet. Update the data from Home first.')
+        return None
+
+    companies = company_index.companies
+    company_id = st.selectbox(
+        'Company', 
+        options=companies.index, 
+        index=None, 
+        format_func=lambda company_id: f'{companies.at[company_id, "Company"]} ({companies.at[company_id, "Medication Trials"]:,} medication, {companies.at[company_id, "Device Trials"]:,} device trials)', 
+        placeholder='Sponsor or manufacturer, e.g. 한미약품', 
+        key='company_id', 
+        on_change=reset_company_pages
+        )
+    if company_id is None:
+        st.caption(f'{companies.shape[0]:,} companies across the medication and device trials.')
+        return None
+
+    company = companies.loc[company_id]
+    other_names = [name for name in company['Names'] if name != company['Company']]
+    if other_names:
+        st.caption(f'Also listed as {", ".join(other_names)}')
+
+    tabs = st.tabs([f'Medication Trials ({company["Medication Trials"]:,})', f'Device Trials ({company["Device Trials"]:,})'])
+    for tab, key, file_name in zip(tabs, ['medication', 'device'], [MEDICATION_TRIAL_FILE_NAME, DEVICE_TRIAL_FILE_NAME]):
+        with tab:
+            row_ids = get_company_trials(company_index, file_name, company_id)
+            if row_ids.size == 0:
+                st.caption(f'No {key} trials.')
+                continue
+            dataset = company_index.datasets[file_name]
+            # Kept while the same company index serves the company, so its sorted orders are reused
+            result = st.session_state.get(f'company_{key}_result')
+            if result is None or result.row_ids is not row_ids:
+                result = QueryResult(row_ids=row_ids, num_of_rows=dataset.dataframe.shape[0], top_entities={})
+                st.session_state[f'company_{key}_result'] = result
+            result_viewer(f'company_{key}', dataset, result)
+
+def metrics_page() -> None:
+    '''Admin page with the hot-path latency histograms of this server process.'''
+
+    st.title('Metrics')
+    if not is_enabled():
+        st.info('Metrics are disabled. Set METRICS_ENABLED to enable them.')
+        return None
+
+    stages = snapshot()
+    st.caption('Latency and bytes per stage since this server process started (or since the last reset).')
+    if stages:
+        metrics_df = pd.DataFrame.from_dict(stages, orient='index').drop(columns=['buckets'])
+        metrics_df[['total_seconds', 'mean_seconds', 'p50_seconds', 'p95_seconds', 'max_seconds']] *= 1000
+        metrics_df.columns = ['Count', 'Total (ms)', 'Mean (ms)', 'p50 (ms)', 'p95 (ms)', 'Max (ms)', 'Bytes']
+        st.dataframe(metrics_df.round(2), use_container_width=True)
+    else:
+        st.info('Nothing recorded yet. Open a trial page or run an update first.')
+
+    columns = st.columns(4)
+    columns[0].download_button('Prometheus text', data=to_prometheus(stages), file_name='metrics.prom', mime='text/plain', use_container_width=True)
+    columns[1].download_button('JSON', data=json.dumps(stages, indent=2), file_name='metrics.json', mime='application/json', use_container_width=True)
+    if columns[2].button(f'Write {METRICS_DUMP_PATH}', use_container_width=True):
+        dump_metrics(METRICS_DUMP_PATH)
+        st.toast(f'Metrics written to {METRICS_DUMP_PATH}')
+    if columns[3].button('Reset', use_container_width=True):
+        reset()
+        st.rerun()
+
+    st.subheader('Query Cache')
+    cache_stats = get_query_cache().stats()
+    columns = st.columns(5)
+    columns[0].metric('Entries', f'{cache_stats["entries"]:,} / {cache_stats["max_entries"]:,}')
+    columns[1].metric('Hit Rate', f'{cache_stats["hit_rate"]:.1%}', help=f'{cache_stats["hits"]:,} hits, {cache_stats["misses"]:,} misses')
+    columns[2].metric('Evictions', f'{cache_stats["evictions"]:,}')
+    columns[3].metric('Invalidations', f'{cache_stats["invalidations"]:,}', help='Entries dropped when a new snapshot was loaded')
+    columns[4].metric('Row ID Bytes', f'{cache_stats["bytes"]:,}')
+
+    st.subheader('API Response Cache')
+    cache_stats = get_response_cache().stats()
+    columns = st.columns(3)
+    columns[0].metric('Entries', f'{cache_stats["entries"]:,}')
+    columns[1].metric('Hit Rate', f'{cache_stats["hit_rate"]:.1%}', help=f'{cache_stats["hits"]:,} hits, {cache_stats["misses"]:,} misses')
+    columns[2].metric('Bytes', f'{cache_stats["bytes"]:,}')
+
 # @st.fragment
 # def medication_chatbot(medication_df) -> None:
 #     # AI Chatbot
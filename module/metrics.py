@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from module.constants import *
+
+class Histogram:
+    '''Latency histogram of one stage, with the bytes it moved.'''
+
+    def __init__(self, buckets: list = METRICS_BUCKETS_SECONDS) -> None:
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float, num_of_bytes: int = 0) -> None:
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        with self.lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.total_bytes += num_of_bytes
+
+    def quantile(self, q: float) -> float:
+        '''Upper bound of the bucket holding the q-quantile (the max for the overflow bucket).'''
+
+        rank = q * self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + [self.max_seconds], self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank and cumulative > 0:
+                return min(bound, self.max_seconds)
+        return 0.0
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                'count': self.count,
+                'total_seconds': self.total_seconds,
+                'mean_seconds': self.total_seconds / self.count if self.count else 0.0,
+                'p50_seconds': self.quantile(0.5),
+                'p95_seconds': self.quantile(0.95),
+                'max_seconds': self.max_seconds,
+                'total_bytes': self.total_bytes,
+                'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], self.bucket_counts)),
+            }
+
+class Span:
+    '''Timer of one stage run. Bytes can be added while it is open.'''
+
+    def __init__(self) -> None:
+        self.num_of_bytes = 0
+
+    def add_bytes(self, num_of_bytes: int) -> None:
+        self.num_of_bytes += num_of_bytes
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+# Shared by every disabled span, it records nothing
+_null_span = Span()
+
+def is_enabled() -> bool:
+    return os.environ.get('METRICS_ENABLED', str(METRICS_ENABLED)).lower() in ('1', 'true')
+
+def record(stage: str, seconds: float, num_of_bytes: int = 0) -> None:
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(stage, Histogram())
+    histogram.observe(seconds, num_of_bytes)
+
+@contextmanager
+def span(stage: str, num_of_bytes: int = 0):
+    '''Time the block as one run of the stage. Does nothing when metrics are disabled.'''
+
+    if not is_enabled():
+        yield _null_span
+        return
+
+    current_span = Span()
+    current_span.add_bytes(num_of_bytes)
+    start_time = time.perf_counter()
+    try:
+        yield current_span
+    finally:
+        record(stage, time.perf_counter() - start_time, current_span.num_of_bytes)
+
+def timed(stage: str):
+    '''Decorator form of span.'''
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def snapshot() -> dict:
+    '''Return {stage: histogram summary} of everything recorded in this process.'''
+
+    with _histograms_lock:
+        histograms = dict(_histograms)
+    return {stage: histogram.to_dict() for stage, histogram in sorted(histograms.items())}
+
+def reset() -> None:
+    with _histograms_lock:
+        _histograms.clear()
+
+def to_prometheus(stages: dict = None) -> str:
+    '''Render the histograms in the Prometheus text exposition format.'''
+
+    stages = snapshot() if stages is None else stages
+    lines = [
+        f'# HELP {METRICS_PREFIX}_stage_seconds Latency of each hot-path stage.',
+        f'# TYPE {METRICS_PREFIX}_stage_seconds histogram',
+    ]
+    for stage, summary in stages.items():
+        cumulative = 0
+        for bound, bucket_count in summary['buckets'].items():
+            cumulative += bucket_count
+            lines.append(f'{METRICS_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRICS_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {summary["total_seconds"]}')
+        lines.append(f'{METRICS_PREFIX}_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+    lines += [
+        f'# HELP {METRICS_PREFIX}_stage_bytes_total Bytes read, written or downloaded by each stage.',
+        f'# TYPE {METRICS_PREFIX}_stage_bytes_total counter',
+    ]
+    for stage, summary in stages.items():
+        lines.append(f'{METRICS_PREFIX}_stage_bytes_total{{stage="{stage}"}} {summary["total_bytes"]}')
+    return '\n'.join(lines) + '\n'
+
+def dump_metrics(file_path: str = METRICS_DUMP_PATH) -> None:
+    '''Write the metrics to a file, as JSON for .json paths and Prometheus text otherwise.'''
+
+    stages = snapshot()
+    content = json.dumps(stages, indent=2) if file_path.endswith('.json') else to_prometheus(stages)
+    with open(f'{file_path}.tmp', 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(f'{file_path}.tmp', file_path)
@@ -0,0 +1,121 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from module.constants import *
+from module.search import search_dataframe
+from module.aggregates import top_entities
+
+@dataclass(frozen=True)
+class QueryResult:
+    '''Rows matching one search over one dataset version, with the Top 10 of every entity column.'''
+
+    row_ids: np.ndarray
+    num_of_rows: int
+    top_entities: dict
+    # Filled lazily by get_result_page_row_ids, {(sort columns, descending): sorted row ids}
+    sorted_row_ids: dict = field(default_factory=dict)
+
+    def mask(self) -> np.ndarray:
+        mask = np.zeros(self.num_of_rows, dtype=bool)
+        mask[self.row_ids] = True
+        return mask
+
+class QueryCache:
+    '''LRU cache of QueryResults shared by every session of the process.
+
+    Keys start with the dataset's file name and version, so a search never hits the result of
+    another snapshot. load_dataset drops the older versions' entries once it loads a new one.'''
+
+    def __init__(self, max_entries: int = QUERY_CACHE_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> QueryResult:
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: tuple, result: QueryResult) -> None:
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, file_name: str, current_version: str) -> None:
+        '''Drop the entries of every other version of the dataset.'''
+
+        with self.lock:
+            stale_keys = [key for key in self.entries if key[0] == file_name and key[1] != current_version]
+            for key in stale_keys:
+                del self.entries[key]
+            self.invalidations += len(stale_keys)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            num_of_lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / num_of_lookups if num_of_lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'bytes': sum(
+                    result.row_ids.nbytes + sum(row_ids.nbytes for row_ids in result.sorted_row_ids.values())
+                    for result in self.entries.values()
+                    ),
+            }
+
+_query_cache = QueryCache()
+
+def get_query_cache() -> QueryCache:
+    return _query_cache
+
+def make_query_key(dataset, queries: dict, date_range: tuple[int, int] = None) -> tuple:
+    '''Key of a search: the dataset version and the inputs in a canonical form.
+    The search is case-insensitive and an empty input matches everything, so inputs differing
+    only in case or in empty fields share an entry. Whitespace is kept, it is part of the match.'''
+
+    normalized_queries = tuple(sorted((column, query.lower()) for column, query in queries.items() if query))
+    return (dataset.file_name, dataset.version, normalized_queries, tuple(date_range) if date_range is not None else None)
+
+def search_cached(dataset, queries: dict, date_range: tuple[int, int] = None, n: int = 10) -> QueryResult:
+    '''Return the rows matching the search and the top n of every entity column,
+    from the query cache if any session ran the same search on this dataset version.'''
+
+    key = make_query_key(dataset, queries, date_range) + (n,)
+    result = _query_cache.get(key)
+    if result is not None:
+        return result
+
+    mask = search_dataframe(dataset, queries, date_range=date_range)
+    row_ids = np.flatnonzero(mask).astype(np.int32)
+    # Shared between sessions
+    row_ids.flags.writeable = False
+    result = QueryResult(
+        row_ids=row_ids,
+        num_of_rows=mask.shape[0],
+        top_entities={column: top_entities(index, mask, n=n, column=column) for column, index in dataset.entity_index.items()},
+        )
+    _query_cache.put(key, result)
+    return result
@@ -0,0 +1,225 @@
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from module.constants import *
+from module.storage import get_filesystem
+
+class GCSLockStore:
+    '''Lock object in a GCS bucket, written with a generation precondition.
+    GCS answers 412 when the precondition fails, so only one writer wins every round.'''
+
+    def __init__(self, fs, path: str) -> None:
+        self.fs = fs
+        self.bucket, self.key, _ = fs.split_path(path)
+        # Uploads go to the /upload/ twin of the JSON API base, whatever endpoint the filesystem uses
+        self.upload_url = fs.base.removesuffix('storage/v1/') + 'upload/storage/v1/b/{}/o'
+
+    def write(self, payload: dict, if_generation_match: str) -> str:
+        '''Write the payload if the object's generation still matches ('0' means it must not exist).
+        Return the new generation, or None if the precondition failed.'''
+
+        from gcsfs.retry import HttpError
+
+        try:
+            response = self.fs.call(
+                'POST',
+                self.upload_url,
+                self.bucket,
+                uploadType='media',
+                name=self.key,
+                ifGenerationMatch=if_generation_match,
+                headers={'Content-Type': 'application/json'},
+                data=json.dumps(payload).encode('utf-8'),
+                json_out=True,
+                )
+        except HttpError as e:
+            if str(e.code) == '412':
+                return None
+            raise
+        return str(response['generation'])
+
+    def read(self) -> tuple[dict, str]:
+        '''Return the payload and generation of the lock object, or None if there is none.'''
+
+        try:
+            headers, contents = self.fs.call('GET', 'b/{}/o/{}', self.bucket, self.key, alt='media')
+        except FileNotFoundError:
+            return None
+        return json.loads(contents), headers['x-goog-generation']
+
+    def delete(self, generation: str) -> bool:
+        from gcsfs.retry import HttpError
+
+        try:
+            self.fs.call('DELETE', 'b/{}/o/{}', self.bucket, self.key, ifGenerationMatch=generation)
+        except FileNotFoundError:
+            return False
+        except HttpError as e:
+            if str(e.code) == '412':
+                return False
+            raise
+        return True
+
+class LocalLockStore:
+    '''Stand-in for GCSLockStore backed by a local file, for ingest.py --storage and tests.
+    Generations are counted in the file itself and every check-and-write holds a flock.'''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    @contextmanager
+    def mutex(self):
+        with open(f'{self.path}.mutex', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read_unlocked(self) -> tuple[dict, str]:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return None
+        return stored['payload'], stored['generation']
+
+    def write(self, payload: dict, if_generation_match: str) -> str:
+        with self.mutex():
+            current = self.read_unlocked()
+            current_generation = current[1] if current is not None else '0'
+            if current_generation != if_generation_match:
+                return None
+            generation = str(int(current_generation) + 1)
+            with open(f'{self.path}.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'payload': payload, 'generation': generation}, f)
+            os.replace(f'{self.path}.tmp', self.path)
+            return generation
+
+    def read(self) -> tuple[dict, str]:
+        with self.mutex():
+            return self.read_unlocked()
+
+    def delete(self, generation: str) -> bool:
+        with self.mutex():
+            current = self.read_unlocked()
+            if current is None or current[1] != generation:
+                return False
+            os.remove(self.path)
+            return True
+
+class RefreshLock:
+    '''Single-flight lock around a data refresh, shared by every session, worker and ingest run.
+
+    The holder's lease expires after `lease_seconds` unless a heartbeat thread extends it, so a
+    crashed holder blocks others for at most one lease. An expired lock is taken over with the
+    same generation precondition, so only one of several waiting sessions gets it.'''
+
+    def __init__(self, store, lease_seconds: float = REFRESH_LOCK_LEASE_SECONDS, heartbeat_seconds: float = REFRESH_LOCK_HEARTBEAT_SECONDS) -> None:
+        self.store = store
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.generation = None
+        self.lost = False
+        self.stop_event = threading.Event()
+        self.heartbeat_thread = None
+
+    def make_payload(self, acquired_at: float) -> dict:
+        now = time.time()
+        return {'owner': self.owner, 'acquired_at': acquired_at, 'heartbeat_at': now, 'expires_at': now + self.lease_seconds}
+
+    def holder(self) -> dict:
+        '''Return the payload of the live lock, or None if nobody holds it (or its lease expired).'''
+
+        current = self.store.read()
+        if current is None or current[0]['expires_at'] < time.time():
+            return None
+        return current[0]
+
+    def acquire(self) -> bool:
+        '''Try once to take the lock. Return False if someone else holds a live lease.'''
+
+        payload = self.make_payload(acquired_at=time.time())
+        # Read first, a live lock is the common case while a refresh runs
+        current = self.store.read()
+        if current is None:
+            generation = self.store.write(payload, if_generation_match='0')
+        elif current[0]['expires_at'] < time.time():
+            # The holder stopped heartbeating, take over its lease
+            generation = self.store.write(payload, if_generation_match=current[1])
+        else:
+            return False
+
+        if generation is None:
+            current = self.store.read()
+            if current is None or current[0]['owner'] != self.owner:
+                # Another session won the race
+                return False
+            # A retried write that had already gone through
+            generation = current[1]
+
+        self.generation = generation
+        self.lost = False
+        self.stop_event.clear()
+        self.heartbeat_thread = threading.Thread(target=self.heartbeat, args=(payload['acquired_at'],), daemon=True)
+        self.heartbeat_thread.start()
+        return True
+
+    def heartbeat(self, acquired_at: float) -> None:
+        while not self.stop_event.wait(self.heartbeat_seconds):
+            try:
+                generation = self.store.write(self.make_payload(acquired_at), if_generation_match=self.generation)
+            except Exception:
+                # A transient error, the lease still has time left to retry on the next beat
+                continue
+            if generation is None:
+                # Another holder took over the expired lease
+                self.lost = True
+                return
+            self.generation = generation
+
+    def release(self) -> None:
+        self.stop_event.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+        if self.generation is not None and not self.lost:
+            self.store.delete(self.generation)
+        self.generation = None
+
+    def wait(self, timeout: float = REFRESH_WAIT_SECONDS, poll_seconds: float = REFRESH_POLL_SECONDS) -> bool:
+        '''Wait until nobody holds the lock. Return False if it is still held after timeout seconds.'''
+
+        deadline = time.monotonic() + timeout
+        while self.holder() is not None:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_seconds)
+        return True
+
+    def __enter__(self) -> 'RefreshLock':
+        if not self.acquire():
+            raise RuntimeError('Another refresh is already running.')
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+def open_refresh_lock(conn) -> RefreshLock:
+    '''Return the refresh lock stored next to the datasets of a FilesConnection or fsspec filesystem.'''
+
+    fs = get_filesystem(conn)
+    lock_path = f'{GCS_BUCKET_NAME}/{REFRESH_LOCK_FILE_NAME}'
+    if 'gcs' in fs.protocol:
+        return RefreshLock(GCSLockStore(fs, lock_path))
+    # A local directory standing in for the bucket
+    root = getattr(fs, 'path', '')
+    return RefreshLock(LocalLockStore(os.path.join(root, lock_path)))
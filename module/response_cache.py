@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from module.constants import *
+
+def make_cache_key(url: str, params: dict) -> str:
+    '''Hash of the URL and the params without secrets, so the API key never reaches the key or the disk.'''
+
+    public_params = sorted((str(name), str(value)) for name, value in params.items() if name not in RESPONSE_CACHE_SECRET_PARAMS)
+    return hashlib.sha256(json.dumps([url, public_params], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    '''Cache of API response bodies with a TTL, bounded by entries and bytes (least recently used first).
+
+    With a directory, bodies are also written there, one JSON file per key, so another process or
+    the next run finds them while they are fresh. The disk tier is bounded by max_bytes as well.'''
+
+    def __init__(self, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, directory: str = None) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # An empty directory (e.g. RESPONSE_CACHE_DIR='') turns the disk tier off too
+        self.directory = directory or None
+        # key: (stored_at, num_of_bytes, body)
+        self.entries = OrderedDict()
+        self.num_of_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def get_disk_path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, url: str, params: dict) -> dict:
+        '''Return the cached body, or None if there is no fresh one.'''
+
+        key = make_cache_key(url, params)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                self.remove(key)
+
+        body = self.read_disk(key, now)
+        with self.lock:
+            if body is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return body
+
+    def read_disk(self, key: str, now: float) -> dict:
+        if self.directory is None:
+            return None
+        try:
+            with open(self.get_disk_path(key), 'rb') as f:
+                contents = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            stored = json.loads(contents)
+        except ValueError:
+            # Left half written by a crashed process, it is replaced on the next put
+            return None
+        if now - stored['stored_at'] > self.ttl_seconds:
+            return None
+        # Promote it to memory, keeping its original age
+        self.store(key, stored['body'], len(contents), stored['stored_at'])
+        return stored['body']
+
+    def put(self, url: str, params: dict, body: dict, num_of_bytes: int) -> None:
+        key = make_cache_key(url, params)
+        stored_at = time.time()
+        self.store(key, body, num_of_bytes, stored_at)
+        if self.directory is not None:
+            file_path = self.get_disk_path(key)
+            # Unique per thread, several workers may write the same key at once
+            temp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'stored_at': stored_at, 'body': body}, f, ensure_ascii=False)
+                os.replace(temp_path, file_path)
+                self.prune_disk()
+            except OSError:
+                # A full or read-only disk only costs the disk tier, the body is in memory
+                pass
+
+    def store(self, key: str, body: dict, num_of_bytes: int, stored_at: float) -> None:
+        # A body larger than the whole cache is not worth evicting everything for
+        if num_of_bytes > self.max_bytes:
+            return None
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (stored_at, num_of_bytes, body)
+            self.num_of_bytes += num_of_bytes
+            while len(self.entries) > self.max_entries or self.num_of_bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key: str) -> None:
+        # Called with the lock held
+        self.num_of_bytes -= self.entries.pop(key)[1]
+
+    def prune_disk(self) -> None:
+        '''Delete the oldest files until the directory fits in max_bytes.'''
+
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, file_path in sorted(files):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.num_of_bytes = 0
+        if self.directory is not None:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.json'):
+                    os.remove(entry.path)
+
+    def stats(self) -> dict:
+        with self.lock:
+            num_of_lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.num_of_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / num_of_lookups if num_of_lookups else 0.0,
+            }
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> ResponseCache:
+    '''Return the process-wide response cache. A non-empty RESPONSE_CACHE_DIR environment variable turns on the disk tier.'''
+
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(directory=os.environ.get('RESPONSE_CACHE_DIR', RESPONSE_CACHE_DIR))
+        return _response_cache
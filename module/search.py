@@ -0,0 +1,149 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from module.constants import *
+from module.metrics import timed
+
+@dataclass(frozen=True)
+class SubstringIndex:
+    '''N-gram inverted index over the distinct (lowercased) values of one column.
+
+    Grams are taken over characters, so a Hangul syllable is one character and a two
+    syllable query like '급성' is answered from the bigram postings.'''
+
+    values: list
+    codes: np.ndarray
+    postings: dict
+    max_gram_size: int
+
+def build_substring_index(series: pd.Series, max_gram_size: int = MAX_GRAM_SIZE) -> SubstringIndex:
+    '''Index every 1..max_gram_size character gram of the column's distinct values.'''
+
+    # Rows share value ids, missing values get -1
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    values = [str(value).lower() for value in uniques]
+
+    postings = {}
+    for value_id, value in enumerate(values):
+        grams = {
+            value[start:start + gram_size]
+            for gram_size in range(1, max_gram_size + 1)
+            for start in range(len(value) - gram_size + 1)
+        }
+        for gram in grams:
+            postings.setdefault(gram, []).append(value_id)
+
+    postings = {gram: np.array(value_ids, dtype=np.int32) for gram, value_ids in postings.items()}
+    return SubstringIndex(values=values, codes=codes.astype(np.int32), postings=postings, max_gram_size=max_gram_size)
+
+def search_substring(index: SubstringIndex, query: str) -> np.ndarray:
+    '''Return a row mask of the literal, case-insensitive substring matches of the query.
+    An empty query matches every row, missing values match nothing else.'''
+
+    if query == '':
+        return np.ones(index.codes.shape[0], dtype=bool)
+
+    query = query.lower()
+    gram_size = min(len(query), index.max_gram_size)
+    grams = {query[start:start + gram_size] for start in range(len(query) - gram_size + 1)}
+
+    # Intersect the shortest posting lists first
+    candidate_ids = None
+    for gram in sorted(grams, key=lambda gram: len(index.postings.get(gram, ()))):
+        value_ids = index.postings.get(gram)
+        if value_ids is None:
+            candidate_ids = np.empty(0, dtype=np.int32)
+            break
+        candidate_ids = value_ids if candidate_ids is None else np.intersect1d(candidate_ids, value_ids, assume_unique=True)
+        if candidate_ids.size == 0:
+            break
+
+    # A query longer than the grams can still be a false positive, so verify the survivors
+    if len(query) > gram_size:
+        candidate_ids = [value_id for value_id in candidate_ids if query in index.values[value_id]]
+
+    # The extra last slot stays False for missing values (code -1)
+    value_mask = np.zeros(len(index.values) + 1, dtype=bool)
+    value_mask[candidate_ids] = True
+    return value_mask[index.codes]
+
+def build_search_index(dataframe: pd.DataFrame, columns: list) -> dict:
+    '''Build a substring index for each searchable column.'''
+
+    return {column: build_substring_index(dataframe[column]) for column in columns}
+
+
+@dataclass(frozen=True)
+class DateIndex:
+    '''IND Approval Dates parsed once into YYYYMMDD integers, with the row order that sorts them.'''
+
+    dates: np.ndarray
+    order: np.ndarray
+    sorted_dates: np.ndarray
+
+def parse_approval_dates(series: pd.Series) -> np.ndarray:
+    '''Parse 'YYYYMMDD' or 'YYYY-MM-DD' strings into YYYYMMDD integers (0 when missing or invalid).'''
+
+    digits = series.astype('string').str.replace(r'\D', '', regex=True).str.slice(0, 8)
+    digits = digits.where(digits.str.len() == 8)
+    return pd.to_numeric(digits, errors='coerce').fillna(0).to_numpy(dtype=np.int32)
+
+def build_date_index(series: pd.Series) -> DateIndex:
+    '''Sort the parsed dates once, so any range is two binary searches away.'''
+
+    dates = parse_approval_dates(series)
+    order = np.argsort(dates, kind='stable').astype(np.int32)
+    return DateIndex(dates=dates, order=order, sorted_dates=dates[order])
+
+def parse_date_bound(text: str) -> tuple[int, int]:
+    '''Return the first and last YYYYMMDD integer of a YYYY, YYYYMM, YYYYMMDD or YYYYQn period.'''
+
+    period = text.strip().replace('-', '').upper()
+    if len(period) == 6 and period[:4].isdigit() and period[4] == 'Q' and period[5] in '1234':
+        quarter = int(period[5])
+        return int(f'{period[:4]}{quarter * 3 - 2:02d}00'), int(f'{period[:4]}{quarter * 3:02d}99')
+    if len(period) in (4, 6, 8) and period.isdigit():
+        # A month or day that does not exist (e.g. 202413, 20240230) is rejected rather than matching nothing
+        try:
+            datetime.strptime(period, {4: '%Y', 6: '%Y%m', 8: '%Y%m%d'}[len(period)])
+        except ValueError:
+            raise ValueError(f'Invalid date "{text}". Use YYYY, YYYYMM, YYYYMMDD or YYYYQ1~4.') from None
+        # A shorter input covers every date it is a prefix of
+        return int(period.ljust(8, '0')), int(period.ljust(8, '9'))
+    raise ValueError(f'Invalid date "{text}". Use YYYY, YYYYMM, YYYYMMDD or YYYYQ1~4.')
+
+def parse_date_range(date_from: str, date_to: str) -> tuple[int, int]:
+    '''Return the inclusive YYYYMMDD range covered by the from/to inputs (None if both are empty).
+    From alone is the whole period it names ('2020' is every date of 2020, like the old prefix
+    match); To alone is every date up to the end of its period.'''
+
+    if not date_from and not date_to:
+        return None
+    # Missing dates are parsed as 0, so an open start still leaves them out
+    start = parse_date_bound(date_from)[0] if date_from else 1
+    end = parse_date_bound(date_to or date_from)[1]
+    return start, end
+
+def search_date_range(index: DateIndex, date_range: tuple[int, int]) -> np.ndarray:
+    '''Return the row mask of dates inside the inclusive range.'''
+
+    mask = np.zeros(index.dates.shape[0], dtype=bool)
+    start = np.searchsorted(index.sorted_dates, date_range[0], side='left')
+    end = np.searchsorted(index.sorted_dates, date_range[1], side='right')
+    mask[index.order[start:end]] = True
+    return mask
+
+@timed('search.filter')
+def search_dataframe(dataset, queries: dict, date_range: tuple[int, int] = None) -> np.ndarray:
+    '''Return the row mask of a TrialDataset's rows matching every {column: query} and the date range.'''
+
+    mask = np.ones(dataset.dataframe.shape[0], dtype=bool)
+    for column, query in queries.items():
+        if query:
+            mask &= search_substring(dataset.search_index[column], query)
+    if date_range is not None:
+        mask &= search_date_range(dataset.date_index, date_range)
+    return mask
@@ -0,0 +1,109 @@
+import fcntl
+import glob
+import hashlib
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from module.constants import *
+from module.metrics import record, span
+
+# Text columns stay Arrow strings over the mapped file instead of being copied into Python objects
+ARROW_STRING_TYPES = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow')}
+
+def get_snapshot_dir() -> str:
+    '''Return the local snapshot directory, from the SNAPSHOT_DIR environment variable if set.
+    None (or an empty variable) turns the snapshot tier off.'''
+
+    return os.environ.get('SNAPSHOT_DIR', SNAPSHOT_DIR) or None
+
+def get_snapshot_prefix(directory: str, file_name: str, object_url: str, columns: list = None) -> str:
+    '''Return the path prefix shared by every version of a stored object read with the given columns.
+    The object URL is part of it, so two buckets never share a snapshot whatever their versions.'''
+
+    source_hash = hashlib.sha256(repr((object_url, columns)).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(directory, f'{file_name}.{source_hash}')
+
+def get_snapshot_path(prefix: str, version: str) -> str:
+    return f'{prefix}.{hashlib.sha256(version.encode("utf-8")).hexdigest()[:16]}.arrow'
+
+def write_snapshot(dataframe: pd.DataFrame, file_path: str) -> None:
+    '''Write the DataFrame as an uncompressed Arrow IPC file, atomically.
+    Readers never see a half written file, they map either nothing or all of it.'''
+
+    # Unique per thread, several writers may write the same version at once
+    temp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    with span('snapshot.write') as write_span:
+        try:
+            with pa.OSFile(temp_path, 'wb') as f:
+                with ipc.new_file(f, table.schema) as writer:
+                    writer.write_table(table, max_chunksize=WRITE_CHUNK_ROWS)
+                write_span.add_bytes(f.tell())
+            os.replace(temp_path, file_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+def read_snapshot(file_path: str) -> pd.DataFrame:
+    '''Map a snapshot read-only. The Arrow string columns point into the mapped pages, which the
+    page cache shares between every process mapping the same file; only the small dictionary
+    codes of categorical columns are copied.'''
+
+    with span('snapshot.read', os.path.getsize(file_path)):
+        table = ipc.open_file(pa.memory_map(file_path, 'r')).read_all()
+        return table.to_pandas(types_mapper=ARROW_STRING_TYPES.get)
+
+def remove_other_versions(prefix: str, file_path: str) -> None:
+    '''Delete the snapshots of older versions of the same object and columns.
+    Processes still mapping one keep their pages until they let go of it.'''
+
+    for other_path in glob.glob(f'{glob.escape(prefix)}.*.arrow'):
+        if other_path != file_path:
+            try:
+                os.remove(other_path)
+            except FileNotFoundError:
+                pass
+
+def load_snapshot(file_name: str, object_url: str, version: str, columns: list, build) -> pd.DataFrame:
+    '''Return the frame of one stored object version from the local snapshot tier.
+
+    The first process to need a version calls build() (download and compact it), writes the
+    snapshot and maps it; the others wait on a file lock and map the same file, never touching
+    GCS. Without a snapshot directory the built frame is returned as it is.'''
+
+    directory = get_snapshot_dir()
+    if directory is None:
+        return build()
+
+    prefix = get_snapshot_prefix(directory, file_name, object_url, columns)
+    file_path = get_snapshot_path(prefix, version)
+    if os.path.exists(file_path):
+        record('snapshot.hit', 0)
+        return read_snapshot(file_path)
+
+    os.makedirs(directory, exist_ok=True)
+    with open(f'{prefix}.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(file_path):
+                # Written by the process that held the lock before us
+                record('snapshot.hit', 0)
+                return read_snapshot(file_path)
+
+            record('snapshot.miss', 0)
+            dataframe = build()
+            try:
+                write_snapshot(dataframe, file_path)
+            except OSError:
+                # A full or read-only disk only costs the sharing, the frame is in memory
+                return dataframe
+            remove_other_versions(prefix, file_path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # Map our own snapshot too, so this process shares the pages with the others
+    return read_snapshot(file_path)
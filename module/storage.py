@@ -0,0 +1,227 @@
+import gzip
+import hashlib
+import json
+import os
+
+import fsspec
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fsspec.implementations.dirfs import DirFileSystem
+
+from module.constants import *
+from module.metrics import record, span
+
+def open_storage(location: str = 'gcs'):
+    '''Open the snapshot storage outside of Streamlit.
+    'gcs' uses the default Google credentials, anything else is a local directory standing in for GCS.'''
+
+    if location == 'gcs':
+        return fsspec.filesystem('gcs')
+    os.makedirs(location, exist_ok=True)
+    return DirFileSystem(path=location, fs=fsspec.filesystem('file', auto_mkdir=True))
+
+def get_filesystem(conn):
+    '''Return the fsspec filesystem behind a FilesConnection (or the filesystem itself).'''
+
+    # A DirFileSystem has an .fs too, the local filesystem it wraps
+    return conn if isinstance(conn, fsspec.AbstractFileSystem) else conn.fs
+
+def get_object_url(conn, file_path: str) -> str:
+    '''Return a URL naming a stored object across filesystems, e.g. gs://bucket/name or file:///dir/bucket/name.'''
+
+    fs = get_filesystem(conn)
+    if isinstance(fs, DirFileSystem):
+        return fs.fs.unstrip_protocol(os.path.join(fs.path, file_path))
+    return fs.unstrip_protocol(file_path)
+
+def get_dataset_path(file_name: str, file_format: str = STORAGE_FORMAT) -> str:
+    '''Return the GCS path of a trial dataset stored in the given format.'''
+
+    return f'{GCS_BUCKET_NAME}/{file_name}.{FILE_EXTENSIONS[file_format]}'
+
+def get_file_format(file_path: str) -> str:
+    '''Infer the storage format from the file extension.'''
+
+    return 'parquet' if file_path.endswith('.parquet') else 'jsonl'
+
+def decode_jsonl(json_file, columns: list = None, chunk_size: int = JSONL_CHUNK_SIZE) -> pd.DataFrame:
+    '''Decode a line-delimited JSON file into a DataFrame, reading it chunk by chunk.
+
+    Every value goes straight into its column list, so besides the final frame only one
+    chunk of raw bytes and its parsed records are held. JSON escapes newlines inside strings, so splitting the
+    raw bytes on b'\\n' never cuts a record in half.'''
+
+    column_values = {column: [] for column in columns} if columns is not None else {}
+    num_of_rows = 0
+    remainder = b''
+
+    while True:
+        chunk = json_file.read(chunk_size)
+        lines = (remainder + chunk).split(b'\n')
+        # The last piece may be an incomplete line, keep it for the next chunk
+        remainder = lines.pop() if chunk else b''
+
+        # Parse one chunk of lines at a time, then spread it over the columns
+        records = json.loads(b'[' + b','.join(line for line in lines if line.strip()) + b']')
+        if columns is None:
+            for record in records:
+                for column in record:
+                    if column not in column_values:
+                        # A column first seen now is missing from every previous row
+                        column_values[column] = [None] * num_of_rows
+        for column, values in column_values.items():
+            values.extend([record.get(column) for record in records])
+        num_of_rows += len(records)
+
+        if not chunk:
+            break
+
+    return pd.DataFrame(column_values)
+
+def hash_dataframe(dataframe: pd.DataFrame) -> str:
+    '''Return a hash of the DataFrame's columns and values, the same for any string dtype.'''
+
+    content_hash = hashlib.sha256('\x1f'.join(map(str, dataframe.columns)).encode('utf-8'))
+    content_hash.update(pd.util.hash_pandas_object(dataframe, index=False).to_numpy().tobytes())
+    return content_hash.hexdigest()
+
+def write_dataframe(dataframe: pd.DataFrame, f, file_format: str, content_hash: str = None) -> None:
+    '''Serialize the DataFrame into an open binary file, WRITE_CHUNK_ROWS rows at a time.'''
+
+    if file_format == 'parquet':
+        # Store every column as a typed (nullable) string column, with the content hash in the footer
+        schema = pa.schema(
+            [(column, pa.string()) for column in dataframe.columns], 
+            metadata={'content_hash': content_hash} if content_hash else None
+            )
+        with pq.ParquetWriter(f, schema, compression=PARQUET_COMPRESSION) as writer:
+            for start in range(0, max(dataframe.shape[0], 1), WRITE_CHUNK_ROWS):
+                chunk = dataframe.iloc[start:start + WRITE_CHUNK_ROWS].astype('string').astype(object)
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        return None
+
+    if JSONL_COMPRESSION == 'gzip':
+        stream = gzip.GzipFile(fileobj=f, mode='wb')
+    elif JSONL_COMPRESSION == 'zstd':
+        stream = pa.CompressedOutputStream(f, 'zstd')
+    else:
+        stream = None
+    out = stream if stream is not None else f
+
+    # Save DataFrame to JSON with specific orientation and line separation
+    for start in range(0, dataframe.shape[0], WRITE_CHUNK_ROWS):
+        out.write(dataframe.iloc[start:start + WRITE_CHUNK_ROWS].to_json(orient='records', lines=True, force_ascii=False).encode('utf-8'))
+    if stream is not None:
+        stream.close()
+
+def open_decompressed(f):
+    '''Wrap a gzip or zstd compressed file in a decompressing reader, other files are returned as they are.'''
+
+    magic = f.read(4)
+    f.seek(0)
+    if magic[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=f, mode='rb')
+    if magic == b'\x28\xb5\x2f\xfd':
+        return pa.CompressedInputStream(f, 'zstd')
+    return f
+
+def read_dataframe(f, file_format: str, columns: list = None) -> pd.DataFrame:
+    '''Read a DataFrame from an open binary file, keeping only the given columns.
+    Parquet only reads the requested column chunks; JSONL decodes every line but drops other columns right away.'''
+
+    # The object is downloaded while it is decoded, so the span covers both
+    with span(f'storage.read_{file_format}', getattr(f, 'size', None) or 0):
+        if file_format == 'parquet':
+            return pd.read_parquet(f, engine='pyarrow', columns=columns)
+
+        return decode_jsonl(open_decompressed(f), columns=columns)
+
+def read_content_hash(conn, file_path: str) -> str:
+    '''Return the content hash in a stored Parquet object's footer (None if missing).
+    Only the footer is read, not the column data.'''
+
+    try:
+        with conn.open(file_path, mode='rb') as f:
+            metadata = pq.read_schema(f).metadata or {}
+    except Exception:
+        return None
+    content_hash = metadata.get(b'content_hash')
+    return content_hash.decode('utf-8') if content_hash else None
+
+def update_data(dataframe: pd.DataFrame, conn, file_path: str, skip_unchanged: bool = True) -> tuple[Function_Status, Exception]:
+    '''Function to save DataFrame to Json (or Parquet for .parquet paths) in GCS.
+    A Parquet object holding exactly the same data is not uploaded again. JSONL objects have
+    no footer to keep the content hash in, so they are always written.'''
+    
+    try:
+        file_format = get_file_format(file_path)
+        content_hash = hash_dataframe(dataframe) if file_format == 'parquet' else None
+        if skip_unchanged and content_hash is not None and read_content_hash(conn, file_path) == content_hash:
+            record('storage.write_skipped', 0)
+            return Function_Status.SUCCESS, None
+
+        # Open the file in write binary mode (wb), it is uploaded block by block as it is written
+        with span(f'storage.write_{file_format}') as write_span:
+            with conn.open(file_path, mode='wb', block_size=UPLOAD_BLOCK_SIZE) as f:
+                write_dataframe(dataframe, f, file_format, content_hash)
+                write_span.add_bytes(f.tell())
+        
+        return Function_Status.SUCCESS, None
+    
+    except Exception as e:
+
+        return Function_Status.FAIL, e
+
+def read_derived_table(conn, file_path: str) -> tuple[pd.DataFrame, str]:
+    '''Return a table derived from a trial dataset (e.g. its trend cube) and the dataset version it
+    describes, or (None, None) if there is none.'''
+
+    try:
+        with conn.open(file_path, mode='rb') as f:
+            table = pq.read_table(f)
+    except FileNotFoundError:
+        return None, None
+    source_version = (table.schema.metadata or {}).get(b'source_version', b'').decode('utf-8')
+    return table.to_pandas(), source_version
+
+def write_derived_table(conn, file_path: str, dataframe: pd.DataFrame, source_version: str) -> None:
+    '''Write a table derived from a trial dataset, tagged with the dataset version it describes.'''
+
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), 'source_version': source_version})
+    with span('storage.write_derived') as write_span:
+        with conn.open(file_path, mode='wb') as f:
+            pq.write_table(table, f, compression=PARQUET_COMPRESSION)
+            write_span.add_bytes(f.tell())
+
+def read_data(conn, file_name: str, columns: list = None) -> pd.DataFrame:
+    '''Read a trial dataset from GCS in the configured storage format.
+    A dataset that only exists as legacy JSONL is migrated on first read.'''
+
+    file_path = get_dataset_path(file_name)
+    try:
+        with conn.open(file_path, mode='rb') as f:
+            return read_dataframe(f, STORAGE_FORMAT, columns)
+    except FileNotFoundError:
+        if STORAGE_FORMAT == 'jsonl':
+            raise
+
+    result, e = migrate_data(conn, file_name)
+    if result == Function_Status.FAIL:
+        raise e
+
+    with conn.open(file_path, mode='rb') as f:
+        return read_dataframe(f, STORAGE_FORMAT, columns)
+
+def migrate_data(conn, file_name: str, source_format: str = 'jsonl', target_format: str = STORAGE_FORMAT) -> tuple[Function_Status, Exception]:
+    '''Copy a trial dataset from one storage format to another in GCS.
+    The source object is kept, so older deployments can still read it.'''
+
+    try:
+        with conn.open(get_dataset_path(file_name, source_format), mode='rb') as f:
+            dataframe = read_dataframe(f, source_format)
+    except Exception as e:
+        return Function_Status.FAIL, e
+
+    return update_data(dataframe=dataframe, conn=conn, file_path=get_dataset_path(file_name, target_format))
@@ -0,0 +1,179 @@
+import sys
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from module.constants import *
+from module.storage import *
+from module.search import parse_approval_dates
+from module.aggregates import build_entity_index
+from module.datasets import get_object_version
+from module.metrics import record, timed
+
+TREND_CUBE_DIMENSIONS = ['Cuboid', 'Month', 'Phase', 'Entity']
+# Entity columns rolled up for each trial dataset, and the key columns telling its trials apart
+TREND_CUBE_DATASETS = {
+    MEDICATION_TRIAL_FILE_NAME: {
+        'column_names': MEDICATION_STUDY_COLUMN_NAME,
+        'entity_columns': MEDICATION_STUDY_ENTITY_COLUMN_NAME,
+        'key_columns': MEDICATION_STUDY_KEY_COLUMN_NAME,
+    },
+    DEVICE_TRIAL_FILE_NAME: {
+        'column_names': MEDICAL_DEVICE_STUDY_COLUMN_NAME,
+        'entity_columns': MEDICAL_DEVICE_STUDY_ENTITY_COLUMN_NAME,
+        'key_columns': MEDICAL_DEVICE_STUDY_KEY_COLUMN_NAME,
+    },
+}
+
+def get_trend_cube_path(file_name: str) -> str:
+    return get_dataset_path(f'{file_name}{TREND_CUBE_FILE_SUFFIX}', 'parquet')
+
+def get_cube_columns(file_name: str) -> list:
+    '''Columns of a trial dataset the cube is built from.'''
+
+    spec = TREND_CUBE_DATASETS[file_name]
+    columns = ['IND Approval Date', 'Phase', *spec['entity_columns'], *spec['key_columns']]
+    return [column for column in dict.fromkeys(columns) if column in spec['column_names']]
+
+@timed('trends.build_cube')
+def build_trend_cube(dataframe: pd.DataFrame, entity_columns: dict) -> pd.DataFrame:
+    '''Roll the trials up into counts per (Cuboid, Month, Phase, Entity).
+
+    The 'Phase' cuboid counts trials per approval month (YYYYMM, 0 when unknown) and Phase, every
+    entity column adds a cuboid of the same counts per entity, a trial counting once for each of
+    its sites. Datasets without a Phase column have '' as their only Phase.'''
+
+    months = parse_approval_dates(dataframe['IND Approval Date']) // 100
+    if 'Phase' in dataframe:
+        phases = dataframe['Phase'].astype('string').fillna('').to_numpy(dtype=object)
+    else:
+        phases = np.full(dataframe.shape[0], '', dtype=object)
+
+    parts = [pd.DataFrame({'Cuboid': 'Phase', 'Month': months, 'Phase': phases, 'Entity': ''})]
+    for column, separator in entity_columns.items():
+        index = build_entity_index(dataframe[column], separator)
+        # Row of every (trial, entity) pair
+        row_ids = np.repeat(np.arange(dataframe.shape[0]), np.diff(index.row_ptr))
+        parts.append(pd.DataFrame({'Cuboid': column, 'Month': months[row_ids], 'Phase': phases[row_ids], 'Entity': index.names[index.entity_ids]}))
+
+    cube = pd.concat(parts, ignore_index=True).groupby(TREND_CUBE_DIMENSIONS, sort=True).size()
+    return cube.rename('Count').reset_index()
+
+def apply_delta(cube: pd.DataFrame, added_cube: pd.DataFrame, removed_cube: pd.DataFrame) -> pd.DataFrame:
+    '''Add the counts of added trials and subtract those of removed ones, dropping empty cells.'''
+
+    cube = pd.concat([cube, added_cube, removed_cube.assign(Count=-removed_cube['Count'])], ignore_index=True)
+    cube = cube.groupby(TREND_CUBE_DIMENSIONS, sort=True)['Count'].sum().reset_index()
+    return cube[cube['Count'] > 0].reset_index(drop=True)
+
+def get_changed_rows(dataframe: pd.DataFrame, other_dataframe: pd.DataFrame, columns: list) -> pd.DataFrame:
+    '''Rows of the DataFrame whose cube columns have no identical row in the other one.'''
+
+    row_hashes = pd.util.hash_pandas_object(dataframe[columns].astype(str), index=False)
+    other_row_hashes = pd.util.hash_pandas_object(other_dataframe[columns].astype(str), index=False)
+    return dataframe[~row_hashes.isin(other_row_hashes).to_numpy()]
+
+def update_trend_cube(conn, file_name: str, dataframe: pd.DataFrame, version: str, stored_dataframe: pd.DataFrame = None, previous_version: str = None) -> None:
+    '''Bring the trend cube up to date with a newly saved dataset version.
+
+    With the stored snapshot the sync started from, and a cube describing exactly that snapshot
+    (previous_version), only the rows that changed are rolled up and applied to the cube.
+    Otherwise the cube is built from the whole dataset.'''
+
+    file_path = get_trend_cube_path(file_name)
+    cube, source_version = read_derived_table(conn, file_path)
+    if cube is not None and source_version == version:
+        return None
+
+    spec = TREND_CUBE_DATASETS[file_name]
+    columns = get_cube_columns(file_name)
+    if cube is not None and stored_dataframe is not None and source_version == previous_version:
+        added_cube = build_trend_cube(get_changed_rows(dataframe, stored_dataframe, columns), spec['entity_columns'])
+        removed_cube = build_trend_cube(get_changed_rows(stored_dataframe, dataframe, columns), spec['entity_columns'])
+        cube = apply_delta(cube, added_cube, removed_cube)
+        record('trends.cube_delta', 0)
+    else:
+        cube = build_trend_cube(dataframe[columns], spec['entity_columns'])
+    write_derived_table(conn, file_path, cube, version)
+
+@dataclass(frozen=True)
+class TrendCube:
+    '''Trend cube of one trial dataset version, split by cuboid.'''
+
+    file_name: str
+    source_version: str
+    cuboids: dict
+
+_cubes = {}
+_cubes_lock = threading.Lock()
+
+def load_trend_cube(conn, file_name: str) -> TrendCube:
+    '''Return the trend cube of the current dataset version, shared by every session of this process.
+
+    Only the small stored cube is read, never the dataset, unless the stored cube describes
+    another version (e.g. written before the last sync); then it is rebuilt and saved again.'''
+
+    version = get_object_version(conn, get_dataset_path(file_name))
+    trend_cube = _cubes.get(file_name)
+    if trend_cube is not None and trend_cube.source_version == version:
+        return trend_cube
+
+    with _cubes_lock:
+        trend_cube = _cubes.get(file_name)
+        if trend_cube is not None and trend_cube.source_version == version:
+            return trend_cube
+
+        cube, source_version = read_derived_table(conn, get_trend_cube_path(file_name))
+        if cube is None or source_version != version:
+            dataframe = read_data(conn, file_name, columns=get_cube_columns(file_name))
+            cube = build_trend_cube(dataframe, TREND_CUBE_DATASETS[file_name]['entity_columns'])
+            try:
+                write_derived_table(conn, get_trend_cube_path(file_name), cube, version)
+            except Exception as e:
+                # Kept in memory, the next process tries again
+                record('trends.write_failed', 0)
+                print(f'Failed to store the rebuilt trend cube of {file_name}: {e!r}', file=sys.stderr)
+
+        trend_cube = TrendCube(
+            file_name=file_name,
+            source_version=version,
+            cuboids={cuboid: cuboid_cube.drop(columns='Cuboid').reset_index(drop=True) for cuboid, cuboid_cube in cube.groupby('Cuboid')},
+            )
+        _cubes[file_name] = trend_cube
+    return trend_cube
+
+def slice_cuboid(trend_cube: TrendCube, cuboid: str, phases: list = None, entities: list = None) -> pd.DataFrame:
+    '''Cells of one cuboid with a known approval month, in the given phases and entities.'''
+
+    cells = trend_cube.cuboids.get(cuboid, pd.DataFrame(columns=['Month', 'Phase', 'Entity', 'Count']))
+    keep = cells['Month'] > 0
+    if phases:
+        keep &= cells['Phase'].isin(phases)
+    if entities:
+        keep &= cells['Entity'].isin(entities)
+    return cells[keep]
+
+@timed('trends.query')
+def get_trend(trend_cube: TrendCube, cuboid: str, by: str, granularity: str = 'Year', phases: list = None, entities: list = None) -> pd.DataFrame:
+    '''Trial counts per period (rows, 'YYYY' or 'YYYY-MM') and Phase or Entity (columns) from the cube.'''
+
+    cells = slice_cuboid(trend_cube, cuboid, phases, entities)
+    months = cells['Month'].astype(int)
+    periods = (months // 100).astype(str) if granularity == 'Year' else (months // 100).astype(str) + '-' + (months % 100).astype(str).str.zfill(2)
+    trend = cells.groupby([periods.rename('Period'), cells[by]])['Count'].sum().unstack(fill_value=0)
+    trend.columns.name = None
+    return trend.sort_index()
+
+def get_top_trend_entities(trend_cube: TrendCube, cuboid: str, n: int = 5, phases: list = None) -> list:
+    '''The n entities with the most trials in the cuboid.'''
+
+    cells = slice_cuboid(trend_cube, cuboid, phases)
+    return cells.groupby('Entity')['Count'].sum().nlargest(n).index.tolist()
+
+def get_trend_options(trend_cube: TrendCube, cuboid: str, column: str) -> list:
+    '''Distinct Phase or Entity values of a cuboid, most trials first.'''
+
+    cells = slice_cuboid(trend_cube, cuboid)
+    return [value for value in cells.groupby(column)['Count'].sum().sort_values(ascending=False).index if value != '']
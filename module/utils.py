@@ -1,69 +1,58 @@
+import os
+import sys
 import json
-import requests
-from datetime import datetime
+import time
+import threading
+from datetime import datetime, timedelta, timezone
 
-from gcsfs.core import GCSFile
 from st_files_connection import FilesConnection
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 
 from math import ceil
 from module.constants import *
+from module.fetcher import *
+from module.storage import *
+from module.metrics import record, span, timed
+from module.response_cache import get_response_cache
+from module.datasets import get_object_version
+from module.trends import update_trend_cube
+from module.companies import update_company_map
 
-@st.cache_data
-def get_request(url: str, params: dict) -> dict:
-    '''Make a GET request and return the response body if successful.'''
-    
-    try:
-        # Make the GET request
-        response = requests.get(url, params=params)
-        
-        # Check if the response status is successful
-        response.raise_for_status()
-        
-        # Return the response body from the JSON response
-        return response.json().get('body', {})
-    
-    except requests.exceptions.HTTPError as http_err:
-        st.error(f':red[API Call Failed] HTTP error occurred: {http_err}', icon='🚨')
-    except requests.exceptions.RequestException as req_err:
-        st.error(f':red[API Call Failed] Request error occurred: {req_err}', icon='🚨')
-    except Exception as err:
-        st.error(f':red[API Call Failed] An unexpected error occurred: {err}', icon='🚨')
-    
-    # Return None if an error occurred
-    return None
+# The legacy api_call_logs.json is folded into per-update objects once per process
+_api_call_logs_migrated = False
+_api_call_logs_migration_lock = threading.Lock()
+
+def get_api_key() -> str:
+    '''Return the decoded API key from the DECODED_API_KEY environment variable or Streamlit secrets.'''
+
+    return os.environ.get('DECODED_API_KEY') or st.secrets['DECODED_API_KEY']
+
+def get_files_connection() -> FilesConnection:
+    '''Return the GCS connection of this session, opened on first use.
+    Streamlit caches the connection itself, so only the first session of the process pays for it.'''
+
+    if 'files_connection' not in st.session_state:
+        st.session_state['files_connection'] = st.connection('gcs', type=FilesConnection)
+    return st.session_state['files_connection']
 
 def check_api_call_logs():
-    '''Check the api_coll_logs.json is valid and can be connected.
-    If not, make a new one.'''
+    '''Check the API call logs in GCS can be read.'''
 
     try:
-        # Attempt to read the api_call_logs.json file from GCS
-        st.session_state['api_call_logs_df'] = st.session_state['files_connection'].read(f'{GCS_BUCKET_NAME}/api_call_logs.json', input_format='jsonl', dtype=str)
-        # Key Error Check
-        st.session_state['api_call_logs_df'][['date', 'time']]
+        st.session_state['api_call_logs_df'] = read_api_call_logs(get_files_connection())
         result, e = Function_Status.SUCCESS, None
         
         return result, e
-    except FileNotFoundError as e:
-        # If reading fails, create a new empty DataFrame
-        st.session_state['api_call_logs_df'] = pd.DataFrame(columns=['date', 'time'], dtype=str)
-        # Save the empty DataFrame to GCS
-        result, e = update_data(dataframe=st.session_state['api_call_logs_df'], conn=st.session_state['files_connection'], file_path=f'{GCS_BUCKET_NAME}/api_call_logs.json')
-        
-        return result, e
-    except KeyError as e:
+    except Exception as e:
         st.session_state['api_call_logs_df'] = pd.DataFrame(columns=['date', 'time'], dtype=str)
-        # Save the empty DataFrame to GCS
-        result, e = update_data(dataframe=st.session_state['api_call_logs_df'], conn=st.session_state['files_connection'], file_path=f'{GCS_BUCKET_NAME}/api_call_logs.json')
 
-        return result, e
+        return Function_Status.FAIL, e
 
-def fetch_data(conn:FilesConnection, api_call_logs_df:pd.DataFrame, today:datetime, status) -> None:
-    '''Function to save DataFrame to Json in GCS.'''
+def fetch_data(conn:FilesConnection, api_call_logs_df:pd.DataFrame, today:datetime, status, full_refresh: bool = False) -> None:
+    '''Function to save DataFrame to Json in GCS.
+    Only new or changed pages are fetched unless full_refresh is set.'''
     
     result_dict = {
             'total_result': Function_Status.SUCCESS,
@@ -83,60 +72,216 @@ def fetch_data(conn:FilesConnection, api_call_logs_df:pd.DataFrame, today:dateti
 
     # Update Medication Trial Data
     status.info('Updating Medication Trial Data...')
-    fetched_medication_trial_df = fetch_medication_trial_data(status)
-    medication_result, medication_e = update_data(dataframe=fetched_medication_trial_df, conn=conn, file_path=f'{GCS_BUCKET_NAME}/medication_trial_info.json')
+    medication_result, medication_e = sync_data(conn=conn, file_name=MEDICATION_TRIAL_FILE_NAME, fetch_function=fetch_medication_trial_data, status=status, full_refresh=full_refresh)
 
     # Update Device Trial Data
     status.info('Updating Device Trial Data...')
-    fetched_device_trial_df = fetch_device_trial_data(status)
-    device_result, device_e = update_data(dataframe=fetched_device_trial_df, conn=conn, file_path=f'{GCS_BUCKET_NAME}/device_trial_info.json')
+    device_result, device_e = sync_data(conn=conn, file_name=DEVICE_TRIAL_FILE_NAME, fetch_function=fetch_device_trial_data, status=status, full_refresh=full_refresh)
 
     # Update API Call Logs with the current date and time
-    max_row = api_call_logs_df.shape[0]
-    api_call_logs_df.loc[max_row, 'date'] = today.split('T')[0]
-    api_call_logs_df.loc[max_row, 'time'] = today.split('T')[1]
-    api_call_logs_result, api_call_logs_e = update_data(dataframe=api_call_logs_df, conn=conn, file_path=f'{GCS_BUCKET_NAME}/api_call_logs.json')
+    api_call_logs_result, api_call_logs_e = append_api_call_log(conn, api_call_logs_df, today)
 
     if medication_result == Function_Status.FAIL:
-        result_dict.total_result = Function_Status.FAIL
-        result_dict.medication.status = Function_Status.FAIL
-        result_dict.medication.message = f'Medication API Failed: {str(medication_e)}]'
+        result_dict['total_result'] = Function_Status.FAIL
+        result_dict['medication']['status'] = Function_Status.FAIL
+        result_dict['medication']['message'] = f'Medication API Failed: {str(medication_e)}]'
     
     if device_result == Function_Status.FAIL:
-        result_dict.total_result = Function_Status.FAIL
-        result_dict.device.status = Function_Status.FAIL
-        result_dict.device.message = f'Device API Failed: {str(device_e)}]'
+        result_dict['total_result'] = Function_Status.FAIL
+        result_dict['device']['status'] = Function_Status.FAIL
+        result_dict['device']['message'] = f'Device API Failed: {str(device_e)}]'
     
     if api_call_logs_result == Function_Status.FAIL:
-        result_dict.total_result = Function_Status.FAIL
-        result_dict.api_call_logs.status = Function_Status.FAIL
-        result_dict.api_call_logs.message = f'API Call Log Update Failed: {str(api_call_logs_e)}]'
+        result_dict['total_result'] = Function_Status.FAIL
+        result_dict['api_call_logs']['status'] = Function_Status.FAIL
+        result_dict['api_call_logs']['message'] = f'API Call Log Update Failed: {str(api_call_logs_e)}]'
 
     st.session_state['fetch_data_result_dict'] = result_dict
 
     return None
 
-def fetch_medication_trial_data(status):
-    '''Fetch and return all medication trial data from the API.'''
+def sync_data(conn: FilesConnection, file_name: str, fetch_function, status, full_refresh: bool = False, checkpoint_dir: str = None) -> tuple[Function_Status, Exception]:
+    '''Fetch a trial dataset against the stored snapshot and save it to GCS if anything changed.
+    Nothing is saved if any page could not be fetched.'''
+
+    try:
+        fetched_dataframe, stored_dataframe, full_fetch = sync_dataframe(conn, file_name, fetch_function, status, full_refresh, checkpoint_dir)
+    except IncompleteFetchError as e:
+        return Function_Status.FAIL, e
+
+    if fetched_dataframe is None:
+        return Function_Status.SUCCESS, None
+    if fetched_dataframe.empty:
+        # Keep the stored snapshot instead of overwriting it with nothing
+        return Function_Status.FAIL, ValueError('No data was fetched from the API.')
+
+    # The trend cube only rolls up what changed since the stored snapshot
+    return save_trial_data(conn, file_name, fetched_dataframe, stored_dataframe, full_fetch)
+
+def save_trial_data(conn: FilesConnection, file_name: str, dataframe: pd.DataFrame, stored_dataframe: pd.DataFrame = None, full_fetch: bool = False) -> tuple[Function_Status, Exception]:
+    '''Save a synced trial dataset to GCS and bring the tables derived from it up to date: its trend
+    cube, updated from the rows changed since stored_dataframe when possible, and its company map.
+    A full_fetch (every page was fetched) is recorded for is_full_refresh_due.'''
+
+    file_path = get_dataset_path(file_name)
+    try:
+        previous_version = get_object_version(conn, file_path)
+    except FileNotFoundError:
+        previous_version = None
+    result, e = update_data(dataframe=dataframe, conn=conn, file_path=file_path)
+    if result == Function_Status.FAIL:
+        return result, e
+    if full_fetch:
+        result, e = write_last_full_refresh(conn, file_name)
+        if result == Function_Status.FAIL:
+            return result, e
+
+    # The dataset is saved either way, load_trend_cube and load_company_index rebuild a derived
+    # table that does not describe the saved version. Failures are counted in the metrics
+    # (e.g. trends.update_failed) and reported in the server log
+    try:
+        version = get_object_version(conn, file_path)
+    except Exception as version_e:
+        record('storage.version_failed', 0)
+        print(f'Saved {file_name} but could not read its version, its derived tables are rebuilt on load: {version_e!r}', file=sys.stderr)
+        return result, e
+    try:
+        update_trend_cube(conn, file_name, dataframe, version, stored_dataframe, previous_version)
+    except Exception as trend_e:
+        record('trends.update_failed', 0)
+        print(f'Failed to update the trend cube of {file_name}, it is rebuilt on load: {trend_e!r}', file=sys.stderr)
+    try:
+        update_company_map(conn, file_name, dataframe, version)
+    except Exception as company_e:
+        record('companies.update_failed', 0)
+        print(f'Failed to update the company map of {file_name}, it is rebuilt on load: {company_e!r}', file=sys.stderr)
+
+    return result, e
+
+def sync_dataframe(conn: FilesConnection, file_name: str, fetch_function, status, full_refresh: bool = False, checkpoint_dir: str = None) -> tuple[pd.DataFrame, pd.DataFrame, bool]:
+    '''Return the up to date trial dataset, None if the stored snapshot is already up to date,
+    or an empty DataFrame if fetching failed, along with the stored snapshot it started from
+    (None for a full refresh) and whether every page was fetched. Raise IncompleteFetchError if
+    some pages could not be fetched.'''
+
+    stored_dataframe = None
+    if not full_refresh and is_full_refresh_due(conn, file_name):
+        status.info(f'No full update in the last {FULL_REFRESH_MAX_AGE_DAYS} days. Fetching every page to pick up changes to older trials...')
+        full_refresh = True
+    if not full_refresh:
+        try:
+            stored_dataframe = read_data(conn, file_name)
+        except FileNotFoundError:
+            status.info('No stored data found. Fetching every page...')
+
+    fetched_dataframe, full_fetch = fetch_function(status, stored_dataframe=stored_dataframe, checkpoint_dir=checkpoint_dir)
+
+    if fetched_dataframe is None:
+        status.info('No new or changed trials since the last update.')
+    return fetched_dataframe, stored_dataframe, full_fetch
+
+def get_full_refresh_path(file_name: str) -> str:
+    return f'{GCS_BUCKET_NAME}/{file_name}{FULL_REFRESH_FILE_SUFFIX}.json'
+
+def read_last_full_refresh(conn: FilesConnection, file_name: str) -> datetime:
+    '''Return when the trial dataset was last fetched in full, or None if it never was.'''
+
+    try:
+        with conn.open(get_full_refresh_path(file_name), mode='rb') as f:
+            return datetime.fromisoformat(json.loads(f.read())['fetched_at'])
+    except FileNotFoundError:
+        return None
+
+def write_last_full_refresh(conn: FilesConnection, file_name: str, fetched_at: datetime = None) -> tuple[Function_Status, Exception]:
+    '''Record that the trial dataset was fetched in full (now, unless fetched_at is given).'''
+
+    fetched_at = fetched_at or datetime.now(timezone.utc)
+    try:
+        with conn.open(get_full_refresh_path(file_name), mode='wb') as f:
+            f.write(json.dumps({'fetched_at': fetched_at.isoformat()}).encode('utf-8'))
+        return Function_Status.SUCCESS, None
+    except Exception as e:
+        return Function_Status.FAIL, e
+
+def is_full_refresh_due(conn: FilesConnection, file_name: str) -> bool:
+    '''Whether the next update of the trial dataset should fetch every page. An update only fetches
+    the newest pages and stops at the first one it already has, so it never sees a change to an
+    older trial; a full fetch every FULL_REFRESH_MAX_AGE_DAYS days reconciles those.'''
+
+    last_full_refresh = read_last_full_refresh(conn, file_name)
+    return last_full_refresh is None or datetime.now(timezone.utc) - last_full_refresh >= timedelta(days=FULL_REFRESH_MAX_AGE_DAYS)
+
+def append_api_call_log(conn: FilesConnection, api_call_logs_df: pd.DataFrame, today: str) -> tuple[Function_Status, Exception]:
+    '''Append the current date and time to the API call logs in GCS.
+    Every update is its own small object, named after its timestamp, so nothing is rewritten.'''
+
+    max_row = api_call_logs_df.shape[0]
+    api_call_logs_df.loc[max_row, 'date'] = today.split('T')[0]
+    api_call_logs_df.loc[max_row, 'time'] = today.split('T')[1]
+    try:
+        with conn.open(f'{GCS_BUCKET_NAME}/{API_CALL_LOG_DIR}/{today}.json', mode='wb') as f:
+            f.write(json.dumps({'date': today.split('T')[0], 'time': today.split('T')[1]}).encode('utf-8'))
+        return Function_Status.SUCCESS, None
+    except Exception as e:
+        return Function_Status.FAIL, e
+
+def read_api_call_logs(conn: FilesConnection) -> pd.DataFrame:
+    '''Read the API call logs without the Streamlit cache (an empty log if none exists yet).
+    The dates come from a single listing of the log objects' names, none of them is downloaded.'''
 
-    url = f'{BASE_URL}/MdcinClincTestInfoService02/getMdcinClincTestInfoList02'
+    global _api_call_logs_migrated
+
+    fs = get_filesystem(conn)
+    log_dir = f'{GCS_BUCKET_NAME}/{API_CALL_LOG_DIR}'
+    if not _api_call_logs_migrated:
+        with _api_call_logs_migration_lock:
+            if not _api_call_logs_migrated:
+                migrate_api_call_logs(conn)
+                _api_call_logs_migrated = True
+
+    # Skip the listing cache, it would hide updates made by other sessions
+    fs.invalidate_cache(log_dir)
+    try:
+        names = sorted(os.path.basename(path)[:-len('.json')] for path in fs.ls(log_dir, detail=False) if path.endswith('.json'))
+    except FileNotFoundError:
+        names = []
+    return pd.DataFrame([name.split('T', 1) for name in names], columns=['date', 'time'], dtype=str)
+
+def migrate_api_call_logs(conn: FilesConnection) -> None:
+    '''Move the entries of the old single-object api_call_logs.json into per-update objects.'''
+
+    fs = get_filesystem(conn)
+    legacy_path = f'{GCS_BUCKET_NAME}/api_call_logs.json'
+    try:
+        with conn.open(legacy_path, mode='rb') as f:
+            legacy_logs_df = read_dataframe(f, 'jsonl')
+    except FileNotFoundError:
+        return None
+
+    legacy_logs_df = legacy_logs_df.reindex(columns=['date', 'time']).dropna()
+    for date, time in legacy_logs_df.itertuples(index=False):
+        result, e = append_api_call_log(conn, pd.DataFrame(columns=['date', 'time']), f'{date}T{time}')
+        if result == Function_Status.FAIL:
+            raise e
+    fs.rm(legacy_path)
+
+@timed('api.fetch_trial_data')
+def fetch_trial_data(url: str, column_names: list, status, checkpoint_dir: str = None) -> pd.DataFrame:
+    '''Fetch every page of a paginated trial API concurrently and return them as one DataFrame.
+    With a checkpoint_dir, fetched pages are saved there and pages saved by an interrupted run are reused.
+    Raise IncompleteFetchError if any page failed or came back empty.'''
 
     # Set up the parameters for the request
     params = {
-        'serviceKey': st.secrets['DECODED_API_KEY'],
+        'serviceKey': get_api_key(),
         'type': 'json',
     }
 
-    # Initialize the list to store all items
-    total_items = []
-
     # Fetch the total count first (to determine the number of pages)
-    params['pageNo'] = 1
-    params['numOfRows'] = 1  # Fetch 1 item to get the total count
-    response_body_dict = get_request(url, params)
-
-    if response_body_dict is None:
-        status.error(':red[Failed to fetch initial data. Please check your API.]', icon='🚨')
+    try:
+        response_body_dict = get_page(url, {**params, 'pageNo': 1, 'numOfRows': 1})
+    except Exception as e:
+        status.error(f':red[Failed to fetch initial data. Please check your API.] {e}', icon='🚨')
         return pd.DataFrame()  # Return an empty DataFrame if the request fails
 
     totalCount = response_body_dict.get('totalCount', 0)
@@ -144,156 +289,255 @@ def fetch_medication_trial_data(status):
         status.error(':orange[No data available from the API.]', icon='⚠️')
         return pd.DataFrame()  # Return an empty DataFrame if no data is available
 
-    num_of_pages = ceil(totalCount / 100)  # Calculate the number of pages
+    num_of_pages = ceil(totalCount / NUM_OF_ROWS)  # Calculate the number of pages
 
-    progress_bar = status.progress(value=0, text='Fetching start')
-    # Fetch data from all pages
-    for page_no in range(1, num_of_pages + 1):
-        progress_bar.progress(page_no / num_of_pages, text=f'Fetching data from page {page_no}...')
-        params['pageNo'] = page_no
-        params['numOfRows'] = 100  # Fetch 100 items per page
+    pages = {}
+    if checkpoint_dir is not None:
+        pages = load_checkpoint(checkpoint_dir, totalCount)
+        if pages:
+            status.info(f'Resuming from checkpoint: {len(pages)}/{num_of_pages} pages already fetched.')
 
-        response_body_dict = get_request(url, params)
+    progress_bar = status.progress(value=0, text='Fetching start')
+    def on_page(page_no, items, num_of_done, num_of_pages):
+        # A failed or empty page is left out, so --resume fetches it again
+        if checkpoint_dir is not None and not isinstance(items, Exception) and items:
+            save_checkpoint_page(checkpoint_dir, page_no, items)
+        progress_bar.progress(num_of_done / num_of_pages, text=f'Fetched page {page_no} ({num_of_done}/{num_of_pages})...')
 
-        if response_body_dict is None:
-            status.error(f':red[Failed to fetch data for page {page_no}. Check the API or network.]', icon='🚨')
-            continue  # Skip to the next page if the request fails
-        
-        items = response_body_dict.get('items', [])
+    # Fetch data from all pages not in the checkpoint
+    missing_page_numbers = [page_no for page_no in range(1, num_of_pages + 1) if page_no not in pages]
+    pages.update(fetch_pages(url, params, missing_page_numbers, on_page=on_page))
+    pages = dict(sorted(pages.items()))
 
-        if items:  # Only add if there are items
+    # Initialize the list to store all items
+    total_items = []
+    num_of_failed_pages = 0
+    for page_no, items in pages.items():
+        if isinstance(items, Exception):
+            status.error(f':red[Failed to fetch data for page {page_no}. Check the API or network.] {items}', icon='🚨')
+            num_of_failed_pages += 1
+        elif items:  # Only add if there are items
             total_items.extend(items)
         else:
             status.error(f':orange[No items found for page {page_no}.]', icon='⚠️')
-    
-    progress_bar.progress(1.0, text=f'Fetching complete.')
+            num_of_failed_pages += 1
+    progress_bar.progress(1.0, text='Fetching complete.')
+
+    if num_of_failed_pages:
+        raise IncompleteFetchError(f'{num_of_failed_pages} of {num_of_pages} pages could not be fetched, the stored data is kept.')
 
     # Return the collected items as a DataFrame
-    output_dataframe = pd.DataFrame(total_items)
-    output_dataframe.columns = MEDICATION_STUDY_COLUMN_NAME
+    with span('dataframe.build'):
+        output_dataframe = pd.DataFrame(total_items)
+        output_dataframe.columns = column_names
     return output_dataframe
 
-def decoding_json_bytes(json_file: GCSFile) -> list:
-    '''Decode the JSON bytes and return the list of JSON objects.'''
-
-    json_bytes = f'[{json_file.read().decode('utf-8').replace('}\n{', '},{')}]'
-    
-    return json.loads(json_bytes)
+@timed('api.fetch_trial_data_delta')
+def fetch_trial_data_delta(url: str, column_names: list, key_columns: list, stored_dataframe: pd.DataFrame, status, checkpoint_dir: str = None) -> tuple[pd.DataFrame, bool]:
+    '''Fetch only the newest pages of a trial API and merge them into the stored snapshot by key.
 
-def fetch_device_trial_data(status):
-    '''Fetch and return all medical device trial data from the API.'''
-    
-    url = f'{BASE_URL}/MdeqClncTestPlanAprvAplyDtlService01/getMdeqClncTestPlanAprvAplyDtlInq01'
+    The API lists the most recently approved trials first, so pages are fetched from the first
+    one until a page holds neither new/changed rows nor anything newer than the stored latest
+    IND Approval Date. Return None if nothing changed. Fall back to a full fetch if the merged
+    snapshot does not add up to the API's totalCount (e.g. trials were deleted or reordered).
+    Changes to trials past that page are missed, sync_dataframe makes a full fetch every
+    FULL_REFRESH_MAX_AGE_DAYS days for them. Also return whether it fell back to a full fetch.'''
 
     # Set up the parameters for the request
     params = {
-        'serviceKey': st.secrets['DECODED_API_KEY'],
+        'serviceKey': get_api_key(),
         'type': 'json',
     }
 
-    # Initialize the list to store all items
-    total_items = []
-
     # Fetch the total count first (to determine the number of pages)
-    params['pageNo'] = 1
-    params['numOfRows'] = 1  # Fetch 1 item to get the total count
-    response_body_dict = get_request(url, params)
-
-    if response_body_dict is None:
-        status.error(':red[Failed to fetch initial data. Please check your API.]', icon='🚨')
-        return pd.DataFrame()  # Return an empty DataFrame if the request fails
+    try:
+        response_body_dict = get_page(url, {**params, 'pageNo': 1, 'numOfRows': 1})
+    except Exception as e:
+        status.error(f':red[Failed to fetch initial data. Please check your API.] {e}', icon='🚨')
+        return pd.DataFrame(), False  # Return an empty DataFrame if the request fails
 
     totalCount = response_body_dict.get('totalCount', 0)
     if totalCount == 0:
         status.error(':orange[No data available from the API.]', icon='⚠️')
-        return pd.DataFrame()  # Return an empty DataFrame if no data is available
-
-    num_of_pages = ceil(totalCount / 100)  # Calculate the number of pages
+        return pd.DataFrame(), False  # Return an empty DataFrame if no data is available
 
-    progress_bar = status.progress(value=0, text='Fetching start')
-    # Fetch data from all pages
-    for page_no in range(1, num_of_pages + 1):
-        progress_bar.progress(page_no / num_of_pages, text=f'Fetching data from page {page_no}...')
-        params['pageNo'] = page_no
-        params['numOfRows'] = 100  # Fetch 100 items per page
-
-        response_body_dict = get_request(url, params)
+    num_of_pages = ceil(totalCount / NUM_OF_ROWS)
+    stored_dataframe = stored_dataframe.reindex(columns=column_names)
+    stored_rows = set(stored_dataframe.astype(str).itertuples(index=False, name=None))
+    latest_date = stored_dataframe['IND Approval Date'].astype(str).max()
 
-        if response_body_dict is None:
-            status.error(f':red[Failed to fetch data for page {page_no}. Check the API or network.]', icon='🚨')
-            continue  # Skip to the next page if the request fails
-        
-        items = response_body_dict.get('items', [])
+    # Pages holding the new trials, plus one page of overlap for recently changed ones
+    num_of_new_rows = max(totalCount - stored_dataframe.shape[0], 0)
+    batch_size = ceil(num_of_new_rows / NUM_OF_ROWS) + 1
 
-        if items:  # Only add if there are items
+    total_items = []
+    next_page_no = 1
+    while next_page_no <= num_of_pages:
+        # Reading more than half of the catalog is no cheaper than a full rebuild
+        if next_page_no > max(num_of_pages // 2, 1):
+            status.info('Too many changed pages. Fetching every page...')
+            return fetch_trial_data(url, column_names, status, checkpoint_dir), True
+
+        page_numbers = list(range(next_page_no, min(next_page_no + batch_size, num_of_pages + 1)))
+        status.info(f'Fetching page {page_numbers[0]}~{page_numbers[-1]} of {num_of_pages}...')
+        pages = fetch_pages(url, params, page_numbers)
+
+        for page_no, items in pages.items():
+            if isinstance(items, Exception):
+                status.error(f':red[Failed to fetch data for page {page_no}. Check the API or network.] {items}', icon='🚨')
+                raise IncompleteFetchError(f'Page {page_no} could not be fetched, the stored data is kept.')
             total_items.extend(items)
-        else:
-            status.error(f':orange[No items found for page {page_no}.]', icon='⚠️')
-    progress_bar.progress(1.0, text='Fetching complete')
-
-    # Return the collected items as a DataFrame
-    output_dataframe = pd.DataFrame(total_items)
-    output_dataframe.columns = MEDICAL_DEVICE_STUDY_COLUMN_NAME
-    return output_dataframe
 
-# @st.cache_data
-def fetch_medication_details_data(dataframe: pd.DataFrame):
-    '''Fetch and return details data from the API.'''
+        # Stop once the last page is entirely made of already stored rows
+        last_page_dataframe = pd.DataFrame(pages[page_numbers[-1]])
+        if not last_page_dataframe.empty:
+            last_page_dataframe.columns = column_names
+            last_page_rows = set(last_page_dataframe.astype(str).itertuples(index=False, name=None))
+            if last_page_rows <= stored_rows and last_page_dataframe['IND Approval Date'].astype(str).max() <= latest_date:
+                break
+
+        next_page_no += len(page_numbers)
+        batch_size = MAX_CONCURRENT_REQUESTS
+
+    fetched_dataframe = pd.DataFrame(total_items)
+    fetched_dataframe.columns = column_names
+    fetched_rows = fetched_dataframe.astype(str).itertuples(index=False, name=None)
+    num_of_changed_rows = sum(row not in stored_rows for row in fetched_rows)
+
+    if num_of_changed_rows == 0 and totalCount == stored_dataframe.shape[0]:
+        return None, False
+
+    # Fetched rows come first, so they replace their stored version
+    merged_dataframe = pd.concat([fetched_dataframe, stored_dataframe], ignore_index=True)
+    merged_dataframe = merged_dataframe.drop_duplicates(subset=key_columns, keep='first').reset_index(drop=True)
+
+    if merged_dataframe.shape[0] != totalCount:
+        status.info(f'Merged {merged_dataframe.shape[0]} trials but the API has {totalCount}. Fetching every page...')
+        return fetch_trial_data(url, column_names, status, checkpoint_dir), True
+
+    status.info(f'{num_of_changed_rows} new or changed trials merged.')
+    return merged_dataframe, False
+
+def fetch_medication_trial_data(status, stored_dataframe: pd.DataFrame = None, checkpoint_dir: str = None):
+    '''Fetch and return all medication trial data from the API, and whether every page was fetched.
+    If a stored snapshot is given, only fetch what changed since then (None if nothing did).'''
+
+    if stored_dataframe is None or stored_dataframe.empty:
+        return fetch_trial_data(MEDICATION_TRIAL_URL, MEDICATION_STUDY_COLUMN_NAME, status, checkpoint_dir), True
+    return fetch_trial_data_delta(MEDICATION_TRIAL_URL, MEDICATION_STUDY_COLUMN_NAME, MEDICATION_STUDY_KEY_COLUMN_NAME, stored_dataframe, status, checkpoint_dir)
+
+def fetch_device_trial_data(status, stored_dataframe: pd.DataFrame = None, checkpoint_dir: str = None):
+    '''Fetch and return all medical device trial data from the API, and whether every page was fetched.
+    If a stored snapshot is given, only fetch what changed since then (None if nothing did).'''
+
+    if stored_dataframe is None or stored_dataframe.empty:
+        return fetch_trial_data(DEVICE_TRIAL_URL, MEDICAL_DEVICE_STUDY_COLUMN_NAME, status, checkpoint_dir), True
+    return fetch_trial_data_delta(DEVICE_TRIAL_URL, MEDICAL_DEVICE_STUDY_COLUMN_NAME, MEDICAL_DEVICE_STUDY_KEY_COLUMN_NAME, stored_dataframe, status, checkpoint_dir)
+
+@timed('api.fetch_medication_details')
+def fetch_medication_details_data(dataframe: pd.DataFrame, conn: FilesConnection, on_chunk=None, notify=st.toast, bypass_cache: bool = False) -> pd.DataFrame:
+    '''Fetch and return details data of every trial in the DataFrame.
+
+    Details already in the detail store are not requested again. The missing IDs are fetched
+    concurrently and `on_chunk(details_dataframe, num_of_done, num_of_ids)` is called with
+    everything collected so far every DETAILS_UPDATE_EVERY responses or DETAILS_UPDATE_SECONDS
+    seconds. New details are saved back to the store.
+    Failed or empty responses are reported through `notify(message, icon=...)`.
+    Responses come from the response cache while fresh, unless bypass_cache is set.'''
     
-    url = f'{BASE_URL}/ClncExamPlanDtlService2/getClncExamPlanDtlInq2'
+    url = MEDICATION_DETAILS_URL
     
     # Set up the parameters for the request
     params = {
-        'serviceKey': st.secrets['DECODED_API_KEY'],
+        'serviceKey': get_api_key(),
         'pageNo': 1,
         'numOfRows': 100,
         'type': 'json',
         }
 
-    # Initialize the list to store all items
-    total_items = []
-
-    # Fetch data for each ids
-    for i in dataframe.index:
-        params['CLNC_TEST_SN'] = dataframe.loc[i,'Clinical Trial ID']
-        
-        response_body_dict = get_request(url, params)
-        
-        if response_body_dict is None:
-            st.toast(f':red[Failed to fetch data for {params['CLNC_TEST_SN']}. Check the API or network.]', icon='🚨')
-            continue  # Skip to the next page if the request fails
-        
-        items = response_body_dict.get('items', [])
-        
-        if items:  # Only add if there are items
-            total_items.extend(items)
+    trial_ids = dataframe['Clinical Trial ID'].astype(str).unique().tolist()
+    stored_dataframe = read_detail_store(conn)
+    stored_dataframe = stored_dataframe[stored_dataframe['Clinical Trial ID'].isin(trial_ids)]
+    missing_ids = sorted(set(trial_ids) - set(stored_dataframe['Clinical Trial ID']))
+
+    # Initialize the list to store all collected details, stored ones first
+    chunks = []
+    if not stored_dataframe.empty:
+        chunks.append(stored_dataframe)
+        if on_chunk is not None:
+            on_chunk(stored_dataframe, 0, len(missing_ids))
+
+    # Responses and time of the last on_chunk call. Collecting everything on every response
+    # would copy the table once per trial, so it is only done every few responses or seconds
+    last_update = {'num_of_done': 0, 'time': time.monotonic()}
+
+    def on_result(index, response_body_dict, num_of_done, num_of_ids):
+        if isinstance(response_body_dict, Exception):
+            notify(f':red[Failed to fetch data for {missing_ids[index]}. Check the API or network.]', icon='🚨')
         else:
-            st.toast(f':orange[No items found for page {params['CLNC_TEST_SN']}.]', icon='⚠️')
-    
-    # Return the collected items as a DataFrame
-    output_dataframe = pd.DataFrame(total_items).fillna('None')
+            items = response_body_dict.get('items', [])
+            
+            if items:  # Only add if there are items
+                chunks.append(make_details_dataframe(items))
+            else:
+                notify(f':orange[No items found for page {missing_ids[index]}.]', icon='⚠️')
+
+        # The caller gets the whole table once every response is in
+        if on_chunk is None or num_of_done == num_of_ids or not chunks:
+            return None
+        now = time.monotonic()
+        if num_of_done - last_update['num_of_done'] >= DETAILS_UPDATE_EVERY or now - last_update['time'] >= DETAILS_UPDATE_SECONDS:
+            # Kept as one frame, the next update only appends what arrived since
+            chunks[:] = [pd.concat(chunks, ignore_index=True)]
+            on_chunk(chunks[0], num_of_done, num_of_ids)
+            last_update.update(num_of_done=num_of_done, time=now)
+
+    # Fetch data for each missing ids
+    fetch_all(url, [{**params, 'CLNC_TEST_SN': trial_id} for trial_id in missing_ids], on_result=on_result, cache=get_response_cache(), bypass_cache=bypass_cache)
+
+    if not chunks:
+        return pd.DataFrame(columns=MEDICATION_STUDY_DETAILS_COLUMN_NAME)
+
+    output_dataframe = pd.concat(chunks, ignore_index=True)
+    if output_dataframe.shape[0] > stored_dataframe.shape[0]:
+        update_detail_store(conn, output_dataframe.iloc[stored_dataframe.shape[0]:])
+
+    # Return the collected items in the order of the given DataFrame
+    order = {trial_id: i for i, trial_id in enumerate(trial_ids)}
+    return output_dataframe.sort_values('Clinical Trial ID', key=lambda ids: ids.map(order), ignore_index=True)
+
+def make_details_dataframe(items: list) -> pd.DataFrame:
+    '''Turn detail API items into a DataFrame with the details column names.'''
+
+    output_dataframe = pd.DataFrame(items).fillna('None')
     output_dataframe.columns = MEDICATION_STUDY_DETAILS_COLUMN_NAME
+    output_dataframe['Clinical Trial ID'] = output_dataframe['Clinical Trial ID'].astype(str)
     return output_dataframe
 
-def update_data(dataframe: pd.DataFrame, conn: FilesConnection, file_path: str) -> tuple[Function_Status, Exception]:
-    '''Function to save DataFrame to Json in GCS.'''
-    
+def read_detail_store(conn: FilesConnection) -> pd.DataFrame:
+    '''Read the stored medication details (an empty frame if nothing is stored yet).'''
+
     try:
-        # Open the file in write binary mode (wb)
-        with conn.open(file_path, mode='wb') as f:
-            # Save DataFrame to JSON with specific orientation and line separation
-            dataframe.to_json(f, orient='records', lines=True, force_ascii=False)
-        
-        return Function_Status.SUCCESS, None
-    
-    except Exception as e:
+        return read_data(conn, MEDICATION_DETAILS_FILE_NAME)
+    except FileNotFoundError:
+        return pd.DataFrame(columns=MEDICATION_STUDY_DETAILS_COLUMN_NAME, dtype=str)
 
-        return Function_Status.FAIL, e
+def update_detail_store(conn: FilesConnection, details_dataframe: pd.DataFrame) -> tuple[Function_Status, Exception]:
+    '''Merge newly fetched details into the detail store by Clinical Trial ID.'''
+
+    # Re-read right before writing, so details saved by another session meanwhile are kept
+    stored_dataframe = read_detail_store(conn)
+    merged_dataframe = pd.concat([details_dataframe, stored_dataframe], ignore_index=True) if not stored_dataframe.empty else details_dataframe
+    merged_dataframe = merged_dataframe.drop_duplicates(subset=['Clinical Trial ID'], keep='first')
+    return update_data(dataframe=merged_dataframe, conn=conn, file_path=get_dataset_path(MEDICATION_DETAILS_FILE_NAME))
 
 @st.cache_data
 def make_plot(dataframe: pd.DataFrame, x: str, y: str):
     '''Make a plotly horizontal bar fig with highlight Top Data'''
 
+    # Only the trial pages draw charts, keep plotly out of every other page's startup
+    import plotly.express as px
+
     colors = ['lightgray' if count != max(dataframe[x]) else '#ffaa00' for count in dataframe[x]]
     fig = px.bar(
         dataframe,
@@ -311,35 +555,18 @@ def make_plot(dataframe: pd.DataFrame, x: str, y: str):
 
 @st.cache_data
 def top10_sponsors_plot(dataframe: pd.DataFrame):
-    '''Make a plot about top 10 sponsors about filtered medication data.'''
+    '''Make a plot about top 10 sponsors from their trial counts (see module.aggregates.top_entities).'''
 
-    x='Count'
-    y='Sponsor'
-    dataframe = dataframe.groupby(y, as_index=False)['Protocol Title'].count()
-    dataframe.columns = [y, x]
-    dataframe = dataframe.nlargest(n=10, columns=x).sort_values(x)
-
-    return make_plot(dataframe, x, y)
+    return make_plot(dataframe, 'Count', 'Sponsor')
 
 @st.cache_data
 def top10_sites_plot(dataframe: pd.DataFrame):
-    '''Make a plot about top 10 sites about filtered medication data.'''
-    x='Count'
-    y='Site'
-    dataframe = dataframe[y].str.split(' :', expand=True).melt().dropna()
-    dataframe.columns = [x, y]
-    dataframe = dataframe.groupby(y, as_index=False).count()
-    dataframe = dataframe.nlargest(n=10, columns=x).sort_values(x)
-
-    return make_plot(dataframe, x, y)
+    '''Make a plot about top 10 sites from their trial counts.'''
+
+    return make_plot(dataframe, 'Count', 'Site')
     
 @st.cache_data
 def top10_Manufacturer_plot(dataframe: pd.DataFrame):
-    '''Make a plot about top 10 manufacturer about filtered device data.'''
-    x='Count'
-    y='Manufacturer'
-    dataframe = dataframe.groupby(y, as_index=False)['Protocol Title'].count()
-    dataframe.columns = [y, x]
-    dataframe = dataframe.nlargest(n=10, columns=x).sort_values(x)
-
-    return make_plot(dataframe, x, y)
\ No newline at end of file
+    '''Make a plot about top 10 manufacturer from their trial counts.'''
+
+    return make_plot(dataframe, 'Count', 'Manufacturer')
\ No newline at end of file
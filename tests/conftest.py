@@ -0,0 +1,64 @@
+import pytest
+
+import module.fetcher as fetcher
+import module.utils as utils
+from benchmarks.mock_api import MockMFDSServer
+from benchmarks.synthetic import make_device_dataframe, make_medication_dataframe
+from module.constants import *
+
+class RecordingStatus:
+    '''Stand-in for the st.status container, keeping what it was told.'''
+
+    def __init__(self) -> None:
+        self.messages = []
+        self.errors = []
+
+    def info(self, message, **kwargs) -> None:
+        self.messages.append(message)
+
+    def error(self, message, **kwargs) -> None:
+        self.errors.append(message)
+
+    toast = warning = success = info
+
+    def progress(self, value: float = 0, text: str = '') -> 'RecordingStatus':
+        return self
+
+class PageRequests:
+    '''Trial list pages requested through fetcher.get_page. Pages in failing fail however often they are retried.'''
+
+    def __init__(self) -> None:
+        self.requested = []
+        self.failing = set()
+
+@pytest.fixture
+def status():
+    return RecordingStatus()
+
+@pytest.fixture
+def page_requests(monkeypatch):
+    page_requests = PageRequests()
+    get_page = fetcher.get_page
+    def recording_get_page(url, params, *args, **kwargs):
+        if params.get('numOfRows') == NUM_OF_ROWS:
+            page_requests.requested.append(params['pageNo'])
+            if params['pageNo'] in page_requests.failing:
+                raise ValueError(f'page {params["pageNo"]} failed')
+        return get_page(url, params, *args, **kwargs)
+    monkeypatch.setattr(fetcher, 'get_page', recording_get_page)
+    return page_requests
+
+@pytest.fixture
+def mock_api(monkeypatch):
+    '''The stand-in MFDS API on a free port, with the app's trial URLs pointed at it.
+    Retries do not back off, so injected failures cost no time.'''
+
+    server = MockMFDSServer(make_medication_dataframe(1000, realistic=True), make_device_dataframe(300), port=0)
+    server.start()
+    for name in ['MEDICATION_TRIAL_URL', 'DEVICE_TRIAL_URL', 'MEDICATION_DETAILS_URL']:
+        monkeypatch.setattr(utils, name, getattr(utils, name).replace(BASE_URL, server.base_url))
+    monkeypatch.setattr(fetcher, 'RETRY_BACKOFF_SECONDS', 0)
+    monkeypatch.setattr(fetcher, 'MAX_REQUESTS_PER_SECOND', 1000)
+    monkeypatch.setenv('DECODED_API_KEY', 'test')
+    yield server
+    server.stop()
@@ -0,0 +1,99 @@
+import pandas as pd
+import pytest
+
+import module.query_cache as query_cache
+from api import ApiError, QueryService, build_id_index, route
+from module.aggregates import build_entity_indexes
+from module.autocomplete import build_suggestion_indexes
+from module.constants import *
+from module.datasets import TrialDataset, compact_dataframe
+from module.query_cache import QueryCache
+from module.search import build_date_index, build_search_index
+
+TRIALS = pd.DataFrame([
+    ('한미약품', '20240105', '서울대학교병원 :서울아산병원', 'IP-1', '당뇨병 환자 대상 1상', '1상', '1001'),
+    ('종근당', '20240310', '서울아산병원', 'IP-2', '고혈압 환자 대상 3상', '3상', '1002'),
+    ('한미약품', '20231120', '부산대학교병원', 'IP-3', '비만 환자 대상 2상', '2상', '1003'),
+    ('셀트리온', None, '서울대학교병원', 'IP-4', '류마티스 관절염 3상', '3상', '1004'),
+    ('한미약품', '20240601', '서울아산병원 :부산대학교병원', 'IP-5', '당뇨병 환자 대상 3상', '3상', '1005'),
+], columns=MEDICATION_STUDY_COLUMN_NAME)
+
+def make_dataset(dataframe: pd.DataFrame) -> TrialDataset:
+    dataframe = compact_dataframe(dataframe)
+    entity_index = build_entity_indexes(dataframe, MEDICATION_STUDY_ENTITY_COLUMN_NAME)
+    return TrialDataset(
+        file_name=MEDICATION_TRIAL_FILE_NAME,
+        version='1',
+        dataframe=dataframe,
+        search_index=build_search_index(dataframe, MEDICATION_STUDY_SEARCH_COLUMN_NAME),
+        date_index=build_date_index(dataframe['IND Approval Date']),
+        entity_index=entity_index,
+        suggestion_index=build_suggestion_indexes(entity_index),
+        )
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(query_cache, '_query_cache', QueryCache())
+    service = QueryService(conn=None)
+    dataset = make_dataset(TRIALS)
+    service.datasets['medication'] = (dataset, build_id_index(dataset, ['Clinical Trial ID']))
+    return service
+
+def get_error(service: QueryService, path: str, params: dict = None) -> ApiError:
+    with pytest.raises(ApiError) as error:
+        route(service, path, params or {})
+    return error.value
+
+def test_search(service):
+    endpoint, body = route(service, '/v1/medication/search', {'sponsor': '한미', 'page_size': '2', 'sort': 'IND Approval Date', 'descending': 'true'})
+    assert endpoint == 'search'
+    assert (body['total'], body['num_of_pages'], body['version']) == (3, 2, '1')
+    assert [row['Clinical Trial ID'] for row in body['rows']] == ['1005', '1001']
+
+    _, body = route(service, '/v1/medication/search', {'sponsor': '한미', 'page_size': '2', 'page': '2', 'sort': 'IND Approval Date', 'descending': 'true', 'columns': 'Clinical Trial ID,Phase'})
+    assert body['rows'] == [{'Clinical Trial ID': '1003', 'Phase': '2상'}]
+
+    _, body = route(service, '/v1/medication/search', {'site': '서울', 'date_from': '2024'})
+    assert [row['Clinical Trial ID'] for row in body['rows']] == ['1001', '1002', '1005']
+    # A missing date is null, not 'None' or NaN
+    _, body = route(service, '/v1/medication/search', {'sponsor': '셀트리온'})
+    assert body['rows'][0]['IND Approval Date'] is None
+
+def test_trial(service):
+    endpoint, body = route(service, '/v1/medication/trials/1003', {})
+    assert endpoint == 'trials'
+    assert [row['Sponsor'] for row in body['rows']] == ['한미약품']
+    error = get_error(service, '/v1/medication/trials/9999')
+    assert error.status == 404
+
+@pytest.mark.parametrize('path', ['/v1/device/search', '/v1/unknown/search', '/v1/unknown/trials/1001', '/v1/medication/unknown', '/v2/medication/search', '/'])
+def test_unknown_datasets_and_paths_are_404(service, path):
+    assert get_error(service, path).status == 404
+
+@pytest.mark.parametrize('params', [
+    {'page_size': 'ten'},
+    {'page_size': '0'},
+    {'page_size': str(API_MAX_PAGE_SIZE + 1)},
+    {'page': '0'},
+    {'columns': 'Sponsor,Price'},
+    {'sort': 'Price'},
+    {'date_from': '2024Q5'},
+])
+def test_bad_search_parameters_are_400(service, params):
+    error = get_error(service, '/v1/medication/search', params)
+    assert error.status == 400
+    if 'Price' in str(params):
+        assert str(error) == "Unknown columns ['Price']."
+
+def test_top_and_suggest(service):
+    _, body = route(service, '/v1/medication/top', {'column': 'Site', 'n': '2', 'sponsor': '한미'})
+    # Two sites tie with 2 trials each, the third has 1
+    assert sorted((entity['name'], entity['count']) for entity in body['entities']) == [('부산대학교병원', 2), ('서울아산병원', 2)]
+    assert body['total'] == 3
+    assert get_error(service, '/v1/medication/top', {'column': 'Phase'}).status == 400
+
+    _, body = route(service, '/v1/medication/suggest', {'column': 'Sponsor', 'q': '한미'})
+    assert body['suggestions'] == [{'name': '한미약품', 'count': 3}]
+
+def test_health(service):
+    assert route(service, '/health', {}) == ('health', {'status': 'ok', 'versions': {'medication': '1'}})
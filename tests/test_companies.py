@@ -0,0 +1,80 @@
+import random
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from module.constants import *
+from module.autocomplete import HANGUL_FIRST, HANGUL_LAST
+from module.companies import build_company_map, build_company_trials, get_company_map_path, get_company_map_version, load_company_map, normalize_company_name, transliterate_hangul
+from module.storage import open_storage, read_derived_table, write_derived_table
+
+# Different companies whose names sound alike
+COLLISIONS = [
+    ('경동제약', '광동제약'), ('대웅', '동아'), ('태극제약', '대국제약'), ('대우제약', '대유제약'), ('Abbvie', 'AB'),
+    ('한미약품', '한미제약'), ('한', 'Han'), ('LG화', 'LGH와'), ('Celltrion', 'Seltrion'),
+]
+
+@pytest.mark.parametrize('first, second', COLLISIONS)
+def test_different_companies_keep_different_keys(first, second):
+    assert normalize_company_name(first) != normalize_company_name(second)
+
+@pytest.mark.parametrize('names', [
+    ['한미약품', '한미약품(주)', '(주) 한미약품', '㈜한미약품', '한미약품 주식회사', '주식회사 한미약품'],
+    ['Hanmi Pharm. Co., Ltd.', 'HANMI PHARM', 'Hanmi Pharm Co Ltd', 'hanmi-pharm, inc.'],
+    ['Celltrion, Inc.', 'CELLTRION', '셀트리온', '(주)셀트리온'],
+    ['Chong Kun Dang Pharmaceutical Corp.', 'ChongKunDang', '종근당', '(주)종근당'],
+])
+def test_spellings_of_one_company_share_a_key(names):
+    assert len({normalize_company_name(name) for name in names}) == 1
+
+def test_transliteration_is_lossless():
+    syllables = [chr(code) for code in range(HANGUL_FIRST, HANGUL_LAST + 1)]
+    assert len({transliterate_hangul(syllable) for syllable in syllables}) == len(syllables)
+    # Runs of syllables, Latin letters and digits mixed in
+    random_generator = random.Random(0)
+    alphabet = syllables[:200] + syllables[-200:] + list('abghnwy0')
+    names = {''.join(random_generator.choices(alphabet, k=random_generator.randint(1, 4))) for _ in range(50000)}
+    assert len({transliterate_hangul(name) for name in names}) == len(names)
+    assert transliterate_hangul('lg화학') == 'lgHWA-HAG'
+    assert transliterate_hangul('셀트리온') == 'SEL-TEU-RI-ON'
+
+def test_aliases_point_at_korean_keys():
+    for key, target in COMPANY_KEY_ALIASES.items():
+        assert key == key.lower() and key.isalnum(), key
+        # Targets are keys of Hangul names, not aliases themselves
+        assert target not in COMPANY_KEY_ALIASES, target
+        assert target != target.lower(), target
+
+def test_legal_forms_alone_are_kept():
+    assert normalize_company_name('Co., Ltd.') == 'coltd'
+
+def test_company_map_and_trials():
+    dataframe = pd.DataFrame({
+        'Manufacturer': ['Celltrion, Inc.', '셀트리온(주)', '경동제약', '광동제약', None, ' 경동제약 '],
+        'Sponsor': ['셀트리온', 'Abbvie', 'AB', '광동제약', '', '대웅'],
+    })
+    company_map = build_company_map(dataframe, ['Manufacturer', 'Sponsor'])
+    ids = dict(zip(company_map['Name'], company_map['Company ID']))
+    assert ids['Celltrion, Inc.'] == ids['셀트리온(주)'] == ids['셀트리온']
+    assert len({ids['경동제약'], ids['광동제약'], ids['Abbvie'], ids['AB'], ids['대웅'], ids['Celltrion, Inc.']}) == 6
+
+    trials = build_company_trials(dataframe, ['Manufacturer', 'Sponsor'], company_map)
+    assert trials[ids['셀트리온']].tolist() == [0, 1]
+    assert trials[ids['경동제약']].tolist() == [2, 5]
+    assert trials[ids['광동제약']].tolist() == [3]
+    assert trials[ids['AB']].tolist() == [2]
+
+def test_company_map_built_with_other_key_rules_is_rebuilt(tmp_path):
+    conn = open_storage(str(tmp_path))
+    dataset = SimpleNamespace(version='7', dataframe=pd.DataFrame({'Sponsor': ['경동제약', '광동제약']}))
+    file_path = get_company_map_path(MEDICATION_TRIAL_FILE_NAME)
+    # A map of the same dataset version that merged the two companies
+    stale_map = pd.DataFrame({'Column': 'Sponsor', 'Name': ['경동제약', '광동제약'], 'Trials': [1, 1], 'Company ID': 'C0000000000'})
+    write_derived_table(conn, file_path, stale_map, dataset.version)
+
+    company_map = load_company_map(conn, MEDICATION_TRIAL_FILE_NAME, dataset)
+    assert company_map['Company ID'].nunique() == 2
+    stored_map, source_version = read_derived_table(conn, file_path)
+    assert source_version == get_company_map_version(dataset.version)
+    assert stored_map['Company ID'].nunique() == 2
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from module.datasets import TrialDataset, get_page_row_ids, get_result_page_row_ids, get_result_sorted_row_ids, get_sorted_row_ids
+from module.query_cache import QueryResult
+
+def make_dataset(dataframe: pd.DataFrame) -> TrialDataset:
+    return TrialDataset(file_name='trials', version='1', dataframe=dataframe, search_index={}, date_index=None, entity_index={})
+
+@pytest.fixture
+def dataset():
+    return make_dataset(pd.DataFrame({
+        'Sponsor': ['b', None, 'a', 'c', 'a', None, 'b'],
+        'Phase': ['2', '1', None, '1', '3', '2', '1'],
+    }))
+
+def pandas_order(dataframe: pd.DataFrame, mask: np.ndarray, sort_columns: list, descending: bool) -> list:
+    return dataframe[mask].sort_values(sort_columns, ascending=not descending, na_position='last', kind='stable').index.tolist()
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_missing_values_sort_last(dataset, descending):
+    row_ids = get_sorted_row_ids(dataset, np.ones(7, dtype=bool), ['Sponsor'], descending)
+    assert row_ids[-2:].tolist() == [1, 5]
+    assert row_ids.tolist() == ([2, 4, 0, 6, 3, 1, 5] if not descending else [3, 0, 6, 2, 4, 1, 5])
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('sort_columns', [['Sponsor'], ['Phase'], ['Sponsor', 'Phase'], ['Phase', 'Sponsor']])
+def test_sorted_row_ids_match_pandas(dataset, sort_columns, descending):
+    mask = np.array([True, True, False, True, True, True, True])
+    expected = pandas_order(dataset.dataframe, mask, sort_columns, descending)
+    assert get_sorted_row_ids(dataset, mask, sort_columns, descending).tolist() == expected
+
+def test_page_row_ids(dataset):
+    mask = np.ones(7, dtype=bool)
+    sorted_row_ids = get_sorted_row_ids(dataset, mask, ['Sponsor'], True).tolist()
+    assert get_page_row_ids(dataset, mask, ['Sponsor'], True, page=2, page_size=3).tolist() == sorted_row_ids[3:6]
+    assert get_page_row_ids(dataset, mask, [], False, page=1, page_size=10).tolist() == list(range(7))
+
+def test_result_pages_are_sorted_once(dataset):
+    mask = np.array([True, True, False, True, True, True, True])
+    result = QueryResult(row_ids=np.flatnonzero(mask), num_of_rows=7, top_entities={})
+    sorted_row_ids = get_sorted_row_ids(dataset, mask, ['Sponsor', 'Phase'], True).tolist()
+    pages = [get_result_page_row_ids(dataset, result, ['Sponsor', 'Phase'], True, page, 2).tolist() for page in (1, 2, 3)]
+    assert sum(pages, []) == sorted_row_ids
+    assert list(result.sorted_row_ids) == [(('Sponsor', 'Phase'), True)]
+    # Without sort columns the matches are already in row order
+    assert get_result_page_row_ids(dataset, result, [], False, 2, 4).tolist() == [5, 6]
+    assert len(result.sorted_row_ids) == 1
+    # The export gets the same cached arrays, not a new sort
+    assert get_result_sorted_row_ids(dataset, result, ['Sponsor', 'Phase'], True) is result.sorted_row_ids[(('Sponsor', 'Phase'), True)]
+    assert get_result_sorted_row_ids(dataset, result, [], False) is result.row_ids
@@ -0,0 +1,45 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import module.exports as exports
+from module.constants import *
+from module.storage import open_storage
+
+@pytest.fixture
+def dataframe():
+    return pd.DataFrame({'Sponsor': ['한미약품', None, 'Celltrion, Inc.', 'a,"b"'], 'Phase': ['1', '2', '3', None]})
+
+@pytest.mark.parametrize('file_format', list(exports.EXPORT_FORMATS))
+def test_small_export_is_downloaded(tmp_path, dataframe, file_format):
+    row_ids = np.array([2, 0, 3])
+    export = exports.prepare_export(open_storage(str(tmp_path)), dataframe, row_ids, ['Sponsor'], file_format, 'trials')
+    assert export['url'] is None and export['rows'] == 3
+    assert export['bytes'] == len(export['data'])
+    if file_format == 'CSV':
+        exported = pd.read_csv(io.BytesIO(export['data']), dtype=str)
+    elif file_format == 'Excel':
+        exported = pd.read_excel(io.BytesIO(export['data']), dtype=str)
+    else:
+        exported = pd.read_parquet(io.BytesIO(export['data']))
+    assert exported['Sponsor'].tolist() == ['Celltrion, Inc.', '한미약품', 'a,"b"']
+
+def test_large_export_without_a_signed_link_is_downloaded(tmp_path, monkeypatch, dataframe):
+    monkeypatch.setattr(exports, 'EXPORT_DOWNLOAD_MAX_BYTES', 10)
+    # A local directory cannot sign links
+    export = exports.prepare_export(open_storage(str(tmp_path)), dataframe, np.arange(4), ['Sponsor', 'Phase'], 'CSV', 'trials')
+    assert export['url'] is None
+    assert export['bytes'] > 10 and export['bytes'] == len(export['data'])
+    # Nothing is uploaded behind a link nobody can open
+    assert not (tmp_path / GCS_BUCKET_NAME / EXPORT_DIR).exists()
+
+def test_large_export_is_uploaded_behind_a_signed_link(tmp_path, monkeypatch, dataframe):
+    monkeypatch.setattr(exports, 'EXPORT_DOWNLOAD_MAX_BYTES', 10)
+    monkeypatch.setattr(exports, 'get_export_link', lambda conn, file_path: f'https://signed.example/{file_path}')
+    export = exports.prepare_export(open_storage(str(tmp_path)), dataframe, np.arange(4), ['Sponsor', 'Phase'], 'CSV', 'trials')
+    assert export['data'] is None
+    uploaded = list((tmp_path / GCS_BUCKET_NAME / EXPORT_DIR).glob(f'*/{export["file_name"]}'))
+    assert len(uploaded) == 1 and uploaded[0].stat().st_size == export['bytes']
+    assert export['url'].endswith(export['file_name'])
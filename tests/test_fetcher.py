@@ -0,0 +1,106 @@
+import os
+
+import pandas as pd
+import pytest
+import requests
+
+import module.fetcher as fetcher
+import module.utils as utils
+from benchmarks.mock_api import get_endpoint_path
+from benchmarks.synthetic import make_medication_dataframe
+from module.constants import *
+from module.fetcher import IncompleteFetchError, clear_checkpoint, fetch_all, fetch_pages, get_page, load_checkpoint, save_checkpoint_page
+
+def list_params(page_no: int, num_of_rows: int = NUM_OF_ROWS) -> dict:
+    return {'serviceKey': 'test', 'type': 'json', 'pageNo': page_no, 'numOfRows': num_of_rows}
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    '''Backoff delays slept by get_page, without sleeping.'''
+
+    delays = []
+    monkeypatch.setattr(fetcher.time, 'sleep', delays.append)
+    return delays
+
+def test_fetch_all_keeps_the_order_of_the_requests(mock_api):
+    results = []
+    bodies = fetch_all(utils.MEDICATION_TRIAL_URL, [list_params(page_no, 10) for page_no in [5, 1, 3]], on_result=lambda *args: results.append(args))
+    served_ids = [row['Clinical Trial ID'] for row in mock_api.datasets[get_endpoint_path(MEDICATION_TRIAL_URL)]]
+    assert [[item['Clinical Trial ID'] for item in body['items']] for body in bodies] == [served_ids[40:50], served_ids[:10], served_ids[20:30]]
+    # Every request reported once, from the calling thread, as it finished
+    assert sorted(index for index, *_ in results) == [0, 1, 2]
+    assert [(num_of_done, num_of_requests) for _, _, num_of_done, num_of_requests in results] == [(1, 3), (2, 3), (3, 3)]
+
+def test_fetch_all_returns_the_errors(mock_api, monkeypatch):
+    monkeypatch.setattr(fetcher, 'MAX_RETRIES', 0)
+    mock_api.failure_rate = 1.0
+    bodies = fetch_all(utils.MEDICATION_TRIAL_URL, [list_params(1), list_params(2)])
+    assert all(isinstance(body, requests.exceptions.HTTPError) for body in bodies)
+
+def test_fetch_pages(mock_api):
+    pages = fetch_pages(utils.MEDICATION_TRIAL_URL, {'serviceKey': 'test', 'type': 'json'}, [10, 2, 11])
+    assert list(pages) == [10, 2, 11]
+    assert [len(items) for items in pages.values()] == [100, 100, 0]
+
+def test_get_page_retries_with_exponential_backoff(mock_api, monkeypatch, sleeps):
+    monkeypatch.setattr(fetcher, 'RETRY_BACKOFF_SECONDS', 0.5)
+    mock_api.failure_rate = 1.0
+    with pytest.raises(requests.exceptions.HTTPError):
+        get_page(utils.MEDICATION_TRIAL_URL, list_params(1))
+    assert mock_api.num_of_requests == MAX_RETRIES + 1
+    assert sleeps == [0.5 * 2 ** attempt for attempt in range(MAX_RETRIES)]
+
+def test_get_page_recovers_from_failures(mock_api, sleeps):
+    mock_api.failure_rate = 0.5
+    for page_no in range(1, 11):
+        assert len(get_page(utils.MEDICATION_TRIAL_URL, list_params(page_no))['items']) == NUM_OF_ROWS
+    assert mock_api.num_of_failures > 0
+    assert mock_api.num_of_requests == 10 + mock_api.num_of_failures
+    assert len(sleeps) == mock_api.num_of_failures
+
+def test_checkpoint_save_load_and_clear(tmp_path):
+    checkpoint_dir = str(tmp_path / 'checkpoint')
+    assert load_checkpoint(checkpoint_dir, 1000) == {}
+    save_checkpoint_page(checkpoint_dir, 2, [{'id': 2}])
+    save_checkpoint_page(checkpoint_dir, 10, [{'id': 10}])
+    assert sorted(os.listdir(checkpoint_dir)) == ['meta.json', 'page_00002.json', 'page_00010.json']
+    assert load_checkpoint(checkpoint_dir, 1000) == {2: [{'id': 2}], 10: [{'id': 10}]}
+
+    # Taken for another totalCount, its pages no longer line up
+    assert load_checkpoint(checkpoint_dir, 1001) == {}
+    assert os.listdir(checkpoint_dir) == ['meta.json']
+    save_checkpoint_page(checkpoint_dir, 1, [{'id': 1}])
+    clear_checkpoint(checkpoint_dir)
+    assert not os.path.exists(checkpoint_dir)
+    clear_checkpoint(checkpoint_dir)
+
+def test_resume_fetches_only_the_missing_pages(mock_api, status, page_requests, tmp_path):
+    checkpoint_dir = str(tmp_path / 'checkpoint')
+    page_requests.failing.update({3, 7})
+    with pytest.raises(IncompleteFetchError):
+        utils.fetch_trial_data(utils.MEDICATION_TRIAL_URL, MEDICATION_STUDY_COLUMN_NAME, status, checkpoint_dir)
+    assert sorted(page_requests.requested) == list(range(1, 11))
+    assert len(load_checkpoint(checkpoint_dir, 1000)) == 8
+
+    page_requests.failing.clear()
+    page_requests.requested.clear()
+    dataframe = utils.fetch_trial_data(utils.MEDICATION_TRIAL_URL, MEDICATION_STUDY_COLUMN_NAME, status, checkpoint_dir)
+    assert sorted(page_requests.requested) == [3, 7]
+    assert 'Resuming from checkpoint: 8/10 pages already fetched.' in status.messages
+    # Pages in their order, the same rows as a fetch without a checkpoint
+    served_dataframe = make_medication_dataframe(1000, realistic=True).sort_values('IND Approval Date', ascending=False, kind='stable')
+    pd.testing.assert_frame_equal(dataframe, served_dataframe[MEDICATION_STUDY_COLUMN_NAME].reset_index(drop=True))
+
+def test_checkpoint_of_another_total_count_is_fetched_again(mock_api, status, page_requests, tmp_path):
+    checkpoint_dir = str(tmp_path / 'checkpoint')
+    page_requests.failing.add(3)
+    with pytest.raises(IncompleteFetchError):
+        utils.fetch_trial_data(utils.MEDICATION_TRIAL_URL, MEDICATION_STUDY_COLUMN_NAME, status, checkpoint_dir)
+
+    # New trials shift every page
+    mock_api.set_dataset(MEDICATION_TRIAL_URL, make_medication_dataframe(1001, realistic=True))
+    page_requests.failing.clear()
+    page_requests.requested.clear()
+    dataframe = utils.fetch_trial_data(utils.MEDICATION_TRIAL_URL, MEDICATION_STUDY_COLUMN_NAME, status, checkpoint_dir)
+    assert sorted(page_requests.requested) == list(range(1, 12))
+    assert dataframe.shape[0] == 1001
@@ -0,0 +1,24 @@
+from datetime import datetime, timedelta, timezone
+
+from module.constants import *
+from module.storage import open_storage
+from module.utils import is_full_refresh_due, read_last_full_refresh, write_last_full_refresh
+
+def test_full_refresh_is_due_without_one(tmp_path):
+    conn = open_storage(str(tmp_path))
+    assert read_last_full_refresh(conn, MEDICATION_TRIAL_FILE_NAME) is None
+    assert is_full_refresh_due(conn, MEDICATION_TRIAL_FILE_NAME)
+
+def test_full_refresh_is_due_once_the_last_one_is_old(tmp_path):
+    conn = open_storage(str(tmp_path))
+    now = datetime.now(timezone.utc)
+    write_last_full_refresh(conn, MEDICATION_TRIAL_FILE_NAME, now - timedelta(days=FULL_REFRESH_MAX_AGE_DAYS - 1))
+    assert not is_full_refresh_due(conn, MEDICATION_TRIAL_FILE_NAME)
+    # Tracked per dataset
+    assert is_full_refresh_due(conn, DEVICE_TRIAL_FILE_NAME)
+
+    write_last_full_refresh(conn, MEDICATION_TRIAL_FILE_NAME, now - timedelta(days=FULL_REFRESH_MAX_AGE_DAYS, seconds=1))
+    assert is_full_refresh_due(conn, MEDICATION_TRIAL_FILE_NAME)
+    write_last_full_refresh(conn, MEDICATION_TRIAL_FILE_NAME)
+    assert not is_full_refresh_due(conn, MEDICATION_TRIAL_FILE_NAME)
+    assert abs(read_last_full_refresh(conn, MEDICATION_TRIAL_FILE_NAME) - datetime.now(timezone.utc)) < timedelta(minutes=1)
@@ -0,0 +1,77 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import module.datasets as datasets
+import module.query_cache as query_cache
+from module.constants import *
+from module.datasets import load_dataset
+from module.query_cache import QueryCache, QueryResult, make_query_key, search_cached
+from module.storage import get_dataset_path, open_storage, update_data
+
+FILE_NAME = 'query_cache_trials'
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = QueryCache(max_entries=4)
+    monkeypatch.setattr(query_cache, '_query_cache', cache)
+    return cache
+
+def make_result(num_of_rows: int = 1) -> QueryResult:
+    return QueryResult(row_ids=np.arange(num_of_rows, dtype=np.int32), num_of_rows=num_of_rows, top_entities={})
+
+def test_query_key_normalization():
+    dataset = SimpleNamespace(file_name=FILE_NAME, version='1')
+    key = make_query_key(dataset, {'Sponsor': 'Hanmi', 'Site': '서울'}, (20240000, 20249999))
+    # Case, empty fields and the order of the fields do not matter
+    assert make_query_key(dataset, {'Site': '서울', 'Phase': '', 'Sponsor': 'HANMI'}, [20240000, 20249999]) == key
+    # Whitespace is part of the match, other dates and versions are other searches
+    assert make_query_key(dataset, {'Sponsor': 'Hanmi ', 'Site': '서울'}, (20240000, 20249999)) != key
+    assert make_query_key(dataset, {'Sponsor': 'Hanmi', 'Site': '서울'}, None) != key
+    assert make_query_key(SimpleNamespace(file_name=FILE_NAME, version='2'), {'Sponsor': 'Hanmi', 'Site': '서울'}, (20240000, 20249999)) != key
+    assert make_query_key(dataset, {}) == make_query_key(dataset, {'Sponsor': ''})
+
+def test_least_recently_used_entries_are_evicted():
+    cache = QueryCache(max_entries=2)
+    cache.put(('a',), make_result())
+    cache.put(('b',), make_result())
+    # Used last, so 'b' is the least recently used now
+    assert cache.get(('a',)) is not None
+    cache.put(('c',), make_result())
+    assert cache.get(('b',)) is None
+    assert cache.get(('a',)) is not None and cache.get(('c',)) is not None
+    stats = cache.stats()
+    assert stats['entries'] == 2 and stats['evictions'] == 1
+    assert stats['hits'] == 3 and stats['misses'] == 1
+
+def write_dataset(conn, tmp_path, sponsors: list, mtime: int) -> None:
+    dataframe = pd.DataFrame({
+        'Sponsor': sponsors,
+        'IND Approval Date': [f'2024{month:02d}01' for month in range(1, len(sponsors) + 1)],
+    })
+    update_data(dataframe, conn, get_dataset_path(FILE_NAME))
+    # A new object version, however close together the writes were
+    os.utime(tmp_path / get_dataset_path(FILE_NAME), (mtime, mtime))
+
+def test_new_dataset_version_invalidates_its_searches(tmp_path, monkeypatch, cache):
+    monkeypatch.setenv('SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+    monkeypatch.setattr(datasets, '_datasets', {})
+    conn = open_storage(str(tmp_path / 'storage'))
+    write_dataset(conn, tmp_path / 'storage', ['Hanmi', 'Celltrion', 'hanmi pharm'], 1_700_000_000)
+
+    dataset = load_dataset(conn, FILE_NAME, search_columns=['Sponsor'])
+    result = search_cached(dataset, {'Sponsor': 'hanmi'})
+    assert result.row_ids.tolist() == [0, 2]
+    assert search_cached(dataset, {'Sponsor': 'HANMI'}) is result
+    # The unchanged version is not loaded again, nor are its searches dropped
+    assert load_dataset(conn, FILE_NAME, search_columns=['Sponsor']) is dataset
+    assert cache.stats()['entries'] == 1
+
+    write_dataset(conn, tmp_path / 'storage', ['Celltrion', 'Hanmi'], 1_700_000_100)
+    new_dataset = load_dataset(conn, FILE_NAME, search_columns=['Sponsor'])
+    assert new_dataset.version != dataset.version
+    assert cache.stats()['entries'] == 0 and cache.stats()['invalidations'] == 1
+    assert search_cached(new_dataset, {'Sponsor': 'hanmi'}).row_ids.tolist() == [1]
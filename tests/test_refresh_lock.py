@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+
+import pytest
+
+from module.constants import *
+from module.refresh_lock import GCSLockStore, LocalLockStore, RefreshLock, open_refresh_lock
+from module.storage import open_storage
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalLockStore(str(tmp_path / 'bucket' / 'refresh.lock'))
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_store_write_needs_the_current_generation(store):
+    assert store.read() is None
+    assert store.write({'owner': 'a'}, if_generation_match='0') == '1'
+    # Like a GCS 412, a write against a stale generation is refused
+    assert store.write({'owner': 'b'}, if_generation_match='0') is None
+    assert store.write({'owner': 'a'}, if_generation_match='1') == '2'
+    assert store.read() == ({'owner': 'a'}, '2')
+    assert store.delete('1') is False
+    assert store.delete('2') is True
+    assert store.read() is None
+    assert store.delete('2') is False
+
+def test_acquire_and_release(store):
+    lock = RefreshLock(store, lease_seconds=60, heartbeat_seconds=60)
+    assert lock.holder() is None
+    assert lock.acquire()
+    assert lock.holder()['owner'] == lock.owner
+    lock.release()
+    assert store.read() is None
+    assert lock.holder() is None
+    # Released locks can be taken again
+    assert lock.acquire()
+    lock.release()
+
+def test_second_acquirer_is_refused(store):
+    first = RefreshLock(store, lease_seconds=60, heartbeat_seconds=60)
+    second = RefreshLock(store, lease_seconds=60, heartbeat_seconds=60)
+    assert first.acquire()
+    try:
+        assert not second.acquire()
+        # The precondition a concurrent writer would use fails too
+        assert store.write(second.make_payload(time.time()), if_generation_match='0') is None
+        with pytest.raises(RuntimeError):
+            with second:
+                pass
+        assert second.holder()['owner'] == first.owner
+    finally:
+        first.release()
+    assert second.acquire()
+    second.release()
+
+def test_only_one_of_concurrent_acquirers_wins(store):
+    locks = [RefreshLock(store, lease_seconds=60, heartbeat_seconds=60) for _ in range(8)]
+    barrier = threading.Barrier(len(locks))
+    results = [None] * len(locks)
+
+    def acquire(position):
+        barrier.wait()
+        results[position] = locks[position].acquire()
+
+    threads = [threading.Thread(target=acquire, args=(position,)) for position in range(len(locks))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert results.count(True) == 1
+        assert store.read()[0]['owner'] == locks[results.index(True)].owner
+    finally:
+        for lock, acquired in zip(locks, results):
+            if acquired:
+                lock.release()
+
+def test_expired_lease_is_taken_over(store):
+    # A holder that stopped heartbeating, e.g. a crashed process
+    crashed = RefreshLock(store, lease_seconds=0.2, heartbeat_seconds=60)
+    waiting = RefreshLock(store, lease_seconds=60, heartbeat_seconds=60)
+    assert crashed.acquire()
+    try:
+        assert not waiting.acquire()
+        assert wait_until(lambda: crashed.holder() is None)
+        assert waiting.wait(timeout=0, poll_seconds=0)
+        assert waiting.acquire()
+        assert waiting.holder()['owner'] == waiting.owner
+    finally:
+        crashed.release()
+        waiting.release()
+
+def test_heartbeat_keeps_the_lease(store):
+    holder = RefreshLock(store, lease_seconds=0.3, heartbeat_seconds=0.05)
+    other = RefreshLock(store, lease_seconds=60, heartbeat_seconds=60)
+    assert holder.acquire()
+    try:
+        time.sleep(0.6)
+        assert not other.acquire()
+        assert not holder.lost
+    finally:
+        holder.release()
+    assert store.read() is None
+
+def test_lost_holder_keeps_the_new_holders_lock(store):
+    lost = RefreshLock(store, lease_seconds=0.2, heartbeat_seconds=60)
+    new = RefreshLock(store, lease_seconds=60, heartbeat_seconds=60)
+    assert lost.acquire()
+    assert wait_until(lambda: new.holder() is None)
+    assert new.acquire()
+    try:
+        # The lost holder's release must not delete a lock it no longer owns
+        lost.release()
+        assert new.holder()['owner'] == new.owner
+    finally:
+        new.release()
+    assert store.read() is None
+
+def test_heartbeat_notices_the_takeover(store):
+    lost = RefreshLock(store, lease_seconds=0.2, heartbeat_seconds=0.5)
+    new = RefreshLock(store, lease_seconds=60, heartbeat_seconds=60)
+    assert lost.acquire()
+    try:
+        assert wait_until(lambda: new.holder() is None)
+        assert new.acquire()
+        # The next beat fails its precondition instead of overwriting the new holder
+        assert wait_until(lambda: lost.lost)
+        assert new.holder()['owner'] == new.owner
+        lost.release()
+        assert new.holder()['owner'] == new.owner
+    finally:
+        lost.release()
+        new.release()
+
+def test_open_refresh_lock_on_a_local_directory(tmp_path):
+    lock = open_refresh_lock(open_storage(str(tmp_path)))
+    assert isinstance(lock.store, LocalLockStore)
+    with lock:
+        assert os.path.exists(tmp_path / GCS_BUCKET_NAME / REFRESH_LOCK_FILE_NAME)
+    assert not os.path.exists(tmp_path / GCS_BUCKET_NAME / REFRESH_LOCK_FILE_NAME)
+
+class FakeGCSFileSystem:
+    '''Answers GCSLockStore's fs.call requests like the GCS JSON API, 412 for a failed precondition.'''
+
+    base = 'https://storage.googleapis.com/storage/v1/'
+
+    def __init__(self) -> None:
+        self.objects = {}
+        self.generation = 0
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def split_path(self, path: str) -> tuple:
+        bucket, key = path.split('/', 1)
+        return bucket, key, None
+
+    def call(self, method: str, path: str, *args, headers=None, data=None, json_out=False, **kwargs):
+        from gcsfs.retry import HttpError
+
+        with self.lock:
+            self.requests.append((method, path.format(*args)))
+            key = (args[0], kwargs['name']) if method == 'POST' else args
+            current = self.objects.get(key)
+            if method != 'POST' and current is None:
+                raise FileNotFoundError(path)
+            if 'ifGenerationMatch' in kwargs and kwargs['ifGenerationMatch'] != (current[1] if current else '0'):
+                raise HttpError({'code': 412, 'message': 'Precondition Failed'})
+            if method == 'GET':
+                return {'x-goog-generation': current[1]}, current[0]
+            if method == 'DELETE':
+                del self.objects[key]
+                return None
+            self.generation += 1
+            self.objects[key] = (data, str(self.generation))
+            return {'generation': self.generation}
+
+def test_gcs_store_treats_412_as_held():
+    fs = FakeGCSFileSystem()
+    store = GCSLockStore(fs, f'{GCS_BUCKET_NAME}/{REFRESH_LOCK_FILE_NAME}')
+    assert store.read() is None
+    generation = store.write({'owner': 'a'}, if_generation_match='0')
+    assert fs.requests[-1] == ('POST', f'https://storage.googleapis.com/upload/storage/v1/b/{GCS_BUCKET_NAME}/o')
+    # Another writer's precondition fails with 412, which means the lock is held
+    assert store.write({'owner': 'b'}, if_generation_match='0') is None
+    assert store.read() == ({'owner': 'a'}, generation)
+    assert store.delete('0') is False
+    assert store.delete(generation) is True
+    assert store.delete(generation) is False
+
+def test_gcs_store_lock_is_held_by_one_owner():
+    store = GCSLockStore(FakeGCSFileSystem(), f'{GCS_BUCKET_NAME}/{REFRESH_LOCK_FILE_NAME}')
+    first = RefreshLock(store, lease_seconds=60, heartbeat_seconds=60)
+    second = RefreshLock(store, lease_seconds=60, heartbeat_seconds=60)
+    assert first.acquire()
+    try:
+        assert not second.acquire()
+        assert second.holder()['owner'] == first.owner
+    finally:
+        first.release()
+    assert store.read() is None
+    assert second.acquire()
+    second.release()
+
+def test_gcs_store_raises_other_errors():
+    from gcsfs.retry import HttpError
+
+    fs = FakeGCSFileSystem()
+    def unavailable(*args, **kwargs):
+        raise HttpError({'code': 503, 'message': 'Service Unavailable'})
+    fs.call = unavailable
+    store = GCSLockStore(fs, f'{GCS_BUCKET_NAME}/{REFRESH_LOCK_FILE_NAME}')
+    with pytest.raises(HttpError):
+        store.write({'owner': 'a'}, if_generation_match='0')
+    with pytest.raises(HttpError):
+        store.delete('1')
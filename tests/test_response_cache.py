@@ -0,0 +1,113 @@
+import os
+
+import pandas as pd
+import pytest
+
+import module.response_cache as response_cache
+import module.utils as utils
+from module.constants import *
+from module.response_cache import ResponseCache, get_response_cache, make_cache_key
+from module.storage import open_storage
+
+URL = MEDICATION_DETAILS_URL
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, 'time', clock)
+    return clock
+
+def params(trial_id: str, service_key: str = 'key') -> dict:
+    return {'serviceKey': service_key, 'type': 'json', 'CLNC_TEST_SN': trial_id}
+
+def test_key_ignores_the_service_key(tmp_path):
+    assert make_cache_key(URL, params('1', 'a')) == make_cache_key(URL, params('1', 'b'))
+    assert make_cache_key(URL, params('1')) != make_cache_key(URL, params('2'))
+    assert make_cache_key(URL, params('1')) != make_cache_key(URL + '2', params('1'))
+
+    cache = ResponseCache(directory=str(tmp_path))
+    cache.put(URL, params('1', 'secret-key'), {'items': []}, 10)
+    assert cache.get(URL, params('1', 'other-key')) == {'items': []}
+    for name in os.listdir(tmp_path):
+        assert 'secret-key' not in (tmp_path / name).read_text(encoding='utf-8')
+
+@pytest.mark.parametrize('with_directory', [False, True])
+def test_entries_expire_after_the_ttl(clock, tmp_path, with_directory):
+    cache = ResponseCache(ttl_seconds=60, directory=str(tmp_path) if with_directory else None)
+    cache.put(URL, params('1'), {'items': [1]}, 10)
+    clock.now += 60
+    assert cache.get(URL, params('1')) == {'items': [1]}
+    clock.now += 1
+    assert cache.get(URL, params('1')) is None
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+def test_disk_entries_keep_their_age(clock, tmp_path):
+    ResponseCache(ttl_seconds=60, directory=str(tmp_path)).put(URL, params('1'), {'items': [1]}, 10)
+    clock.now += 30
+    # Another process finds it, promoted to memory with its original age
+    cache = ResponseCache(ttl_seconds=60, directory=str(tmp_path))
+    assert cache.get(URL, params('1')) == {'items': [1]}
+    clock.now += 31
+    assert cache.get(URL, params('1')) is None
+
+def test_least_recently_used_entries_are_evicted_by_bytes():
+    cache = ResponseCache(max_bytes=100)
+    for trial_id in ['1', '2']:
+        cache.put(URL, params(trial_id), {'items': [trial_id]}, 40)
+    # Used last, so '2' is the least recently used now
+    assert cache.get(URL, params('1')) is not None
+    cache.put(URL, params('3'), {'items': ['3']}, 40)
+    assert cache.get(URL, params('2')) is None
+    assert cache.get(URL, params('1')) is not None
+    assert cache.get(URL, params('3')) is not None
+    assert cache.stats()['bytes'] == 80
+
+    # Larger than the whole cache, not worth evicting everything for
+    cache.put(URL, params('4'), {'items': ['4']}, 101)
+    assert cache.get(URL, params('4')) is None
+    assert cache.stats()['entries'] == 2
+
+def test_least_recently_used_entries_are_evicted_by_count():
+    cache = ResponseCache(max_entries=2)
+    for trial_id in ['1', '2', '3']:
+        cache.put(URL, params(trial_id), {'items': [trial_id]}, 1)
+    assert [cache.get(URL, params(trial_id)) is not None for trial_id in ['1', '2', '3']] == [False, True, True]
+
+def test_disk_tier_is_pruned_by_bytes(tmp_path):
+    cache = ResponseCache(max_bytes=200, directory=str(tmp_path))
+    for trial_id in range(10):
+        cache.put(URL, params(str(trial_id)), {'items': ['x' * 30]}, 1)
+    assert sum(entry.stat().st_size for entry in os.scandir(tmp_path)) <= 200
+
+def test_empty_directory_means_memory_only(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(response_cache, '_response_cache', None)
+    monkeypatch.setenv('RESPONSE_CACHE_DIR', '')
+    cache = get_response_cache()
+    assert cache.directory is None
+    cache.put(URL, params('1'), {'items': []}, 10)
+    assert os.listdir(tmp_path) == []
+
+def test_details_without_items_are_not_requested_again(mock_api, tmp_path, monkeypatch):
+    monkeypatch.setattr(response_cache, '_response_cache', ResponseCache())
+    conn = open_storage(str(tmp_path))
+    # Only the first ID has details, the other two are never stored
+    dataframe = pd.DataFrame({'Clinical Trial ID': [next(iter(mock_api.sponsors)), 'missing-1', 'missing-2']})
+    notify = lambda message, icon=None: None
+
+    details_dataframe = utils.fetch_medication_details_data(dataframe, conn, notify=notify)
+    assert details_dataframe.shape[0] == 1
+    num_of_requests = mock_api.num_of_requests
+    utils.fetch_medication_details_data(dataframe, conn, notify=notify)
+    assert mock_api.num_of_requests == num_of_requests
+    # Unless the cache is bypassed
+    utils.fetch_medication_details_data(dataframe, conn, notify=notify, bypass_cache=True)
+    assert mock_api.num_of_requests == num_of_requests + 2
@@ -0,0 +1,34 @@
+import pandas as pd
+import pytest
+
+import module.utils as utils
+from module.constants import *
+from module.metrics import reset, snapshot
+from module.storage import open_storage, read_data
+
+@pytest.fixture
+def dataframe():
+    return pd.DataFrame({column: [f'{column} {i}' for i in range(3)] for column in MEDICATION_STUDY_COLUMN_NAME})
+
+def fail(*args, **kwargs):
+    raise OSError('bucket unavailable')
+
+def test_trend_cube_failure_is_reported(tmp_path, monkeypatch, capsys, dataframe):
+    conn = open_storage(str(tmp_path))
+    monkeypatch.setattr(utils, 'update_trend_cube', fail)
+    reset()
+    # The dataset itself is saved
+    assert utils.save_trial_data(conn, MEDICATION_TRIAL_FILE_NAME, dataframe) == (Function_Status.SUCCESS, None)
+    assert read_data(conn, MEDICATION_TRIAL_FILE_NAME).shape[0] == 3
+    assert snapshot()['trends.update_failed']['count'] == 1
+    assert 'trend cube of medication_trial_info' in capsys.readouterr().err
+
+def test_company_map_failure_is_reported(tmp_path, monkeypatch, capsys, dataframe):
+    conn = open_storage(str(tmp_path))
+    monkeypatch.setattr(utils, 'update_company_map', fail)
+    reset()
+    assert utils.save_trial_data(conn, MEDICATION_TRIAL_FILE_NAME, dataframe) == (Function_Status.SUCCESS, None)
+    assert read_data(conn, MEDICATION_TRIAL_FILE_NAME).shape[0] == 3
+    assert snapshot()['companies.update_failed']['count'] == 1
+    assert 'trends.update_failed' not in snapshot()
+    assert 'company map of medication_trial_info' in capsys.readouterr().err
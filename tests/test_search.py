@@ -0,0 +1,75 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from module.search import build_date_index, build_substring_index, parse_date_bound, parse_date_range, search_date_range, search_substring
+
+VALUES = [
+    'Seoul National University Hospital', 'SEOUL St. Mary', 'seoul', '서울대학교병원', '서울아산병원', '삼진제약', '(주)한미약품',
+    'a.b*c', 'A+B (phase 1/2)', '[test] ^start$', 'back\\slash', 'x|y', '100% done?', '', None,
+]
+QUERIES = [
+    '', 'seoul', 'SEOUL', 'Seo', 'hospital', 'l h', 'z', '서울', '서울대', '병원', '울아산병', '제약', '(주)', '한미약품x',
+    '.', 'a.b', '*', 'b*c', '+', 'A+B', '(', '1/2)', '[', '^', '$', 'start$', '\\', 'x|y', '|', '%', '?',
+]
+
+def contains_mask(series: pd.Series, query: str) -> np.ndarray:
+    if query == '':
+        return np.ones(series.shape[0], dtype=bool)
+    return series.str.contains(query, case=False, regex=False, na=False).to_numpy(dtype=bool)
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_search_substring_matches_str_contains(query):
+    series = pd.Series(VALUES * 3, dtype=object)
+    index = build_substring_index(series)
+    assert np.array_equal(search_substring(index, query), contains_mask(series, query))
+
+def test_search_substring_matches_str_contains_on_random_values():
+    random_generator = random.Random(0)
+    alphabet = 'abAB서울대병원.*+?()[]^$|\\ '
+    series = pd.Series([''.join(random_generator.choices(alphabet, k=random_generator.randint(0, 12))) for _ in range(2000)], dtype=object)
+    index = build_substring_index(series, max_gram_size=3)
+    for _ in range(300):
+        query = ''.join(random_generator.choices(alphabet, k=random_generator.randint(1, 6)))
+        assert np.array_equal(search_substring(index, query), contains_mask(series, query)), query
+
+@pytest.mark.parametrize('text, bounds', [
+    ('2024', (20240000, 20249999)),
+    ('202402', (20240200, 20240299)),
+    ('20240229', (20240229, 20240229)),
+    ('2024-02-29', (20240229, 20240229)),
+    ('2024q1', (20240100, 20240399)),
+    ('2024Q4', (20241000, 20241299)),
+    (' 2024Q2 ', (20240400, 20240699)),
+])
+def test_parse_date_bound(text, bounds):
+    assert parse_date_bound(text) == bounds
+
+@pytest.mark.parametrize('text', ['', '202', '20241', '2024Q0', '2024Q5', '2024Q', 'abcd', '2024ab', '202413', '202400', '20240230', '20231301', '2024123100'])
+def test_parse_date_bound_rejects_invalid_input(text):
+    with pytest.raises(ValueError):
+        parse_date_bound(text)
+
+def test_parse_date_range():
+    assert parse_date_range('', '') is None
+    assert parse_date_range('2024', '') == (20240000, 20249999)
+    # To alone covers everything up to the end of its period, but never the missing (0) dates
+    assert parse_date_range('', '2024Q4') == (1, 20241299)
+    assert parse_date_range('2023Q4', '202402') == (20231000, 20240299)
+
+def date_range_rows(dates: list, date_from: str, date_to: str) -> list:
+    index = build_date_index(pd.Series(dates, dtype=object))
+    return np.flatnonzero(search_date_range(index, parse_date_range(date_from, date_to))).tolist()
+
+def test_quarter_end_includes_its_last_day():
+    dates = ['20240930', '20241001', '20241231', '20250101', None]
+    assert date_range_rows(dates, '2024Q4', '') == [1, 2]
+    assert date_range_rows(dates, '', '2024Q4') == [0, 1, 2]
+
+def test_month_end_includes_its_last_day():
+    dates = ['20240131', '20240201', '20240229', '20240301', '2024-02-15', 'invalid']
+    assert date_range_rows(dates, '202402', '') == [1, 2, 4]
+    assert date_range_rows(dates, '', '202402') == [0, 1, 2, 4]
+    assert date_range_rows(dates, '20240229', '') == [2]
@@ -0,0 +1,130 @@
+import glob
+import multiprocessing
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+from module.datasets import compact_dataframe
+from module.snapshot import get_snapshot_path, get_snapshot_prefix, load_snapshot, read_snapshot, remove_other_versions, write_snapshot
+
+OBJECT_URL = 'gs://bucket/trials.parquet'
+
+def make_dataframe(num_of_rows: int = 1000) -> pd.DataFrame:
+    return compact_dataframe(pd.DataFrame({
+        'Clinical Trial ID': [str(100000 + row) for row in range(num_of_rows)],
+        'Phase': [['1상', '2상', '3상', None][row % 4] for row in range(num_of_rows)],
+        'Sponsor': [f'Sponsor {row}' if row % 7 else None for row in range(num_of_rows)],
+    }, dtype=object))
+
+@pytest.fixture
+def snapshot_dir(tmp_path, monkeypatch):
+    directory = tmp_path / 'snapshots'
+    monkeypatch.setenv('SNAPSHOT_DIR', str(directory))
+    return directory
+
+def test_written_snapshot_is_mapped_back(tmp_path):
+    dataframe = make_dataframe()
+    file_path = str(tmp_path / 'trials.arrow')
+    write_snapshot(dataframe, file_path)
+    assert os.listdir(tmp_path) == ['trials.arrow']
+
+    snapshot = read_snapshot(file_path)
+    pd.testing.assert_frame_equal(snapshot, dataframe)
+    # Text stays Arrow strings over the mapped file, categoricals stay categoricals
+    assert snapshot['Sponsor'].dtype == pd.StringDtype('pyarrow')
+    assert isinstance(snapshot['Phase'].dtype, pd.CategoricalDtype)
+
+def test_load_snapshot_builds_a_version_once(snapshot_dir):
+    dataframe = make_dataframe()
+    builds = []
+    def build():
+        builds.append(1)
+        return dataframe
+
+    pd.testing.assert_frame_equal(load_snapshot('trials', OBJECT_URL, '1', None, build), dataframe)
+    pd.testing.assert_frame_equal(load_snapshot('trials', OBJECT_URL, '1', None, build), dataframe)
+    assert len(builds) == 1
+    # Other columns or another bucket are other snapshots
+    load_snapshot('trials', OBJECT_URL, '1', ['Sponsor'], lambda: dataframe[['Sponsor']])
+    load_snapshot('trials', 'gs://other/trials.parquet', '1', None, build)
+    assert len(builds) == 2
+    assert len(glob.glob(str(snapshot_dir / '*.arrow'))) == 3
+
+def test_without_a_directory_every_load_builds(monkeypatch):
+    monkeypatch.setenv('SNAPSHOT_DIR', '')
+    dataframe = make_dataframe(10)
+    builds = []
+    for _ in range(2):
+        assert load_snapshot('trials', OBJECT_URL, '1', None, lambda: builds.append(1) or dataframe) is dataframe
+    assert len(builds) == 2
+
+def test_new_version_removes_the_others(snapshot_dir):
+    dataframe = make_dataframe(10)
+    load_snapshot('trials', OBJECT_URL, '1', None, lambda: dataframe)
+    load_snapshot('trials', OBJECT_URL, '1', ['Sponsor'], lambda: dataframe[['Sponsor']])
+    prefix = get_snapshot_prefix(str(snapshot_dir), 'trials', OBJECT_URL)
+    old_path = get_snapshot_path(prefix, '1')
+    # A process still mapping the old version keeps reading it
+    old_snapshot = read_snapshot(old_path)
+
+    load_snapshot('trials', OBJECT_URL, '2', None, lambda: dataframe.iloc[:5])
+    assert not os.path.exists(old_path)
+    assert os.path.exists(get_snapshot_path(prefix, '2'))
+    # The snapshot of other columns is not another version
+    assert os.path.exists(get_snapshot_path(get_snapshot_prefix(str(snapshot_dir), 'trials', OBJECT_URL, ['Sponsor']), '1'))
+    assert old_snapshot.shape[0] == 10
+
+    remove_other_versions(prefix, get_snapshot_path(prefix, '2'))
+    assert len(glob.glob(f'{glob.escape(prefix)}.*.arrow')) == 1
+
+def write_repeatedly(file_path: str, num_of_rows: int, num_of_writes: int) -> None:
+    dataframe = make_dataframe(num_of_rows)
+    for _ in range(num_of_writes):
+        write_snapshot(dataframe, file_path)
+
+def test_concurrent_writers_replace_the_file_atomically(tmp_path):
+    file_path = str(tmp_path / 'trials.arrow')
+    write_snapshot(make_dataframe(2000), file_path)
+    context = multiprocessing.get_context('spawn')
+    # Processes and threads, frames of two sizes, all writing the same file
+    writers = [context.Process(target=write_repeatedly, args=(file_path, num_of_rows, 20)) for num_of_rows in (2000, 3000)]
+    writers += [threading.Thread(target=write_repeatedly, args=(file_path, num_of_rows, 20)) for num_of_rows in (2000, 3000)]
+    for writer in writers:
+        writer.start()
+
+    # A reader only ever maps a whole file
+    num_of_reads = 0
+    while any(writer.is_alive() for writer in writers):
+        assert read_snapshot(file_path).shape[0] in (2000, 3000)
+        num_of_reads += 1
+    for writer in writers:
+        writer.join()
+        assert getattr(writer, 'exitcode', 0) == 0
+    assert num_of_reads > 0
+    assert read_snapshot(file_path).shape[0] in (2000, 3000)
+    # No temporary file is left behind
+    assert os.listdir(tmp_path) == ['trials.arrow']
+
+def load_and_count(snapshot_dir: str, builds_path: str, results: multiprocessing.Queue) -> None:
+    os.environ['SNAPSHOT_DIR'] = snapshot_dir
+    def build():
+        with open(builds_path, 'a') as f:
+            f.write('build\n')
+        return make_dataframe()
+    results.put(load_snapshot('trials', OBJECT_URL, '1', None, build).shape[0])
+
+def test_concurrent_loaders_build_once(tmp_path):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    builds_path = str(tmp_path / 'builds.txt')
+    loaders = [context.Process(target=load_and_count, args=(str(tmp_path / 'snapshots'), builds_path, results)) for _ in range(4)]
+    for loader in loaders:
+        loader.start()
+    counts = [results.get(timeout=60) for _ in loaders]
+    for loader in loaders:
+        loader.join()
+    assert counts == [1000] * len(loaders)
+    with open(builds_path) as f:
+        assert f.read().count('build') == 1
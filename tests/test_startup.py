@@ -0,0 +1,8 @@
+from benchmarks.bench_startup import measure_startup
+from module.constants import *
+
+def test_startup_stays_within_budget():
+    # The median of a few fresh processes, a single cold import is too noisy to fail a build on
+    result = measure_startup(runs=3)
+    assert not result['lazy_modules_loaded'], f'{result["lazy_modules_loaded"]} are imported at startup'
+    assert result['median_seconds'] <= STARTUP_IMPORT_BUDGET_SECONDS, result
@@ -0,0 +1,69 @@
+import json
+
+import pandas as pd
+import pytest
+
+import module.storage as storage
+import module.utils as utils
+from module.constants import *
+from module.storage import open_storage, read_content_hash, update_data
+
+@pytest.fixture
+def conn(tmp_path):
+    return open_storage(str(tmp_path))
+
+@pytest.fixture
+def writes(monkeypatch):
+    '''Paths written by update_data.'''
+
+    written_paths = []
+    write_dataframe = storage.write_dataframe
+    def recording_write_dataframe(dataframe, f, *args, **kwargs):
+        written_paths.append(f.path)
+        return write_dataframe(dataframe, f, *args, **kwargs)
+    monkeypatch.setattr(storage, 'write_dataframe', recording_write_dataframe)
+    return written_paths
+
+def make_dataframe() -> pd.DataFrame:
+    return pd.DataFrame({'Clinical Trial ID': ['1', '2', '3'], 'Sponsor': ['한미약품', None, 'Celltrion']}, dtype=object)
+
+def test_unchanged_parquet_upload_is_skipped(conn, writes):
+    file_path = f'{GCS_BUCKET_NAME}/trials.parquet'
+    dataframe = make_dataframe()
+    assert update_data(dataframe, conn, file_path) == (Function_Status.SUCCESS, None)
+    assert len(writes) == 1
+    assert read_content_hash(conn, file_path) == storage.hash_dataframe(dataframe)
+
+    # The same values, also as another string dtype
+    assert update_data(dataframe.copy(), conn, file_path) == (Function_Status.SUCCESS, None)
+    assert update_data(dataframe.astype('string'), conn, file_path) == (Function_Status.SUCCESS, None)
+    assert len(writes) == 1
+
+    dataframe.loc[1, 'Sponsor'] = '종근당'
+    update_data(dataframe, conn, file_path)
+    assert len(writes) == 2
+    assert update_data(dataframe, conn, file_path, skip_unchanged=False) == (Function_Status.SUCCESS, None)
+    assert len(writes) == 3
+
+def test_jsonl_upload_is_always_written(conn, writes):
+    file_path = f'{GCS_BUCKET_NAME}/trials.json'
+    dataframe = make_dataframe()
+    update_data(dataframe, conn, file_path)
+    update_data(dataframe, conn, file_path)
+    assert len(writes) == 2
+    assert read_content_hash(conn, file_path) is None
+
+def test_api_call_logs_are_migrated_once(conn, monkeypatch):
+    monkeypatch.setattr(utils, '_api_call_logs_migrated', False)
+    with conn.open(f'{GCS_BUCKET_NAME}/api_call_logs.json', mode='wb') as f:
+        f.write(json.dumps({'date': '2024-01-02', 'time': '03:04:05'}).encode('utf-8'))
+
+    migrations = []
+    migrate_api_call_logs = utils.migrate_api_call_logs
+    monkeypatch.setattr(utils, 'migrate_api_call_logs', lambda conn: migrations.append(conn) or migrate_api_call_logs(conn))
+    assert utils.read_api_call_logs(conn).values.tolist() == [['2024-01-02', '03:04:05']]
+    assert not storage.get_filesystem(conn).exists(f'{GCS_BUCKET_NAME}/api_call_logs.json')
+
+    utils.append_api_call_log(conn, pd.DataFrame(columns=['date', 'time']), '2024-01-03T00:00:00')
+    assert utils.read_api_call_logs(conn).values.tolist() == [['2024-01-02', '03:04:05'], ['2024-01-03', '00:00:00']]
+    assert len(migrations) == 1
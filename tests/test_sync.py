@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import ingest
+import module.fetcher as fetcher
+import module.utils as utils
+from benchmarks.synthetic import make_medication_dataframe
+from module.constants import *
+from module.storage import open_storage, read_data
+
+@pytest.fixture
+def conn(tmp_path):
+    return open_storage(str(tmp_path))
+
+def test_full_sync_saves_every_row(mock_api, conn, status):
+    assert utils.sync_data(conn, MEDICATION_TRIAL_FILE_NAME, utils.fetch_medication_trial_data, status, full_refresh=True) == (Function_Status.SUCCESS, None)
+    assert read_data(conn, MEDICATION_TRIAL_FILE_NAME).shape[0] == 1000
+    assert not utils.is_full_refresh_due(conn, MEDICATION_TRIAL_FILE_NAME)
+
+@pytest.mark.parametrize('full_refresh', [True, False])
+def test_failed_pages_keep_the_stored_snapshot(mock_api, conn, status, page_requests, full_refresh):
+    utils.sync_data(conn, MEDICATION_TRIAL_FILE_NAME, utils.fetch_medication_trial_data, status, full_refresh=True)
+    stored_dataframe = read_data(conn, MEDICATION_TRIAL_FILE_NAME)
+    # Due for the weekly full fetch, which then fails part way
+    last_full_refresh = datetime.now(timezone.utc) - timedelta(days=FULL_REFRESH_MAX_AGE_DAYS + 1)
+    utils.write_last_full_refresh(conn, MEDICATION_TRIAL_FILE_NAME, last_full_refresh)
+
+    page_requests.failing.update({3, 7})
+    result, e = utils.sync_data(conn, MEDICATION_TRIAL_FILE_NAME, utils.fetch_medication_trial_data, status, full_refresh=full_refresh)
+    assert result == Function_Status.FAIL
+    assert isinstance(e, fetcher.IncompleteFetchError)
+    assert '2 of 10 pages' in str(e)
+    assert read_data(conn, MEDICATION_TRIAL_FILE_NAME).equals(stored_dataframe)
+    assert utils.read_last_full_refresh(conn, MEDICATION_TRIAL_FILE_NAME) == last_full_refresh
+
+def test_failed_pages_with_a_flaky_api(mock_api, conn, status, monkeypatch):
+    utils.sync_data(conn, MEDICATION_TRIAL_FILE_NAME, utils.fetch_medication_trial_data, status, full_refresh=True)
+    stored_dataframe = read_data(conn, MEDICATION_TRIAL_FILE_NAME)
+
+    mock_api.failure_rate = 0.75
+    monkeypatch.setattr(fetcher, 'MAX_RETRIES', 0)
+    result, e = utils.sync_data(conn, MEDICATION_TRIAL_FILE_NAME, utils.fetch_medication_trial_data, status, full_refresh=True)
+    assert result == Function_Status.FAIL
+    assert read_data(conn, MEDICATION_TRIAL_FILE_NAME).equals(stored_dataframe)
+
+def sort_by_key(dataframe: pd.DataFrame) -> pd.DataFrame:
+    return dataframe.astype(str).sort_values(MEDICATION_STUDY_KEY_COLUMN_NAME).reset_index(drop=True)
+
+@pytest.fixture
+def synced(mock_api, conn, status):
+    '''A complete snapshot of the mock API's medication trials, fully fetched a day ago.'''
+
+    utils.sync_data(conn, MEDICATION_TRIAL_FILE_NAME, utils.fetch_medication_trial_data, status, full_refresh=True)
+    last_full_refresh = datetime.now(timezone.utc) - timedelta(days=1)
+    utils.write_last_full_refresh(conn, MEDICATION_TRIAL_FILE_NAME, last_full_refresh)
+    # The rows the mock API serves, newest approval first
+    served_dataframe = make_medication_dataframe(1000, realistic=True).sort_values('IND Approval Date', ascending=False, kind='stable')
+    return served_dataframe, last_full_refresh
+
+def test_delta_sync_merges_new_and_edited_rows(mock_api, conn, status, synced):
+    served_dataframe, last_full_refresh = synced
+    new_dataframe = served_dataframe.head(5).copy()
+    new_dataframe['Clinical Trial ID'] = [f'9{position:05d}' for position in range(5)]
+    new_dataframe['IND Approval Date'] = '20991231'
+    edited_dataframe = served_dataframe.copy()
+    edited_id = edited_dataframe['Clinical Trial ID'].iloc[3]
+    edited_dataframe.loc[edited_dataframe['Clinical Trial ID'] == edited_id, 'Phase'] = '3상'
+    served_dataframe = pd.concat([new_dataframe, edited_dataframe], ignore_index=True)
+    mock_api.set_dataset(MEDICATION_TRIAL_URL, served_dataframe)
+
+    num_of_requests = mock_api.num_of_requests
+    assert utils.sync_data(conn, MEDICATION_TRIAL_FILE_NAME, utils.fetch_medication_trial_data, status) == (Function_Status.SUCCESS, None)
+    # The count and the first pages only, not all 10
+    assert mock_api.num_of_requests - num_of_requests <= 3
+    stored_dataframe = read_data(conn, MEDICATION_TRIAL_FILE_NAME)
+    assert stored_dataframe.shape[0] == 1005
+    assert sort_by_key(stored_dataframe).equals(sort_by_key(served_dataframe))
+    assert stored_dataframe.loc[stored_dataframe['Clinical Trial ID'] == edited_id, 'Phase'].tolist() == ['3상']
+    # Not a full fetch, so the weekly one stays due at the same time
+    assert utils.read_last_full_refresh(conn, MEDICATION_TRIAL_FILE_NAME) == last_full_refresh
+
+def test_unchanged_delta_sync_keeps_the_snapshot(mock_api, conn, status, synced):
+    _, last_full_refresh = synced
+    stored_dataframe = read_data(conn, MEDICATION_TRIAL_FILE_NAME)
+    assert utils.sync_data(conn, MEDICATION_TRIAL_FILE_NAME, utils.fetch_medication_trial_data, status) == (Function_Status.SUCCESS, None)
+    assert 'No new or changed trials since the last update.' in status.messages
+    assert read_data(conn, MEDICATION_TRIAL_FILE_NAME).equals(stored_dataframe)
+    assert utils.read_last_full_refresh(conn, MEDICATION_TRIAL_FILE_NAME) == last_full_refresh
+
+def test_delta_count_mismatch_falls_back_to_a_full_fetch(mock_api, conn, status, synced):
+    served_dataframe, last_full_refresh = synced
+    # An old trial deleted past the pages the delta reads
+    served_dataframe = served_dataframe.iloc[:-1]
+    mock_api.set_dataset(MEDICATION_TRIAL_URL, served_dataframe)
+
+    assert utils.sync_data(conn, MEDICATION_TRIAL_FILE_NAME, utils.fetch_medication_trial_data, status) == (Function_Status.SUCCESS, None)
+    assert any(message.startswith('Merged 1000 trials but the API has 999.') for message in status.messages)
+    stored_dataframe = read_data(conn, MEDICATION_TRIAL_FILE_NAME)
+    assert sort_by_key(stored_dataframe).equals(sort_by_key(served_dataframe))
+    # The fallback fetched every page, which counts as the weekly full fetch
+    assert utils.read_last_full_refresh(conn, MEDICATION_TRIAL_FILE_NAME) > last_full_refresh
+
+def test_dry_run_plans_the_due_full_fetch(mock_api, conn, status, synced, tmp_path):
+    _, last_full_refresh = synced
+    dataset = {**ingest.DATASETS['medication'], 'url': utils.MEDICATION_TRIAL_URL}
+    args = SimpleNamespace(full=False, checkpoint_dir=str(tmp_path / 'checkpoints'))
+    plan = ingest.plan_dataset(conn, dataset, args)
+    assert plan['mode'] == 'incremental'
+    assert plan['last_full_refresh'] == last_full_refresh.isoformat()
+
+    utils.write_last_full_refresh(conn, MEDICATION_TRIAL_FILE_NAME, last_full_refresh - timedelta(days=FULL_REFRESH_MAX_AGE_DAYS))
+    assert ingest.plan_dataset(conn, dataset, args)['mode'] == 'full'
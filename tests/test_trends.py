@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import module.trends as trends
+from benchmarks.synthetic import make_device_dataframe, make_medication_dataframe
+from module.constants import *
+from module.storage import open_storage, read_derived_table
+from module.trends import TREND_CUBE_DATASETS, build_trend_cube, get_cube_columns, get_trend_cube_path, update_trend_cube
+
+DATAFRAMES = {
+    MEDICATION_TRIAL_FILE_NAME: lambda: make_medication_dataframe(2000, realistic=True),
+    DEVICE_TRIAL_FILE_NAME: lambda: make_device_dataframe(1000),
+}
+
+def change_trials(dataframe: pd.DataFrame, file_name: str, round_no: int, random_generator: np.random.Generator) -> pd.DataFrame:
+    '''Add, edit and delete trials the way a sync does.'''
+
+    spec = TREND_CUBE_DATASETS[file_name]
+    dataframe = dataframe.reset_index(drop=True)
+
+    # New trials, copies of existing ones under new keys
+    added = dataframe.sample(50, random_state=round_no).copy()
+    for column in spec['key_columns']:
+        added[column] = [f'new-{round_no}-{position}' for position in range(added.shape[0])]
+
+    edited = dataframe.copy()
+    changed_rows = random_generator.choice(edited.shape[0], 200, replace=False)
+    other_rows = random_generator.choice(edited.shape[0], 200)
+    # Other months, unknown dates, other phases and other entities (e.g. sites added or dropped)
+    for column in ['IND Approval Date', 'Phase', *spec['entity_columns']]:
+        if column in edited:
+            edited.loc[changed_rows, column] = edited.loc[other_rows, column].to_numpy()
+    edited.loc[changed_rows[:20], 'IND Approval Date'] = None
+    edited.loc[changed_rows[20:30], 'IND Approval Date'] = 'unknown'
+
+    deleted_rows = random_generator.choice(edited.shape[0], 30, replace=False)
+    return pd.concat([added, edited.drop(index=deleted_rows)], ignore_index=True)
+
+def sort_cube(cube: pd.DataFrame) -> pd.DataFrame:
+    cube = cube.astype({'Cuboid': str, 'Month': np.int64, 'Phase': str, 'Entity': str, 'Count': np.int64})
+    return cube.sort_values(trends.TREND_CUBE_DIMENSIONS).reset_index(drop=True)
+
+@pytest.mark.parametrize('file_name', list(DATAFRAMES))
+def test_incremental_cube_equals_a_rebuild(tmp_path, monkeypatch, file_name):
+    stages = []
+    monkeypatch.setattr(trends, 'record', lambda stage, *args: stages.append(stage))
+    conn = open_storage(str(tmp_path))
+    spec = TREND_CUBE_DATASETS[file_name]
+    random_generator = np.random.default_rng(0)
+
+    dataframe = DATAFRAMES[file_name]()
+    update_trend_cube(conn, file_name, dataframe, 'v0')
+    assert stages == []
+    for round_no in range(1, 4):
+        stored_dataframe = dataframe
+        dataframe = change_trials(stored_dataframe, file_name, round_no, random_generator)
+        update_trend_cube(conn, file_name, dataframe, f'v{round_no}', stored_dataframe, f'v{round_no - 1}')
+        assert stages.count('trends.cube_delta') == round_no
+
+        cube, source_version = read_derived_table(conn, get_trend_cube_path(file_name))
+        assert source_version == f'v{round_no}'
+        rebuilt_cube = build_trend_cube(dataframe[get_cube_columns(file_name)], spec['entity_columns'])
+        pd.testing.assert_frame_equal(sort_cube(cube), sort_cube(rebuilt_cube))
+
+def test_cube_of_another_version_is_rebuilt(tmp_path, monkeypatch):
+    stages = []
+    monkeypatch.setattr(trends, 'record', lambda stage, *args: stages.append(stage))
+    conn = open_storage(str(tmp_path))
+    dataframe = make_medication_dataframe(500, realistic=True)
+    update_trend_cube(conn, MEDICATION_TRIAL_FILE_NAME, dataframe, 'v0')
+
+    # The stored cube describes v0, not the v1 the sync started from, so no delta applies
+    new_dataframe = change_trials(dataframe, MEDICATION_TRIAL_FILE_NAME, 1, np.random.default_rng(0))
+    update_trend_cube(conn, MEDICATION_TRIAL_FILE_NAME, new_dataframe, 'v2', dataframe, 'v1')
+    assert stages == []
+    cube, _ = read_derived_table(conn, get_trend_cube_path(MEDICATION_TRIAL_FILE_NAME))
+    rebuilt_cube = build_trend_cube(new_dataframe[get_cube_columns(MEDICATION_TRIAL_FILE_NAME)], MEDICATION_STUDY_ENTITY_COLUMN_NAME)
+    pd.testing.assert_frame_equal(sort_cube(cube), sort_cube(rebuilt_cube))